@@ -0,0 +1,144 @@
+import math
+import numpy as np
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from models.base_module import BaseModel
+from inferences.result_matrix import ModelOutputs, ResultMatrix
+from metrics.reference_index import load_reference_index
+from metrics.sample_metrics import rouge_group_scores
+from rankings.functions import significance_ranks
+
+# Sequential evaluation: prompts are scored in rounds of a shuffled order, and a model stops being
+# queried once its confidence interval is separated from every other model's interval, i.e. once
+# its rank can no longer change. The interval level is corrected for every model and every round
+# (union bound), so looking at the intervals after each round keeps the chosen confidence overall.
+
+ROUGE_METRICS = {'rouge1': 'rouge1', 'rouge2': 'rouge2', 'rougel': 'rougeL', 'rougelsum': 'rougeLsum'}
+
+def confidence_bounds(sums: np.ndarray, squared_sums: np.ndarray, counts: np.ndarray, z: float, score_range: Tuple[float, float] = (0.0, 1.0)) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  # Wilson score intervals on scores rescaled to [0, 1], with the sample variance in place of the
+  # Bernoulli p(1 - p) (equal to it for 0/1 scores). Unlike a normal interval, a model with identical
+  # scores so far, e.g. all correct, still gets an interval of width ~z^2/n instead of a single point.
+  low, high = score_range
+  scale = high - low
+  safe_counts = np.maximum(counts, 1)
+  means = sums / safe_counts
+  variances = np.maximum(squared_sums - safe_counts * means ** 2, 0) / np.maximum(counts - 1, 1) / scale ** 2
+  proportions = (means - low) / scale
+  shrink = 1 + z ** 2 / safe_counts
+  centers = (proportions + z ** 2 / (2 * safe_counts)) / shrink
+  half_widths = np.where(counts > 1, z / shrink * np.sqrt(variances / safe_counts + z ** 2 / (4 * safe_counts ** 2)), np.inf)
+  return means, low + scale * np.clip(centers - half_widths, 0, 1), low + scale * np.clip(centers + half_widths, 0, 1)
+
+def resolved_pairs(lows: np.ndarray, highs: np.ndarray, tolerance: float = 0.0) -> np.ndarray:
+  # (models, models): the order of the two models is settled, either because their intervals do not
+  # overlap or because both intervals fit within `tolerance` and the models count as tied
+  disjoint = (lows[:, None] > highs[None, :]) | (highs[:, None] < lows[None, :])
+  indifferent = np.maximum(highs[:, None], highs[None, :]) - np.minimum(lows[:, None], lows[None, :]) <= tolerance
+  return disjoint | indifferent
+
+def adaptive_evaluation(num_prompts: int, num_models: int, score_batch: Callable[[int, List[int]], Sequence[float]], round_size: int = 50, confidence: float = 0.95, tolerance: float = 0.0, min_samples: Optional[int] = None, seed: int = 0, max_workers: Optional[int] = None, score_range: Tuple[float, float] = (0.0, 1.0)) -> Dict[str, Any]:
+  # score_batch(model_index, prompt_indices) runs the model on those prompts and returns one score per
+  # prompt, within score_range (e.g. (-1, 1) for truthfulness differences)
+  if round_size < 1:
+    raise ValueError("round_size must be at least 1.")
+  if not score_range[0] < score_range[1]:
+    raise ValueError("score_range must be an increasing (low, high) pair.")
+  min_samples = round_size if min_samples is None else min_samples
+  order = np.random.default_rng(seed).permutation(num_prompts)
+  num_rounds = max(math.ceil(num_prompts / round_size), 1)
+  z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * max(num_models, 1) * num_rounds))
+
+  sums = np.zeros(num_models)
+  squared_sums = np.zeros(num_models)
+  counts = np.zeros(num_models)
+  active = np.ones(num_models, dtype=bool)
+  stopped_rounds = np.full(num_models, num_rounds)
+  prompt_indices: List[List[int]] = [[] for _ in range(num_models)]
+  sample_scores: List[List[float]] = [[] for _ in range(num_models)]
+  means, lows, highs = confidence_bounds(sums, squared_sums, counts, z, score_range)
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    for round_index in range(num_rounds):
+      active_models = np.flatnonzero(active)
+      if len(active_models) == 0:
+        break
+      batch = order[round_index * round_size:(round_index + 1) * round_size].tolist()
+      futures = {model_index: executor.submit(score_batch, int(model_index), batch) for model_index in active_models}
+
+      for model_index, future in futures.items():
+        scores = np.asarray(future.result(), dtype=np.float64)
+        if len(scores) != len(batch):
+          raise ValueError("score_batch must return one score per prompt.")
+        if np.any((scores < score_range[0]) | (scores > score_range[1])):
+          raise ValueError(f"score_batch returned scores outside score_range {score_range}.")
+        sums[model_index] += scores.sum()
+        squared_sums[model_index] += (scores ** 2).sum()
+        counts[model_index] += len(scores)
+        prompt_indices[model_index].extend(batch)
+        sample_scores[model_index].extend(scores.tolist())
+
+      means, lows, highs = confidence_bounds(sums, squared_sums, counts, z, score_range)
+      resolved = resolved_pairs(lows, highs, tolerance)
+      np.fill_diagonal(resolved, True)
+      settled = resolved.all(axis=1) & (counts >= min_samples)
+      stopped_rounds[active & settled] = round_index + 1
+      active &= ~settled
+
+  disjoint = (lows[:, None] > highs[None, :]) | (highs[:, None] < lows[None, :])
+  return {
+    'score': means.tolist(),
+    'ci_low': lows.tolist(),
+    'ci_high': highs.tolist(),
+    'ranks': significance_ranks(means, disjoint).tolist(),
+    'settled': (~active).tolist(),
+    'stopped_round': stopped_rounds.tolist(),
+    'num_samples': counts.astype(int).tolist(),
+    'calls': int(counts.sum()),
+    'full_calls': num_prompts * num_models,
+    'prompt_indices': prompt_indices,
+    'sample_scores': sample_scores,
+  }
+
+def batch_inference(inference_function: Callable[..., ResultMatrix], prompts: List[str], **prompt_inputs: List[Any]) -> Callable[[List[int], BaseModel], ModelOutputs]:
+  # Runs one of `inferences.functions` for a single model on a subset of the prompts, e.g.
+  # batch_inference(translate, prompts, src_langs=src_langs, tgt_langs=tgt_langs)
+  def infer(prompt_indices: List[int], model: BaseModel) -> ModelOutputs:
+    inputs = {name: [values[i] for i in prompt_indices] for name, values in prompt_inputs.items()}
+    return inference_function(prompts=[prompts[i] for i in prompt_indices], models=[model], **inputs)[0]
+  return infer
+
+def rouge_scorer(references: List[List[str]], metric: str = 'rougel') -> Callable[[int, str], float]:
+  if metric not in ROUGE_METRICS:
+    raise ValueError(f"Unknown metric: {metric}. Expected one of {', '.join(ROUGE_METRICS)}.")
+  index = load_reference_index(references, tokenizer="rouge", max_order=2)
+  return lambda prompt_index, output: rouge_group_scores(output, index, prompt_index)[ROUGE_METRICS[metric]]
+
+def evaluate_adaptively(models: List[BaseModel], infer: Callable[[List[int], BaseModel], Sequence[str]], score_sample: Callable[[int, str], float], num_prompts: int, **kwargs: Any) -> Tuple[ResultMatrix, Dict[str, Any]]:
+  # Outputs of prompts a model was never queried on stay None
+  models_outputs = ResultMatrix(len(models), num_prompts)
+
+  def score_batch(model_index: int, prompt_indices: List[int]) -> List[float]:
+    outputs = infer(prompt_indices, models[model_index])
+    latencies = outputs.latencies.tolist() if isinstance(outputs, ModelOutputs) else [None] * len(outputs)
+    for prompt_index, output, latency in zip(prompt_indices, outputs, latencies):
+      models_outputs.set(model_index, prompt_index, output, latency)
+    return [score_sample(prompt_index, output) for prompt_index, output in zip(prompt_indices, outputs)]
+
+  return models_outputs, adaptive_evaluation(num_prompts, len(models), score_batch, **kwargs)
+
+if __name__ == "__main__":
+  # Simulated models answering correctly with different probabilities, so no API calls are made
+  accuracies = [0.85, 0.80, 0.60, 0.55, 0.30]
+  num_prompts = 5000
+  outcomes = np.random.default_rng(42).random((len(accuracies), num_prompts)) < np.asarray(accuracies)[:, None]
+
+  def score_batch(model_index: int, prompt_indices: List[int]) -> List[float]:
+    return outcomes[model_index, prompt_indices].astype(float).tolist()
+
+  result = adaptive_evaluation(num_prompts, len(accuracies), score_batch, round_size=100, confidence=0.95)
+
+  for model_index, accuracy in enumerate(accuracies):
+    print(f"Model {model_index} (True Accuracy {accuracy}): Score {result['score'][model_index]:.3f}, CI [{result['ci_low'][model_index]:.3f}, {result['ci_high'][model_index]:.3f}], Rank {result['ranks'][model_index]}, Samples {result['num_samples'][model_index]}, Settled {result['settled'][model_index]}")
+  print(f"Calls: {result['calls']} of {result['full_calls']}")
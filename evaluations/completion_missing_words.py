@@ -1,43 +1,19 @@
-from models.openai_module import OpenAIModel
-from models.anthropic_module import AnthropicModel
-from models.cohere_module import CohereModel
-from models.groq_module import GroqModel
-from models.google_generative_ai_module import GoogleGenerativeAIModel
-from models.google_vertex_ai_module import GoogleVertexAIModel
-from inferences.functions import complete_missing_word
-from metrics.base_metrics import calc_missing_words_accuracy
-from typing import List, Dict, Tuple
-
-def evaluate_completion_missing_word(prompts: List[str], references: List[List[str]], answers: List[str], model_details: List[Dict[str, str]], evaluation_details: List[str]) -> Tuple[List[List[str]], Dict[str, List[float]]]:
-  models = []
-
-  for model_detail in model_details:
-    if model_detail["source"] == "openai":
-      models.append(OpenAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "anthropic":
-      models.append(AnthropicModel(model=model_detail["model"]))
-    elif model_detail["source"] == "cohere":
-      models.append(CohereModel(model=model_detail["model"]))
-    elif model_detail["source"] == "groq":
-      models.append(GroqModel(model=model_detail["model"]))
-    elif model_detail["source"] == "genai":
-      models.append(GoogleGenerativeAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "vertexai":
-      models.append(GoogleVertexAIModel(model=model_detail["model"]))
-    
-  all_results = complete_missing_word(
-    prompts=prompts,
-    models=models,
-    missing_words=references,
-  )
-
-  models_completions = [[None for _ in prompts] for _ in models]
-
-  for prompt_results in all_results:
-    for prompt_index, model_index, completion in prompt_results:
-      models_completions[model_index][prompt_index] = completion
+from models.registry import load_models
+from inferences.functions import complete_missing_word, complete_missing_word_by_logprobs, sample
+from inferences.packing import packed_complete_missing_word
+from inferences.result_matrix import ResultMatrix
+from evaluations.sampling import score_samples
+from metrics.base_metrics import calc_missing_words_accuracy, calc_missing_words_sample_scores
+from metrics.sampling import pass_at_k_scores
+from typing import List, Dict, Tuple, Optional, Union
 
+# 'generate' compares the generated word with the answer; 'logprobs' picks the most probable option from
+# one output token per item (on providers without log probabilities, the generated word matched to an option)
+SCORING_MODES = ('generate', 'logprobs')
+
+def score_completion_missing_word(models_completions: ResultMatrix, references: List[List[str]], answers: List[str], evaluation_details: List[str], return_sample_scores: bool = False) -> Tuple[Dict[str, List[float]], Dict[str, List[List[float]]]]:
   evaluations = {}
+  sample_evaluations = {}
 
   if 'accuracy' in evaluation_details:
     missing_words_accuracies = []
@@ -45,6 +21,55 @@ def evaluate_completion_missing_word(prompts: List[str], references: List[List[s
       missing_words_accuracy = calc_missing_words_accuracy(model_completions, references, answers)
       missing_words_accuracies.append(missing_words_accuracy['accuracy'])
     evaluations['accuracy'] = missing_words_accuracies
+    if return_sample_scores:
+      sample_evaluations['accuracy'] = [calc_missing_words_sample_scores(model_completions, references, answers) for model_completions in models_completions]
+
+  return evaluations, sample_evaluations
+
+def evaluate_completion_missing_word(prompts: List[str], references: List[List[str]], answers: List[str], model_details: List[Dict[str, str]], evaluation_details: List[str], return_sample_scores: bool = False, pack_size: Optional[int] = None, scoring_mode: str = 'generate', n_samples: int = 1) -> Union[Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]]], Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]], Dict[str, List[List[float]]]]]:
+  models = load_models(model_details)
+
+  if scoring_mode not in SCORING_MODES:
+    raise ValueError(f"Unknown scoring_mode: {scoring_mode}. Expected one of {', '.join(SCORING_MODES)}.")
+  if scoring_mode == 'logprobs' and pack_size is not None and pack_size > 1:
+    raise ValueError("pack_size cannot be combined with scoring_mode='logprobs'.")
+  if n_samples > 1 and (scoring_mode == 'logprobs' or (pack_size is not None and pack_size > 1)):
+    raise ValueError("n_samples cannot be combined with pack_size or scoring_mode='logprobs'.")
+
+  models_probabilities = None
+  if n_samples > 1:
+    # One ResultMatrix per sample; see inferences.functions.sample
+    models_completions = sample('complete_missing_word', [prompts, references], models, n_samples)
+  elif scoring_mode == 'logprobs':
+    models_completions, models_probabilities = complete_missing_word_by_logprobs(prompts=prompts, models=models, missing_words=references)
+  elif pack_size is not None and pack_size > 1:
+    # Several prompts per request; see inferences.packing.PACK_SIZES
+    models_completions = packed_complete_missing_word(prompts=prompts, models=models, missing_words=references, pack_size=pack_size)
+  else:
+    models_completions = complete_missing_word(
+      prompts=prompts,
+      models=models,
+      missing_words=references,
+    )
+
+  if n_samples > 1:
+    evaluations, sample_evaluations = score_samples(score_completion_missing_word, models_completions, return_sample_scores=return_sample_scores, references=references, answers=answers, evaluation_details=evaluation_details)
+    if 'accuracy' in evaluation_details:
+      # Chance that at least one of k samples is the answer, for one sample and for all of them
+      correct = [[calc_missing_words_sample_scores(model_completions, references, answers) for model_completions in sample_completions] for sample_completions in models_completions]
+      evaluations.update(pass_at_k_scores(correct, sorted({1, n_samples})))
+  else:
+    evaluations, sample_evaluations = score_completion_missing_word(models_completions, references, answers, evaluation_details, return_sample_scores)
+
+  if models_probabilities is not None:
+    # Probability the model puts on the correct option, a smoother signal than accuracy
+    models_answer_probabilities = [[probabilities[answer - 1] for probabilities, answer in zip(model_probabilities, answers)] for model_probabilities in models_probabilities]
+    evaluations['answer_probability'] = [sum(scores) / len(scores) if scores else 0.0 for scores in models_answer_probabilities]
+    if return_sample_scores:
+      sample_evaluations['answer_probability'] = models_answer_probabilities
+
+  if return_sample_scores:
+    return models_completions, evaluations, sample_evaluations
 
   return models_completions, evaluations
 
@@ -1,42 +1,14 @@
-from models.openai_module import OpenAIModel
-from models.anthropic_module import AnthropicModel
-from models.cohere_module import CohereModel
-from models.groq_module import GroqModel
-from models.google_generative_ai_module import GoogleGenerativeAIModel
-from models.google_vertex_ai_module import GoogleVertexAIModel
-from inferences.functions import complete_sentence
-from metrics.base_metrics import calc_rouge_score
-from typing import List, Dict, Tuple
-
-def evaluate_completion_sentence(prompts: List[str], references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str]) -> Tuple[List[List[str]], Dict[str, List[float]]]:
-  models = []
-
-  for model_detail in model_details:
-    if model_detail["source"] == "openai":
-      models.append(OpenAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "anthropic":
-      models.append(AnthropicModel(model=model_detail["model"]))
-    elif model_detail["source"] == "cohere":
-      models.append(CohereModel(model=model_detail["model"]))
-    elif model_detail["source"] == "groq":
-      models.append(GroqModel(model=model_detail["model"]))
-    elif model_detail["source"] == "genai":
-      models.append(GoogleGenerativeAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "vertexai":
-      models.append(GoogleVertexAIModel(model=model_detail["model"]))
-    
-  all_results = complete_sentence(
-    prompts=prompts,
-    models=models
-  )
-
-  models_completions = [[None for _ in prompts] for _ in models]
-
-  for prompt_results in all_results:
-    for prompt_index, model_index, completion in prompt_results:
-      models_completions[model_index][prompt_index] = completion
+from models.registry import load_models
+from inferences.functions import complete_sentence, sample
+from inferences.result_matrix import ResultMatrix
+from evaluations.sampling import score_samples
+from metrics.base_metrics import calc_rouge_score, calc_rouge_sample_scores
+from metrics.metric_cache import MetricCache
+from typing import List, Dict, Tuple, Optional, Union
 
+def score_completion_sentence(models_completions: ResultMatrix, references: List[List[str]], evaluation_details: List[str], metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False) -> Tuple[Dict[str, List[float]], Dict[str, List[List]]]:
   evaluations = {}
+  sample_evaluations = {}
 
   if 'rouge' in evaluation_details:
     rouge1_scores = []
@@ -45,7 +17,7 @@ def evaluate_completion_sentence(prompts: List[str], references: List[List[str]]
     rougeLsum_scores = []
 
     for model_completions in models_completions:
-      rouge_score = calc_rouge_score(model_completions, references)
+      rouge_score = calc_rouge_score(model_completions, references, cache=metric_cache)
       rouge1_scores.append(rouge_score['rouge1'])
       rouge2_scores.append(rouge_score['rouge2'])
       rougeL_scores.append(rouge_score['rougeL'])
@@ -56,6 +28,33 @@ def evaluate_completion_sentence(prompts: List[str], references: List[List[str]]
     evaluations['rougel'] = rougeL_scores
     evaluations['rougelsum'] = rougeLsum_scores
 
+    if return_sample_scores:
+      models_rouge_samples = [calc_rouge_sample_scores(outputs, references, cache=metric_cache) for outputs in models_completions]
+      for rouge_type, metric in [('rouge1', 'rouge1'), ('rouge2', 'rouge2'), ('rougeL', 'rougel'), ('rougeLsum', 'rougelsum')]:
+        sample_evaluations[metric] = [rouge_samples[rouge_type] for rouge_samples in models_rouge_samples]
+
+  return evaluations, sample_evaluations
+
+def evaluate_completion_sentence(prompts: List[str], references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str], metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False, n_samples: int = 1) -> Union[Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]]], Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]], Dict[str, List[List[float]]]]]:
+  models = load_models(model_details)
+
+  if n_samples > 1:
+    # One ResultMatrix per sample; see inferences.functions.sample
+    models_completions = sample('complete_sentence', [prompts], models, n_samples)
+  else:
+    models_completions = complete_sentence(
+      prompts=prompts,
+      models=models
+    )
+
+  if n_samples > 1:
+    evaluations, sample_evaluations = score_samples(score_completion_sentence, models_completions, return_sample_scores=return_sample_scores, references=references, evaluation_details=evaluation_details, metric_cache=metric_cache)
+  else:
+    evaluations, sample_evaluations = score_completion_sentence(models_completions, references, evaluation_details, metric_cache, return_sample_scores)
+
+  if return_sample_scores:
+    return models_completions, evaluations, sample_evaluations
+
   return models_completions, evaluations
 
 if __name__ == "__main__":
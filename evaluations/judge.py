@@ -0,0 +1,181 @@
+import re
+import itertools
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from models.base_module import BaseModel
+from inferences.functions import call
+from metrics.metric_cache import MetricCache, sample_key
+from rankings.bradley_terry import BradleyTerryLeaderboard, win_probabilities
+
+# Pairwise LLM-as-judge evaluation. Instead of judging every pair of models on every prompt, each
+# round pairs models whose order is still uncertain (Swiss pairing of neighbours in the current
+# ranking, or active pairing by expected information) and judges them on a few prompts. Every
+# comparison is judged in both positions to cancel the judge's position bias, and verdicts are cached
+# so re-running a leaderboard with one new model only judges the new pairs.
+
+TASK_INSTRUCTIONS = {
+  'translation': "Which response is the more accurate and fluent translation of the text?",
+  'summarization': "Which response is the more faithful, complete and concise summary of the text?",
+  'qanda': "Which response answers the question more truthfully and helpfully?",
+  'completion_sentence': "Which response completes the sentence more naturally and correctly?",
+}
+
+JUDGE_PROMPT_TEMPLATE = """Instruction:
+- {instruction}
+- Answer with A, B or TIE only.
+
+Text:
+{prompt}
+
+Response A:
+{output_a}
+
+Response B:
+{output_b}
+"""
+
+# A line holding only the verdict (e.g. "B", "**TIE**", "Response A."), optionally after a label such
+# as "Verdict:"; free text merely starting with "A" ("A great answer ...") is not a verdict
+VERDICT_LINE = re.compile(r"^\W*(?:(?:VERDICT|ANSWER|WINNER|FINAL ANSWER)\W*)?(?:RESPONSE\s+)?(TIE|A|B)\W*$", re.MULTILINE)
+
+def parse_verdict(text: str) -> Optional[float]:
+  # 1.0 if response A won, 0.0 if B won, 0.5 for a tie, None if the judge did not give a verdict;
+  # the last verdict line wins, so a judge reasoning before answering is still parsed
+  matches = VERDICT_LINE.findall(text.upper())
+  if not matches:
+    return None
+  return {'A': 1.0, 'B': 0.0, 'TIE': 0.5}[matches[-1]]
+
+def swiss_pairs(strengths: np.ndarray, round_index: int) -> List[Tuple[int, int]]:
+  # Neighbours in the current ranking, shifted by one every other round so the boundaries move
+  order = np.argsort(-strengths, kind='stable').tolist()
+  offset = round_index % 2
+  return [(order[i], order[i + 1]) for i in range(offset, len(order) - 1, 2)]
+
+def active_pairs(strengths: np.ndarray, games: np.ndarray, num_pairs: int) -> List[Tuple[int, int]]:
+  # Pairs whose outcome is closest to a coin flip and that were compared the least
+  probabilities = win_probabilities(strengths)
+  uncertainty = probabilities * probabilities.T / (1 + games)
+  rows, cols = np.triu_indices(len(strengths), k=1)
+  best = np.argsort(-uncertainty[rows, cols], kind='stable')[:num_pairs]
+  return [(int(rows[i]), int(cols[i])) for i in best]
+
+class PairwiseJudge:
+  """A `BaseModel` judging pairs of outputs, with verdicts cached per (judge, prompt, ordered outputs)."""
+
+  def __init__(self, judge: BaseModel, task: str = 'summarization', cache: Optional[MetricCache] = None):
+    if task not in TASK_INSTRUCTIONS:
+      raise ValueError(f"Unknown task: {task}. Expected one of {', '.join(TASK_INSTRUCTIONS)}.")
+    self.judge = judge
+    self.task = task
+    self.cache = cache if cache is not None else MetricCache(":memory:")
+    self.judge_calls = 0
+
+  def judge_pairs(self, comparisons: List[Tuple[str, str, str]]) -> List[float]:
+    # comparisons: (prompt, output a, output b) -> P(a is better), averaged over both positions
+    ordered = [(prompt, first, second) for prompt, a, b in comparisons for first, second in [(a, b), (b, a)]]
+    keys = [sample_key('judge', prompt, [first, second], {'judge': str(self.judge), 'task': self.task}) for prompt, first, second in ordered]
+    verdicts = self.cache.get_many(keys)
+
+    missing = [i for i, key in enumerate(keys) if key not in verdicts]
+    missing = list({keys[i]: i for i in missing}.values())
+    if missing:
+      judge_prompts = [
+        JUDGE_PROMPT_TEMPLATE.format(instruction=TASK_INSTRUCTIONS[self.task], prompt=ordered[i][0], output_a=ordered[i][1], output_b=ordered[i][2])
+        for i in missing
+      ]
+      judge_outputs = call(prompts=judge_prompts, models=[self.judge])[0]
+      self.judge_calls += len(judge_prompts)
+      computed = {}
+      for i, output in zip(missing, judge_outputs):
+        verdict = parse_verdict(output or "")
+        # An unparseable (or failed) verdict counts as a tie for this run but is not cached, so it is judged again next time
+        if verdict is not None:
+          computed[keys[i]] = verdict
+        verdicts[keys[i]] = 0.5 if verdict is None else verdict
+      if computed:
+        self.cache.put_many(computed)
+
+    return [(verdicts[keys[2 * i]] + 1 - verdicts[keys[2 * i + 1]]) / 2 for i in range(len(comparisons))]
+
+def evaluate_with_judge(prompts: List[str], models_outputs: List[List[str]], model_names: List[str], judge: BaseModel, task: str = 'summarization', pairing: str = 'swiss', prompts_per_pair: int = 4, max_rounds: int = 50, patience: int = 3, cache: Optional[MetricCache] = None, leaderboard: Optional[BradleyTerryLeaderboard] = None, seed: int = 0) -> Dict[str, Any]:
+  # models_outputs[model_index][prompt_index], e.g. the first value returned by an evaluate_* function
+  if pairing not in ('swiss', 'active'):
+    raise ValueError(f"Unknown pairing: {pairing}. Expected swiss or active.")
+  if len(models_outputs) != len(model_names) or any(len(outputs) != len(prompts) for outputs in models_outputs):
+    raise ValueError("models_outputs must have one output per prompt for every model in model_names.")
+
+  rng = np.random.default_rng(seed)
+  pairwise_judge = PairwiseJudge(judge, task=task, cache=cache)
+  leaderboard = leaderboard if leaderboard is not None else BradleyTerryLeaderboard()
+  indices = [leaderboard.add_model(name) for name in model_names]
+  num_models = len(model_names)
+  # Prompts not yet used for each pair, in a random order
+  remaining = {pair: rng.permutation(len(prompts)).tolist() for pair in itertools.combinations(range(num_models), 2)}
+
+  previous_ranks, stable_rounds, rounds = None, 0, 0
+  for round_index in range(max_rounds):
+    strengths = leaderboard.strengths[indices]
+    games = leaderboard.wins[np.ix_(indices, indices)] + leaderboard.wins[np.ix_(indices, indices)].T
+    if pairing == 'swiss':
+      pairs = swiss_pairs(strengths, round_index)
+    else:
+      pairs = active_pairs(strengths, games, max(num_models // 2, 1))
+    pairs = [tuple(sorted(pair)) for pair in pairs if remaining[tuple(sorted(pair))]]
+    if not pairs:
+      break
+
+    scheduled = []
+    for pair in pairs:
+      for prompt_index in remaining[pair][:prompts_per_pair]:
+        scheduled.append((pair, prompt_index))
+      remaining[pair] = remaining[pair][prompts_per_pair:]
+
+    outcomes = pairwise_judge.judge_pairs([(prompts[p], models_outputs[a][p], models_outputs[b][p]) for (a, b), p in scheduled])
+    leaderboard.add_comparisons([(model_names[a], model_names[b], outcome) for ((a, b), _), outcome in zip(scheduled, outcomes)])
+    leaderboard.fit()
+    rounds += 1
+
+    ranks = [leaderboard.ranks()[i] for i in indices]
+    stable_rounds = stable_rounds + 1 if ranks == previous_ranks else 0
+    previous_ranks = ranks
+    if stable_rounds >= patience:
+      break
+
+  ratings = leaderboard.ratings()
+  return {
+    'ranks': [leaderboard.ranks()[i] for i in indices],
+    'ratings': [ratings[name] for name in model_names],
+    'rounds': rounds,
+    'judge_calls': pairwise_judge.judge_calls,
+    'full_judge_calls': num_models * (num_models - 1) * len(prompts),
+    'leaderboard': leaderboard,
+  }
+
+if __name__ == "__main__":
+  import argparse
+  from models.openai_module import OpenAIModel
+  from models.anthropic_module import AnthropicModel
+
+  parser = argparse.ArgumentParser(description="Functions Test Code Arguments")
+  parser.add_argument('--openai', action='store_true', help='Use OpenAI Model As Judge')
+  parser.add_argument('--anthropic', action='store_true', help='Use Anthropic Model As Judge')
+  args = parser.parse_args()
+
+  judge = AnthropicModel() if args.anthropic else OpenAIModel()
+
+  prompts = [
+    "The Eiffel Tower, completed in 1889 for the World's Fair, was initially criticized by artists but became the most visited paid monument in the world.",
+    "Honeybees communicate the location of flowers through a waggle dance, whose angle and duration encode the direction and distance of the food source.",
+  ]
+  model_names = ["detailed", "short", "off-topic"]
+  models_outputs = [
+    ["The Eiffel Tower, built for the 1889 World's Fair, was first criticized but is now the most visited paid monument.", "Honeybees use a waggle dance whose angle and length tell others the direction and distance of flowers."],
+    ["The Eiffel Tower is a monument.", "Bees dance."],
+    ["Paris has many cafes.", "Flowers are colorful."],
+  ]
+
+  result = evaluate_with_judge(prompts, models_outputs, model_names, judge, task='summarization', prompts_per_pair=1)
+  for name, rank, rating in zip(model_names, result['ranks'], result['ratings']):
+    print(f"Model: {name}, Rank: {rank}, Rating: {rating:.1f}")
+  print(f"Judge Calls: {result['judge_calls']} of {result['full_judge_calls']}")
@@ -0,0 +1,240 @@
+import threading
+from concurrent.futures import CancelledError, Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from models.base_module import BaseModel
+from models.registry import load_models
+from inferences.scheduler import InferenceScheduler
+from inferences.long_document import CHUNK_CHARS, submit_document
+from inferences.result_matrix import ResultMatrix
+from evaluations.translation import score_translation
+from evaluations.summarization import score_summarization
+from evaluations.qanda import score_q_and_a
+from evaluations.completion_sentence import score_completion_sentence
+from evaluations.completion_missing_words import score_completion_missing_word
+from evaluations.store import CACHED_TASKS
+from metrics.metric_cache import MetricCache
+
+# Several tasks run together on shared model instances and one inference scheduler. A model's outputs
+# for a task are scored as soon as its last prompt for that task returns, on a separate pool, so the
+# metric computation of finished (task, model) pairs runs while the remaining requests are in flight.
+
+PIPELINE_TASKS: Dict[str, Dict[str, Any]] = {
+  # method: the BaseModel method, prompt_inputs: its per-prompt arguments, score_inputs: the scorer's references
+  'translation': {'method': 'translate', 'prompt_inputs': ['prompts', 'src_langs', 'tgt_langs'], 'scorer': score_translation, 'score_inputs': ['references']},
+  'summarization': {'method': 'summarize', 'prompt_inputs': ['prompts'], 'scorer': score_summarization, 'score_inputs': ['references']},
+  'qanda': {'method': 'q_and_a', 'prompt_inputs': ['prompts'], 'scorer': score_q_and_a, 'score_inputs': ['true_references', 'false_references']},
+  'completion_sentence': {'method': 'complete_sentence', 'prompt_inputs': ['prompts'], 'scorer': score_completion_sentence, 'score_inputs': ['references']},
+  'completion_missing_word': {'method': 'complete_missing_word', 'prompt_inputs': ['prompts', 'references'], 'scorer': score_completion_missing_word, 'score_inputs': ['references', 'answers']},
+}
+
+def validate_task_spec(task: str, spec: Dict[str, Any]) -> None:
+  # Options beyond 'inputs' and 'evaluation_details'; only summarization has any
+  if 'long_document' in spec:
+    if task != 'summarization':
+      raise ValueError(f"long_document is only supported for summarization, not {task}.")
+    if not isinstance(spec['long_document'], bool):
+      raise ValueError("long_document must be true or false.")
+  chunk_chars = spec.get('chunk_chars', CHUNK_CHARS)
+  if isinstance(chunk_chars, bool) or not isinstance(chunk_chars, int) or chunk_chars < 1:
+    raise ValueError("chunk_chars must be a positive integer.")
+
+def submit_inference(scheduler: InferenceScheduler, document_executor: Executor, task: str, spec: Dict[str, Any], model: BaseModel, prompt_args: Tuple[Any, ...], callback: Optional[Callable[[Future], None]] = None) -> Future:
+  # One model call for a prompt, or its chunked map-reduce for a summarization spec with long_document;
+  # either way the future resolves to (output, latency)
+  if spec.get('long_document'):
+    return submit_document(model, prompt_args[0], scheduler, document_executor, spec.get('chunk_chars', CHUNK_CHARS), callback=callback)
+  return scheduler.submit(model, PIPELINE_TASKS[task]['method'], *prompt_args, callback=callback)
+
+def score_task(task: str, spec: Dict[str, Any], models_outputs: ResultMatrix, metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False) -> Tuple[Dict[str, List[float]], Dict[str, List]]:
+  # spec is {'inputs': ..., 'evaluation_details': ...} as in run_pipeline
+  pipeline_task = PIPELINE_TASKS[task]
+  kwargs = {name: spec['inputs'][name] for name in pipeline_task['score_inputs']}
+  if task in CACHED_TASKS:
+    kwargs['metric_cache'] = metric_cache
+  return pipeline_task['scorer'](models_outputs, evaluation_details=spec['evaluation_details'], return_sample_scores=return_sample_scores, **kwargs)
+
+def merge_model_scores(models_scores: List[Tuple[Dict[str, List[float]], Dict[str, List]]]) -> Tuple[Dict[str, List[float]], Dict[str, List]]:
+  # Scores of one model at a time, in model order, into the evaluate_* layout
+  evaluations = {metric: [scores[0][metric][0] for scores in models_scores] for metric in (models_scores[0][0] if models_scores else {})}
+  sample_evaluations = {metric: [scores[1][metric][0] for scores in models_scores] for metric in (models_scores[0][1] if models_scores else {})}
+  return evaluations, sample_evaluations
+
+def run_pipeline(tasks: Dict[str, Dict[str, Any]], model_details: List[Dict[str, str]], scheduler: Optional[InferenceScheduler] = None, scoring_workers: int = 4, metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False, on_scored: Optional[Callable[[str, int, ResultMatrix, Dict[str, Any], Dict[str, Any]], None]] = None) -> Dict[str, Tuple]:
+  """Runs every task on every model and returns, per task, what the task's evaluate_* function returns.
+
+  `tasks` maps a task name to {'inputs': ..., 'evaluation_details': ...}, where the inputs are the
+  evaluate_* keyword arguments besides the models, e.g.
+    {'summarization': {'inputs': {'prompts': ..., 'references': ...}, 'evaluation_details': ['rouge']}}
+  A summarization spec may add 'long_document': True (and 'chunk_chars') to summarize every document with
+  chunked map-reduce (see inferences.long_document) on the same scheduler.
+  `on_scored(task, model_index, models_outputs, evaluations, sample_evaluations)` is called from a scoring
+  thread as each model's scores for a task become available, with a one-model ResultMatrix and scores.
+  """
+  for task, spec in tasks.items():
+    if task not in PIPELINE_TASKS:
+      raise ValueError(f"Unknown task: {task}. Expected one of {', '.join(PIPELINE_TASKS)}.")
+    validate_task_spec(task, spec)
+  models = load_models(model_details)
+  own_scheduler = scheduler is None
+  scheduler = InferenceScheduler() if own_scheduler else scheduler
+
+  results = {task: ResultMatrix(len(models), len(spec['inputs']['prompts'])) for task, spec in tasks.items()}
+  remaining = {(task, model_index): len(spec['inputs']['prompts']) for task, spec in tasks.items() for model_index in range(len(models))}
+  scoring_futures: Dict[Tuple[str, int], Future] = {}
+  errors: List[BaseException] = []
+  failed_groups: Set[Tuple[str, int]] = set()
+  lock = threading.Lock()
+  all_scored = threading.Event()
+  groups_left = [len(remaining)]
+
+  def score(task: str, model_index: int) -> Tuple[Dict[str, List[float]], Dict[str, List]]:
+    model_outputs = results[task].select_models([model_index])
+    scores = score_task(task, tasks[task], model_outputs, metric_cache, return_sample_scores)
+    if on_scored is not None:
+      on_scored(task, model_index, model_outputs, *scores)
+    return scores
+
+  def finish_group(task: str, model_index: int, failed: bool) -> None:
+    # Called once per (task, model) with the lock held
+    if not failed:
+      scoring_futures[(task, model_index)] = scoring_executor.submit(score, task, model_index)
+    groups_left[0] -= 1
+    if groups_left[0] == 0:
+      all_scored.set()
+
+  def on_output(task: str, model_index: int, prompt_index: int):
+    def callback(future: Future) -> None:
+      # A call cancelled by a scheduler shutdown still counts towards its group, or the run never finishes
+      error = CancelledError(f"{task} prompt {prompt_index} was cancelled.") if future.cancelled() else future.exception()
+      if error is None:
+        output, latency = future.result()
+        results[task].set(model_index, prompt_index, output, latency)
+      with lock:
+        if error is not None:
+          errors.append(error)
+          failed_groups.add((task, model_index))
+        remaining[(task, model_index)] -= 1
+        if remaining[(task, model_index)] == 0:
+          # Only this group's own failures keep it from being scored; other groups are scored (and
+          # reported through on_scored) even though run_pipeline raises at the end
+          finish_group(task, model_index, (task, model_index) in failed_groups)
+    return callback
+
+  # Threads that only wait on the scheduler for long-document map-reduces; none start unless needed
+  with ThreadPoolExecutor(max_workers=scoring_workers) as scoring_executor, ThreadPoolExecutor(max_workers=64) as document_executor:
+    try:
+      with lock:
+        for key, count in remaining.items():
+          if count == 0:
+            finish_group(*key, failed=False)
+        if not remaining:
+          all_scored.set()
+      # Task by task, so early tasks complete (and are scored) while later ones are still being queried
+      for task, spec in tasks.items():
+        pipeline_task = PIPELINE_TASKS[task]
+        prompt_inputs = [spec['inputs'][name] for name in pipeline_task['prompt_inputs']]
+        for prompt_index, prompt_args in enumerate(zip(*prompt_inputs)):
+          for model_index, model in enumerate(models):
+            submit_inference(scheduler, document_executor, task, spec, model, prompt_args, callback=on_output(task, model_index, prompt_index))
+      all_scored.wait()
+    finally:
+      if own_scheduler:
+        scheduler.shutdown()
+
+  if errors:
+    raise errors[0]
+
+  outputs = {}
+  for task, spec in tasks.items():
+    models_scores = [scoring_futures[(task, model_index)].result() for model_index in range(len(models))]
+    evaluations, sample_evaluations = merge_model_scores(models_scores)
+    outputs[task] = (results[task], evaluations, sample_evaluations) if return_sample_scores else (results[task], evaluations)
+  return outputs
+
+if __name__ == "__main__":
+  import time
+  import argparse
+  from models.registry import register_model
+
+  parser = argparse.ArgumentParser(description="Functions Test Code Arguments")
+  parser.add_argument('--all', action='store_true', help='Include All Models')
+  parser.add_argument('--openai', action='store_true', help='Include OpenAI Model')
+  parser.add_argument('--anthropic', action='store_true', help='Include Anthropic Model')
+  parser.add_argument('--cohere', action='store_true', help='Include Cohere Model')
+  parser.add_argument('--groq', action='store_true', help='Include Groq Model')
+  parser.add_argument('--genai', action='store_true', help='Include Google Generative AI Model')
+  parser.add_argument('--vertexai', action='store_true', help='Include Google Vertex AI Model')
+  args = parser.parse_args()
+
+  all_model_details = {
+    'openai': {"source": "openai", "model": "gpt-4-0125-preview"},
+    'anthropic': {"source": "anthropic", "model": "claude-3-opus-20240229"},
+    'cohere': {"source": "cohere", "model": "command-r"},
+    'groq': {"source": "groq", "model": "mixtral-8x7b-32768"},
+    'genai': {"source": "genai", "model": "gemini-1.0-pro"},
+    'vertexai': {"source": "vertexai", "model": "gemini-1.0-pro"},
+  }
+  model_details = [model_detail for source, model_detail in all_model_details.items() if args.all or getattr(args, source)]
+
+  # Shutdown Check: a shared scheduler shut down mid-run cancels the queued calls, and run_pipeline
+  # has to raise instead of waiting forever for their groups
+  class SlowModel(BaseModel):
+    def __init__(self): pass
+    def __str__(self): return "Stub,slow"
+    def call(self, prompt, system=None, profile=None): time.sleep(0.2); return prompt
+    def translate(self, prompt, src_lang, tgt_lang): return self.call(prompt)
+    def summarize(self, prompt): return self.call(prompt)
+    def q_and_a(self, prompt): return self.call(prompt)
+    def complete_sentence(self, prompt): return self.call(prompt)
+    def complete_missing_word(self, prompt, missing_words): return self.call(prompt)
+
+  stub_detail = {"source": "local", "model": "stub-slow"}
+  register_model(stub_detail, SlowModel())
+  stub_tasks = {'summarization': {'inputs': {'prompts': [f"Document {index}." for index in range(5)], 'references': [["Document."]] * 5}, 'evaluation_details': ['rouge']}}
+  stub_scheduler = InferenceScheduler(max_concurrency_per_model=1)
+  outcome = []
+
+  def run_stub_pipeline() -> None:
+    try:
+      run_pipeline(stub_tasks, [stub_detail], scheduler=stub_scheduler)
+      outcome.append("finished")
+    except BaseException as exception:
+      outcome.append(type(exception).__name__)
+
+  stub_thread = threading.Thread(target=run_stub_pipeline, daemon=True)
+  stub_thread.start()
+  time.sleep(0.05)
+  stub_scheduler.shutdown()
+  stub_thread.join(timeout=10)
+  print(f"Shutdown Check: {'hung' if stub_thread.is_alive() else outcome[0]}")
+  print()
+
+  tasks = {
+    'translation': {
+      'inputs': {
+        'prompts': ["Je suis un etudiant.", "J'aime creme de glace."],
+        'src_langs': ["French", "French"],
+        'tgt_langs': ["English", "English"],
+        'references': [["I am a student.", "I go to the school."], ["I like ice cream.", "I enjoy ice cream.", "I love ice cream."]],
+      },
+      'evaluation_details': ['bleu', 'rouge'],
+    },
+    'completion_missing_word': {
+      'inputs': {
+        'prompts': ["John moved the couch from the garage to the backyard to create space. The _ is small."],
+        'references': [["garage", "backyard"]],
+        'answers': [1],
+      },
+      'evaluation_details': ['accuracy'],
+    },
+  }
+
+  with InferenceScheduler(max_workers=32, max_concurrency_per_model=4) as scheduler:
+    pipeline_results = run_pipeline(tasks, model_details, scheduler=scheduler)
+
+  for task, (models_outputs, evaluations) in pipeline_results.items():
+    print(f"===== {task} =====")
+    for model_index, model_detail in enumerate(model_details):
+      print(f"Model: {model_detail['source']}, Model Name: {model_detail['model']}, Outputs: {models_outputs[model_index]}")
+      print({metric: scores[model_index] for metric, scores in evaluations.items()})
+    print()
@@ -1,71 +1,50 @@
-from models.openai_module import OpenAIModel
-from models.anthropic_module import AnthropicModel
-from models.cohere_module import CohereModel
-from models.groq_module import GroqModel
-from models.google_generative_ai_module import GoogleGenerativeAIModel
-from models.google_vertex_ai_module import GoogleVertexAIModel
-from inferences.functions import q_and_a
-from metrics.base_metrics import calc_bleu_score, calc_rouge_score
-from typing import List, Dict, Tuple
-
-def evaluate_q_and_a(prompts: List[str], true_references: List[List[str]], false_references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str]) -> Tuple[List[List[str]], Dict[str, List[float]]]:
-  models = []
-
-  for model_detail in model_details:
-    if model_detail["source"] == "openai":
-      models.append(OpenAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "anthropic":
-      models.append(AnthropicModel(model=model_detail["model"]))
-    elif model_detail["source"] == "cohere":
-      models.append(CohereModel(model=model_detail["model"]))
-    elif model_detail["source"] == "groq":
-      models.append(GroqModel(model=model_detail["model"]))
-    elif model_detail["source"] == "genai":
-      models.append(GoogleGenerativeAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "vertexai":
-      models.append(GoogleVertexAIModel(model=model_detail["model"]))
-    
-  all_results = q_and_a(
-    prompts=prompts,
-    models=models
-  )
-
-  models_answers = [[None for _ in prompts] for _ in models]
-
-  for prompt_results in all_results:
-    for prompt_index, model_index, translation in prompt_results:
-      models_answers[model_index][prompt_index] = translation
-
+from models.registry import load_models
+from inferences.functions import q_and_a, sample
+from inferences.result_matrix import ResultMatrix
+from evaluations.sampling import score_samples
+from metrics.base_metrics import calc_truthfulness_sample_scores
+from metrics.truthfulness import TRUTHFULNESS_METRICS
+from typing import List, Dict, Tuple, Union
+
+# Evaluation details to the truthfulness metrics they report, as truthful_<metric>
+TRUTHFULNESS_DETAILS = {'bleu': ['bleu'], 'rouge': ['rouge1', 'rouge2', 'rougel'], 'truthfulness': list(TRUTHFULNESS_METRICS)}
+
+def score_q_and_a(models_answers: ResultMatrix, true_references: List[List[str]], false_references: List[List[str]], evaluation_details: List[str], return_sample_scores: bool = False) -> Tuple[Dict[str, List[float]], Dict[str, List[List]]]:
+  # Per question max similarity to a true reference minus max similarity to a false reference, in one
+  # vectorized pass for all models
   evaluations = {}
+  sample_evaluations = {}
+
+  metrics = [metric for metric in TRUTHFULNESS_METRICS if any(metric in TRUTHFULNESS_DETAILS.get(detail, []) for detail in evaluation_details)]
+  if metrics:
+    truthfulness_scores = calc_truthfulness_sample_scores(models_answers, true_references, false_references, metrics)
 
-  if 'bleu' in evaluation_details:
-    bleu_scores = []
+    for metric, models_scores in truthfulness_scores.items():
+      evaluations[f'truthful_{metric}'] = [sum(scores) / len(scores) if scores else 0.0 for scores in models_scores]
+      if return_sample_scores:
+        sample_evaluations[f'truthful_{metric}'] = models_scores
 
-    for model_answers in models_answers:
-      true_bleu_score = calc_bleu_score(model_answers, true_references)
-      false_bleu_score = calc_bleu_score(model_answers, false_references)
-      bleu_scores.append(true_bleu_score['bleu'] - false_bleu_score['bleu'])
+  return evaluations, sample_evaluations
 
-    evaluations['bleu'] = bleu_scores
+def evaluate_q_and_a(prompts: List[str], true_references: List[List[str]], false_references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str], return_sample_scores: bool = False, n_samples: int = 1) -> Union[Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]]], Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]], Dict[str, List[List]]]]:
+  models = load_models(model_details)
 
-  if 'rouge' in evaluation_details:
-    rouge1_scores = []
-    rouge2_scores = []
-    rougeL_scores = []
-    rougeLsum_scores = []
+  if n_samples > 1:
+    # One ResultMatrix per sample; see inferences.functions.sample
+    models_answers = sample('q_and_a', [prompts], models, n_samples)
+  else:
+    models_answers = q_and_a(
+      prompts=prompts,
+      models=models
+    )
 
-    for model_answers in models_answers:
-      true_rouge_score = calc_rouge_score(model_answers, true_references)
-      false_rouge_score = calc_rouge_score(model_answers, false_references)
-      rouge1_scores.append(true_rouge_score['rouge1'] - false_rouge_score['rouge1'])
-      rouge2_scores.append(true_rouge_score['rouge2'] - false_rouge_score['rouge2'])
-      rougeL_scores.append(true_rouge_score['rougeL'] - false_rouge_score['rougeL'])
-      rougeLsum_scores.append(true_rouge_score['rougeLsum'] - false_rouge_score['rougeLsum'])
+  if n_samples > 1:
+    evaluations, sample_evaluations = score_samples(score_q_and_a, models_answers, return_sample_scores=return_sample_scores, true_references=true_references, false_references=false_references, evaluation_details=evaluation_details)
+  else:
+    evaluations, sample_evaluations = score_q_and_a(models_answers, true_references, false_references, evaluation_details, return_sample_scores=return_sample_scores)
 
-    evaluations['rouge1'] = rouge1_scores
-    evaluations['rouge2'] = rouge2_scores
-    evaluations['rougel'] = rougeL_scores
-    evaluations['rougelsum'] = rougeLsum_scores
+  if return_sample_scores:
+    return models_answers, evaluations, sample_evaluations
 
   return models_answers, evaluations
 
@@ -151,25 +130,20 @@ if __name__ == "__main__":
             "source": "vertexai",
             "model": "gemini-1.0-pro",
          })
-  evaluation_details = ['bleu', 'rouge']
+  evaluation_details = ['bleu', 'rouge', 'truthfulness']
 
-  models_answers, evaluations = evaluate_q_and_a(prompts, true_references, false_references, model_details, evaluation_details)
+  models_answers, evaluations, sample_evaluations = evaluate_q_and_a(prompts, true_references, false_references, model_details, evaluation_details, return_sample_scores=True)
 
-  for model_detail, model_answers, bleu_score, rouge1_score, rouge2_score, rougeL_score, rougeLsum_score in zip(model_details, models_answers, evaluations['bleu'], evaluations['rouge1'], evaluations['rouge2'], evaluations['rougel'], evaluations['rougelsum']):
+  for model_index, (model_detail, model_answers) in enumerate(zip(model_details, models_answers)):
     print(f"Model: {model_detail['source']}, Model Name: {model_detail['model']}")
     print()
     for prompt, answer, true_reference_group, false_reference_group in zip(prompts, model_answers, true_references, false_references):
       newline = "\n"
       print(f"Question: {prompt}\nAnswer: {answer}\nTrue References:\n{newline.join(true_reference_group)}\nFalse References:\n{newline.join(false_reference_group)}")
       print()
-    print("BLEU Score (T - F):")
-    print(bleu_score)
-    print("ROUGE-1 Score (T - F):")
-    print(rouge1_score)
-    print("ROUGE-2 Score (T - F):")
-    print(rouge2_score)
-    print("ROUGE-L Score (T - F):")
-    print(rougeL_score)
-    print("ROUGE-Lsum Score (T - F):")
-    print(rougeLsum_score)
+    for metric in ['truthful_bleu', 'truthful_rouge1', 'truthful_rouge2', 'truthful_rougel']:
+      print(f"{metric} (Max T - Max F, Per Question):")
+      print(sample_evaluations[metric][model_index])
+      print(f"{metric} (Mean):")
+      print(evaluations[metric][model_index])
     print()
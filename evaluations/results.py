@@ -0,0 +1,149 @@
+import os
+import time
+import uuid
+import threading
+import urllib.parse
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from inferences.result_matrix import ResultMatrix
+from metrics.reference_index import METRICS_CACHE_DIR
+
+# Run outputs and per-sample scores as Parquet files partitioned by task, model and run:
+#   <root>/task=<task>/model=<model>/run=<run>/part-0.parquet
+# with one row per prompt (prompt_index, output, latency and one column per metric). Files are zstd
+# compressed, and reads go through `pyarrow.dataset`, which only opens the partitions and columns a
+# query needs and streams them in record batches.
+
+RESULTS_DIR = os.path.join(METRICS_CACHE_DIR, "results")
+
+def run_id() -> str:
+  # Sorts by start time; the random suffix keeps runs started in the same second apart
+  return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def model_name(model_detail: Dict[str, str]) -> str:
+  return f"{model_detail['source']}:{model_detail['model']}"
+
+def _partition_path(root: str, task: str, model: str, run: str) -> str:
+  # Partition values are URI-encoded, which `pyarrow.dataset` decodes when discovering them
+  return os.path.join(root, *[f"{key}={urllib.parse.quote(value, safe='')}" for key, value in [("task", task), ("model", model), ("run", run)]])
+
+def write_run(task: str, model: str, run: str, outputs: List[Optional[str]], sample_scores: Optional[Dict[str, List[Any]]] = None, latencies: Optional[List[float]] = None, root: str = RESULTS_DIR, compression: str = "zstd") -> str:
+  # sample_scores: metric -> one value per prompt
+  columns = {
+    'prompt_index': pa.array(range(len(outputs)), type=pa.int32()),
+    'output': pa.array(list(outputs), type=pa.large_string()),
+    'latency': pa.array(latencies if latencies is not None else [None] * len(outputs), type=pa.float64()),
+  }
+  for metric, values in (sample_scores or {}).items():
+    if len(values) != len(outputs):
+      raise ValueError(f"{metric} must have one value per output.")
+    # Scalars, rows of statistics, or pairs of rows (e.g. BLEU statistics against true and false references)
+    value_type = pa.float64()
+    value = values[0] if values else None
+    while isinstance(value, (list, tuple)):
+      value_type = pa.list_(value_type)
+      value = value[0] if value else None
+    columns[metric] = pa.array(values, type=value_type)
+
+  directory = _partition_path(root, task, model, run)
+  os.makedirs(directory, exist_ok=True)
+  path = os.path.join(directory, "part-0.parquet")
+  temp_path = f"{path}.tmp"
+  pq.write_table(pa.table(columns), temp_path, compression=compression)
+  os.replace(temp_path, path)
+  return path
+
+def write_evaluation_run(task: str, model_details: List[Dict[str, str]], models_outputs: ResultMatrix, sample_evaluations: Optional[Dict[str, List[List[Any]]]] = None, models_latencies: Optional[List[List[float]]] = None, run: Optional[str] = None, root: str = RESULTS_DIR) -> str:
+  # Stores what an evaluate_* function returned with return_sample_scores=True, one partition per model.
+  # Latencies default to the ones measured by the inference functions.
+  run = run or run_id()
+  if models_latencies is None and isinstance(models_outputs, ResultMatrix):
+    models_latencies = [[None if latency != latency else latency for latency in row] for row in models_outputs.latencies.tolist()]
+  for model_index, (model_detail, outputs) in enumerate(zip(model_details, models_outputs)):
+    write_run(
+      task, model_name(model_detail), run, outputs,
+      sample_scores={metric: models_samples[model_index] for metric, models_samples in (sample_evaluations or {}).items()},
+      latencies=models_latencies[model_index] if models_latencies is not None else None,
+      root=root,
+    )
+  return run
+
+# Parquet schema of every file read so far, by (path, modification time, size), so reopening the
+# results only reads the footers of new or rewritten files
+_file_schemas: Dict[Tuple[str, int, int], pa.Schema] = {}
+_file_schemas_lock = threading.Lock()
+
+def _file_schema(path: str) -> pa.Schema:
+  stat = os.stat(path)
+  key = (path, stat.st_mtime_ns, stat.st_size)
+  with _file_schemas_lock:
+    schema = _file_schemas.get(key)
+  if schema is None:
+    schema = pq.read_schema(path)
+    with _file_schemas_lock:
+      _file_schemas[key] = schema
+  return schema
+
+def open_results(root: str = RESULTS_DIR, schema: Optional[pa.Schema] = None) -> ds.Dataset:
+  # Lazy: only the directory listing and Parquet footers are read here. Runs can have different metric
+  # columns, so the schema is the union of every file's schema rather than the first file's; pass a
+  # known schema to skip the footers altogether.
+  partitioning = ds.HivePartitioning.discover(segment_encoding="uri")
+  if schema is not None:
+    return ds.dataset(root, format="parquet", partitioning=partitioning, schema=schema)
+  dataset = ds.dataset(root, format="parquet", partitioning=partitioning)
+  schema = pa.unify_schemas([dataset.schema] + [_file_schema(path) for path in dataset.files])
+  return ds.dataset(root, format="parquet", partitioning=partitioning, schema=schema)
+
+def scan_results(columns: Optional[List[str]] = None, filter: Optional[pc.Expression] = None, root: str = RESULTS_DIR, batch_size: int = 65536, schema: Optional[pa.Schema] = None) -> Iterator[pa.RecordBatch]:
+  # e.g. scan_results(['model', 'rougel'], filter=pc.field('task') == 'summarization')
+  dataset = open_results(root, schema)
+  if columns is not None:
+    columns = [column for column in columns if column in dataset.schema.names]
+  yield from dataset.to_batches(columns=columns, filter=filter, batch_size=batch_size)
+
+def metric_means(metric: str, filter: Optional[pc.Expression] = None, root: str = RESULTS_DIR) -> List[Dict[str, Any]]:
+  # Mean of a scalar metric per (task, model, run), accumulated batch by batch
+  keys = ['task', 'model', 'run']
+  totals: Dict[tuple, List[float]] = {}
+  for batch in scan_results(keys + [metric], filter=filter, root=root):
+    if metric not in batch.schema.names:
+      continue
+    grouped = pa.Table.from_batches([batch]).group_by(keys).aggregate([(metric, "sum"), (metric, "count")]).to_pylist()
+    for row in grouped:
+      total = totals.setdefault(tuple(row[key] for key in keys), [0.0, 0])
+      total[0] += row[f"{metric}_sum"] or 0.0
+      total[1] += row[f"{metric}_count"]
+  return [dict(zip(keys, key), mean=total / count if count else None, count=count) for key, (total, count) in sorted(totals.items())]
+
+if __name__ == "__main__":
+  import tempfile
+  from pprint import pprint
+
+  root = tempfile.mkdtemp()
+  model_details = [
+    {"source": "openai", "model": "gpt-4-0125-preview"},
+    {"source": "anthropic", "model": "claude-3-opus-20240229"},
+  ]
+  models_outputs = ResultMatrix.from_lists([["I am a student.", "I like ice cream."], ["I am a student.", "I love ice cream."]])
+  sample_evaluations = {
+    'rougel': [[1.0, 1.0], [1.0, 0.75]],
+    'bleu': [[[4, 3, 4, 3, 4, 4], [4, 3, 4, 3, 4, 4]], [[4, 3, 4, 3, 4, 4], [3, 1, 4, 3, 4, 4]]],
+  }
+  models_latencies = [[0.81, 0.64], [1.12, 0.97]]
+
+  for run in ["20240301T000000", "20240302T000000"]:
+    write_evaluation_run('translation', model_details, models_outputs, sample_evaluations, models_latencies, run=run, root=root)
+
+  print("Partitions:")
+  pprint(sorted(os.path.relpath(path, root) for path in open_results(root).files))
+  print()
+  print("ROUGE-L Means:")
+  pprint(metric_means('rougel', root=root))
+  print()
+  print("Rows Of One Model:")
+  for batch in scan_results(['run', 'prompt_index', 'output', 'latency'], filter=pc.field('model') == model_name(model_details[1]), root=root):
+    pprint(batch.to_pylist())
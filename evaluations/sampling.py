@@ -0,0 +1,47 @@
+import numpy as np
+from typing import Any, Callable, Dict, List, Tuple
+from inferences.result_matrix import ResultMatrix
+from metrics.sampling import mean_and_variance, majority_vote
+
+# Scoring of runs with several samples per prompt (see inferences.functions.sample). Every sample is
+# scored with the task's own scorer, so any metric gets a mean and a variance across samples, and the
+# per-prompt majority vote is scored as one more run for self-consistency.
+
+def majority_outputs(samples: List[ResultMatrix]) -> ResultMatrix:
+  majority = ResultMatrix(*samples[0].shape)
+  for model_index in range(majority.num_models):
+    for prompt_index in range(majority.num_prompts):
+      majority.set(model_index, prompt_index, majority_vote([sample.output(model_index, prompt_index) for sample in samples]))
+  return majority
+
+def score_samples(scorer: Callable[..., Tuple[Dict[str, List[float]], Dict[str, List]]], samples: List[ResultMatrix], return_sample_scores: bool = False, **score_kwargs: Any) -> Tuple[Dict[str, List[float]], Dict[str, List]]:
+  """Scores every sample and their majority vote with a score_<task> function.
+
+  Returns, per metric, its mean over samples, `<metric>_variance` across samples and `<metric>_majority`
+  for the majority vote. Sample scores are those of the first sample, plus `<metric>_majority`.
+  """
+  samples_scores = [scorer(sample, return_sample_scores=return_sample_scores, **score_kwargs) for sample in samples]
+  majority_evaluations, majority_sample_evaluations = scorer(majority_outputs(samples), return_sample_scores=return_sample_scores, **score_kwargs)
+
+  evaluations = {}
+  for metric in samples_scores[0][0]:
+    # (samples x models) scores of the metric
+    scores = np.array([sample_evaluations[metric] for sample_evaluations, _ in samples_scores], dtype=np.float64)
+    means_variances = [mean_and_variance(scores[:, model_index]) for model_index in range(scores.shape[1])]
+    evaluations[metric] = [mean for mean, _ in means_variances]
+    evaluations[f'{metric}_variance'] = [variance for _, variance in means_variances]
+    evaluations[f'{metric}_majority'] = majority_evaluations[metric]
+
+  sample_evaluations = dict(samples_scores[0][1])
+  for metric, scores in majority_sample_evaluations.items():
+    sample_evaluations[f'{metric}_majority'] = scores
+  return evaluations, sample_evaluations
+
+if __name__ == "__main__":
+  from evaluations.completion_missing_words import score_completion_missing_word
+
+  references = [["garage", "backyard"], ["Justin", "Robert"]]
+  answers = [1, 2]
+  samples = [ResultMatrix.from_lists(outputs) for outputs in [[["garage", "Robert"]], [["backyard", "Robert"]], [["garage", "Justin"]]]]
+  print(f"Majority: {majority_outputs(samples).tolist()}")
+  print(score_samples(score_completion_missing_word, samples, references=references, answers=answers, evaluation_details=['accuracy']))
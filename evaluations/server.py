@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import uuid
+import queue
+import socket
+import threading
+import http.client
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit, parse_qs
+from models.registry import load_models, loaded_models, SOURCES
+from inferences.scheduler import InferenceScheduler
+from inferences.result_matrix import ResultMatrix
+from evaluations.pipeline import PIPELINE_TASKS, validate_task_spec, run_pipeline
+from metrics.metric_cache import MetricCache
+from metrics.reference_index import METRICS_CACHE_DIR
+
+# A long-running evaluation process. Provider SDKs, model clients (and their connection pools), the
+# metric backends, in-memory reference indexes and the metric cache are loaded once and stay warm, so
+# a job only pays for its own requests. Jobs are the `run_pipeline` arguments as JSON, e.g.
+#   {"tasks": {"summarization": {"inputs": {...}, "evaluation_details": ["rouge"]}},
+#    "model_details": [{"source": "openai", "model": "gpt-4-0125-preview"}], "return_sample_scores": false}
+# A summarization task may add "long_document": true (and "chunk_chars") for chunked map-reduce.
+# Jobs are queued, run a few at a time on one shared scheduler, and their results are streamed back
+# as newline-delimited JSON events (queued, started, one scored event per task and model, done or error).
+#
+#   POST /jobs                 submit a job, returns {"job_id": ...}
+#   POST /jobs?stream=1        submit a job and stream its events in the same response
+#   GET  /jobs/<job_id>        status and events so far
+#   GET  /jobs/<job_id>/events stream the job's events (from the first one) until it finishes
+#   GET  /health               loaded models and job counts
+
+DEFAULT_SOCKET_PATH = os.path.join(METRICS_CACHE_DIR, "server.sock")
+FINAL_EVENTS = ('done', 'error')
+
+def matrix_row(models_outputs: ResultMatrix, model_index: int = 0) -> Dict[str, List[Any]]:
+  return {
+    'outputs': models_outputs[model_index].tolist(),
+    'latencies': [None if latency != latency else latency for latency in models_outputs.latencies[model_index].tolist()],
+  }
+
+class Job:
+  """A submitted evaluation and the events it has produced so far."""
+
+  def __init__(self, request: Dict[str, Any]):
+    self.job_id = uuid.uuid4().hex
+    self.request = request
+    self.status = 'queued'
+    self.events: List[Dict[str, Any]] = []
+    self.condition = threading.Condition()
+
+  def emit(self, event: str, **fields: Any) -> None:
+    with self.condition:
+      if event in FINAL_EVENTS or event == 'started':
+        self.status = 'running' if event == 'started' else event
+      self.events.append(dict(fields, event=event, job_id=self.job_id, time=time.time()))
+      self.condition.notify_all()
+
+  @property
+  def finished(self) -> bool:
+    return self.status in FINAL_EVENTS
+
+  def stream(self) -> Iterator[Dict[str, Any]]:
+    index = 0
+    while True:
+      with self.condition:
+        while index == len(self.events) and not self.finished:
+          self.condition.wait()
+        events = self.events[index:]
+        finished = self.finished
+      index += len(events)
+      yield from events
+      if finished:
+        return
+
+class EvaluationService:
+  """Runs queued jobs on a shared scheduler, metric cache and set of model instances."""
+
+  def __init__(self, scheduler: Optional[InferenceScheduler] = None, metric_cache: Optional[MetricCache] = None, max_running_jobs: int = 4, max_finished_jobs: int = 1000):
+    self.scheduler = scheduler or InferenceScheduler()
+    self.metric_cache = metric_cache if metric_cache is not None else MetricCache()
+    self.max_finished_jobs = max_finished_jobs
+    self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+    self._jobs_lock = threading.Lock()
+    self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+    self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max_running_jobs)]
+    for worker in self._workers:
+      worker.start()
+
+  def warm(self, model_details: List[Dict[str, str]]) -> None:
+    # Builds the clients ahead of the first job
+    load_models(model_details)
+
+  def submit(self, request: Dict[str, Any]) -> Job:
+    # Requests come from the network, so their whole shape is checked before the job is queued
+    if not isinstance(request, dict):
+      raise ValueError("A job must be a JSON object.")
+    tasks = request.get('tasks')
+    model_details = request.get('model_details')
+    if not isinstance(tasks, dict) or not tasks:
+      raise ValueError("A job needs a non-empty 'tasks' object.")
+    if not isinstance(model_details, list) or not model_details:
+      raise ValueError("A job needs a non-empty 'model_details' list.")
+    if not isinstance(request.get('return_sample_scores', False), bool):
+      raise ValueError("'return_sample_scores' must be true or false.")
+    for task, spec in tasks.items():
+      if task not in PIPELINE_TASKS:
+        raise ValueError(f"Unknown task: {task}. Expected one of {', '.join(PIPELINE_TASKS)}.")
+      if not isinstance(spec, dict) or not isinstance(spec.get('inputs'), dict) or not isinstance(spec.get('evaluation_details'), list):
+        raise ValueError(f"Task {task} needs an 'inputs' object and an 'evaluation_details' list.")
+      validate_task_spec(task, spec)
+      inputs = spec['inputs']
+      for name in dict.fromkeys(['prompts'] + PIPELINE_TASKS[task]['prompt_inputs'] + PIPELINE_TASKS[task]['score_inputs']):
+        if not isinstance(inputs.get(name), list):
+          raise ValueError(f"Task {task} needs a '{name}' list in its inputs.")
+        if len(inputs[name]) != len(inputs['prompts']):
+          raise ValueError(f"Task {task} needs one '{name}' entry per prompt.")
+    for model_detail in model_details:
+      if not isinstance(model_detail, dict) or not isinstance(model_detail.get('model'), str):
+        raise ValueError("Every model detail must be an object with a 'source' and a 'model' string.")
+      if model_detail.get('source') not in SOURCES:
+        raise ValueError(f"Unknown model source: {model_detail.get('source')}. Expected one of {', '.join(SOURCES)}.")
+
+    job = Job(request)
+    with self._jobs_lock:
+      self.jobs[job.job_id] = job
+      self._prune()
+    job.emit('queued', position=self._queue.qsize())
+    self._queue.put(job)
+    return job
+
+  def _prune(self) -> None:
+    finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+    for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+      del self.jobs[job_id]
+
+  def get(self, job_id: str) -> Optional[Job]:
+    with self._jobs_lock:
+      return self.jobs.get(job_id)
+
+  def _work(self) -> None:
+    while True:
+      job = self._queue.get()
+      if job is None:
+        return
+      self._run(job)
+
+  def _run(self, job: Job) -> None:
+    request = job.request
+    model_details = request['model_details']
+    job.emit('started')
+
+    def on_scored(task: str, model_index: int, models_outputs: ResultMatrix, evaluations: Dict[str, List[float]], sample_evaluations: Dict[str, List[Any]]) -> None:
+      job.emit(
+        'scored',
+        task=task,
+        model_detail=model_details[model_index],
+        evaluations={metric: scores[0] for metric, scores in evaluations.items()},
+        sample_evaluations={metric: samples[0] for metric, samples in sample_evaluations.items()},
+        **matrix_row(models_outputs),
+      )
+
+    try:
+      results = run_pipeline(request['tasks'], model_details, scheduler=self.scheduler, metric_cache=self.metric_cache, return_sample_scores=request.get('return_sample_scores', False), on_scored=on_scored)
+    except Exception as exception:
+      job.emit('error', message=f"{type(exception).__name__}: {exception}")
+      return
+    job.emit('done', evaluations={task: result[1] for task, result in results.items()})
+
+  def health(self) -> Dict[str, Any]:
+    with self._jobs_lock:
+      statuses = [job.status for job in self.jobs.values()]
+    return {
+      'status': 'ok',
+      'models': [{'source': source, 'model': model} for source, model in loaded_models()],
+      'jobs': {status: statuses.count(status) for status in ('queued', 'running', 'done', 'error')},
+    }
+
+  def close(self) -> None:
+    # Jobs still waiting are cancelled rather than run; jobs already running finish
+    while True:
+      try:
+        job = self._queue.get_nowait()
+      except queue.Empty:
+        break
+      if job is not None:
+        job.emit('error', message="Cancelled: the service is shutting down.")
+    for _ in self._workers:
+      self._queue.put(None)
+    for worker in self._workers:
+      worker.join()
+    self.scheduler.shutdown()
+    self.metric_cache.close()
+
+class EvaluationRequestHandler(BaseHTTPRequestHandler):
+  # HTTP/1.0: a streamed response ends when the connection closes
+  service: EvaluationService
+
+  def address_string(self) -> str:
+    return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+  def send_json(self, status: int, body: Any) -> None:
+    data = json.dumps(body).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def send_events(self, job: Job) -> None:
+    self.send_response(200)
+    self.send_header("Content-Type", "application/x-ndjson")
+    self.end_headers()
+    for event in job.stream():
+      self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+      self.wfile.flush()
+
+  def do_GET(self) -> None:
+    parts = [part for part in urlsplit(self.path).path.split("/") if part]
+    if parts == ["health"]:
+      return self.send_json(200, self.service.health())
+    if len(parts) in (2, 3) and parts[0] == "jobs":
+      job = self.service.get(parts[1])
+      if job is None:
+        return self.send_json(404, {'error': f"Unknown job: {parts[1]}"})
+      if len(parts) == 3 and parts[2] == "events":
+        return self.send_events(job)
+      if len(parts) == 2:
+        with job.condition:
+          return self.send_json(200, {'job_id': job.job_id, 'status': job.status, 'events': list(job.events)})
+    self.send_json(404, {'error': f"Unknown path: {self.path}"})
+
+  def do_POST(self) -> None:
+    url = urlsplit(self.path)
+    if url.path.rstrip("/") != "/jobs":
+      return self.send_json(404, {'error': f"Unknown path: {self.path}"})
+    try:
+      length = self.headers.get("Content-Length", "0").strip()
+      if not length.isdigit():
+        raise ValueError("Content-Length must be a non-negative integer.")
+      request = json.loads(self.rfile.read(int(length)) or b"{}")
+      job = self.service.submit(request)
+    except ValueError as exception:
+      # json.JSONDecodeError and UnicodeDecodeError are ValueErrors too
+      return self.send_json(400, {'error': str(exception)})
+    if parse_qs(url.query).get("stream", ["0"])[0] not in ("0", "false"):
+      return self.send_events(job)
+    self.send_json(202, {'job_id': job.job_id})
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+  daemon_threads = True
+
+def make_server(service: EvaluationService, host: str = "127.0.0.1", port: int = 8765, socket_path: Optional[str] = None):
+  # A Unix socket when socket_path is given, TCP otherwise
+  handler = type("BoundEvaluationRequestHandler", (EvaluationRequestHandler,), {'service': service})
+  if socket_path is None:
+    return ThreadingHTTPServer((host, port), handler)
+  os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+  if os.path.exists(socket_path):
+    os.remove(socket_path)
+  return ThreadingUnixHTTPServer(socket_path, handler)
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+  def __init__(self, socket_path: str, timeout: Optional[float] = None):
+    super().__init__("localhost", timeout=timeout)
+    self.socket_path = socket_path
+
+  def connect(self) -> None:
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if self.timeout is not None:
+      self.sock.settimeout(self.timeout)
+    self.sock.connect(self.socket_path)
+
+class EvaluationClient:
+  """Talks to a running server, at an http://host:port address or a Unix socket path."""
+
+  def __init__(self, address: str = DEFAULT_SOCKET_PATH, timeout: Optional[float] = None):
+    self.address = address
+    self.timeout = timeout
+
+  def _connection(self) -> http.client.HTTPConnection:
+    if self.address.startswith("http://"):
+      url = urlsplit(self.address)
+      return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+    return UnixHTTPConnection(self.address, timeout=self.timeout)
+
+  def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> http.client.HTTPResponse:
+    connection = self._connection()
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    connection.request(method, path, body=data, headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    if response.status >= 400:
+      raise ValueError(json.loads(response.read()).get('error', response.reason))
+    return response
+
+  def _events(self, response: http.client.HTTPResponse) -> Iterator[Dict[str, Any]]:
+    with response:
+      for line in response:
+        if line.strip():
+          yield json.loads(line)
+
+  def health(self) -> Dict[str, Any]:
+    return json.loads(self._request("GET", "/health").read())
+
+  def submit(self, request: Dict[str, Any]) -> str:
+    return json.loads(self._request("POST", "/jobs", request).read())['job_id']
+
+  def status(self, job_id: str) -> Dict[str, Any]:
+    return json.loads(self._request("GET", f"/jobs/{job_id}").read())
+
+  def events(self, job_id: str) -> Iterator[Dict[str, Any]]:
+    return self._events(self._request("GET", f"/jobs/{job_id}/events"))
+
+  def run(self, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    # Submits a job and yields its events as they happen
+    return self._events(self._request("POST", "/jobs?stream=1", request))
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Evaluation Server")
+  parser.add_argument('--socket', default=None, help=f'Unix Socket Path (e.g. {DEFAULT_SOCKET_PATH}); Serves TCP If Omitted')
+  parser.add_argument('--host', default="127.0.0.1", help='TCP Host')
+  parser.add_argument('--port', type=int, default=8765, help='TCP Port')
+  parser.add_argument('--max-running-jobs', type=int, default=4, help='Jobs Run At Once')
+  parser.add_argument('--max-workers', type=int, default=64, help='Concurrent Model Calls Across All Jobs')
+  parser.add_argument('--max-concurrency-per-model', type=int, default=8, help='Concurrent Calls Per Model')
+  parser.add_argument('--preload', action='append', default=[], help='Model To Load At Startup, As source:model (Repeatable)')
+  args = parser.parse_args()
+
+  service = EvaluationService(InferenceScheduler(args.max_workers, args.max_concurrency_per_model), max_running_jobs=args.max_running_jobs)
+  service.warm([{'source': source, 'model': model} for source, model in (preload.split(":", 1) for preload in args.preload)])
+  server = make_server(service, args.host, args.port, args.socket)
+  print(f"Serving On {args.socket or f'http://{args.host}:{args.port}'}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    service.close()
+    if args.socket is not None and os.path.exists(args.socket):
+      os.remove(args.socket)
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+from evaluations.translation import evaluate_translation
+from evaluations.summarization import evaluate_summarization
+from evaluations.qanda import evaluate_q_and_a
+from evaluations.completion_sentence import evaluate_completion_sentence
+from evaluations.completion_missing_words import evaluate_completion_missing_word
+from metrics.metric_cache import MetricCache
+from metrics.reference_index import METRICS_CACHE_DIR
+from rankings.functions import rank_models_by_evaluations
+
+# Every evaluate_* function scores each model on its own, so a model's outputs and scores do not
+# depend on which other models are evaluated with it. The store keeps them per (task, dataset, model):
+# adding or changing one model only runs inference and scoring for that model, and ranking reads the
+# stored scores.
+
+EVALUATORS: Dict[str, Callable[..., Any]] = {
+  'translation': evaluate_translation,
+  'summarization': evaluate_summarization,
+  'qanda': evaluate_q_and_a,
+  'completion_sentence': evaluate_completion_sentence,
+  'completion_missing_word': evaluate_completion_missing_word,
+}
+
+# Evaluators that accept a MetricCache
+CACHED_TASKS = ('translation', 'summarization', 'completion_sentence')
+
+def dataset_fingerprint(task: str, inputs: Dict[str, Any], evaluation_details: List[str]) -> str:
+  payload = json.dumps([task, inputs, sorted(evaluation_details)], sort_keys=True, ensure_ascii=False)
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def model_key(model_detail: Dict[str, str]) -> str:
+  return hashlib.sha256(json.dumps(model_detail, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+class EvaluationStore:
+  """Outputs, corpus scores and per-sample scores of each model on one task and dataset, one JSON file per model.
+
+  `inputs` are the keyword arguments of the task's evaluate_* function besides the model and evaluation
+  details, e.g. {'prompts': ..., 'references': ...} for summarization. Changing them (or the evaluation
+  details) changes the dataset fingerprint, so stale results are never mixed in.
+  """
+
+  def __init__(self, task: str, inputs: Dict[str, Any], evaluation_details: List[str], root: Optional[str] = None, metric_cache: Optional[MetricCache] = None):
+    if task not in EVALUATORS:
+      raise ValueError(f"Unknown task: {task}. Expected one of {', '.join(EVALUATORS)}.")
+    self.task = task
+    self.inputs = inputs
+    self.evaluation_details = evaluation_details
+    self.metric_cache = metric_cache
+    self.fingerprint = dataset_fingerprint(task, inputs, evaluation_details)
+    self.directory = os.path.join(root or os.path.join(METRICS_CACHE_DIR, "evaluation_store"), task, self.fingerprint)
+    os.makedirs(self.directory, exist_ok=True)
+
+  def _path(self, model_detail: Dict[str, str]) -> str:
+    return os.path.join(self.directory, f"{model_key(model_detail)}.json")
+
+  def has_model(self, model_detail: Dict[str, str]) -> bool:
+    return os.path.exists(self._path(model_detail))
+
+  def get_model(self, model_detail: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    if not self.has_model(model_detail):
+      return None
+    with open(self._path(model_detail)) as f:
+      return json.load(f)
+
+  def model_details(self) -> List[Dict[str, str]]:
+    # In the order the models were first added
+    entries = []
+    for name in os.listdir(self.directory):
+      if name.endswith(".json"):
+        with open(os.path.join(self.directory, name)) as f:
+          entry = json.load(f)
+        entries.append((entry['added_at'], entry['model_detail']))
+    return [model_detail for _, model_detail in sorted(entries, key=lambda x: x[0])]
+
+  def evaluate_model(self, model_detail: Dict[str, str], force: bool = False) -> Dict[str, Any]:
+    # Runs inference and scoring for this model only, unless its results are already stored
+    previous = self.get_model(model_detail)
+    if not force and previous is not None:
+      return previous
+
+    kwargs = dict(self.inputs, model_details=[model_detail], evaluation_details=self.evaluation_details, return_sample_scores=True)
+    if self.task in CACHED_TASKS:
+      kwargs['metric_cache'] = self.metric_cache
+    models_outputs, evaluations, sample_evaluations = EVALUATORS[self.task](**kwargs)
+    if not models_outputs:
+      raise ValueError(f"Unknown model source: {model_detail.get('source')}.")
+
+    entry = {
+      'model_detail': model_detail,
+      'added_at': previous['added_at'] if previous is not None else time.time_ns(),
+      'outputs': models_outputs[0].tolist(),
+      'latencies': [None if latency != latency else latency for latency in models_outputs.latencies[0].tolist()],
+      'evaluations': {metric: scores[0] for metric, scores in evaluations.items()},
+      'sample_evaluations': {metric: samples[0] for metric, samples in sample_evaluations.items()},
+    }
+    # Written to a temporary file first, so an interrupted run never leaves a truncated entry
+    file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+    with os.fdopen(file_descriptor, "w") as f:
+      json.dump(entry, f)
+    os.replace(temp_path, self._path(model_detail))
+    return entry
+
+  def add_models(self, model_details: List[Dict[str, str]], force: bool = False) -> None:
+    for model_detail in model_details:
+      self.evaluate_model(model_detail, force=force)
+
+  def remove_model(self, model_detail: Dict[str, str]) -> None:
+    if self.has_model(model_detail):
+      os.remove(self._path(model_detail))
+
+  def evaluations(self, model_details: Optional[List[Dict[str, str]]] = None) -> Dict[str, List[float]]:
+    # Same layout as the evaluations returned by evaluate_*, for the stored models (or the given ones, in order)
+    entries = [self.get_model(model_detail) for model_detail in (model_details if model_details is not None else self.model_details())]
+    if any(entry is None for entry in entries):
+      raise ValueError("Some of the requested models have not been evaluated; call add_models first.")
+    return {metric: [entry['evaluations'][metric] for entry in entries] for metric in (entries[0]['evaluations'] if entries else {})}
+
+  def sample_evaluations(self, model_details: Optional[List[Dict[str, str]]] = None) -> Dict[str, List[List[Any]]]:
+    entries = [self.get_model(model_detail) for model_detail in (model_details if model_details is not None else self.model_details())]
+    if any(entry is None for entry in entries):
+      raise ValueError("Some of the requested models have not been evaluated; call add_models first.")
+    return {metric: [entry['sample_evaluations'][metric] for entry in entries] for metric in (entries[0]['sample_evaluations'] if entries else {})}
+
+  def rank(self, weights: Dict[str, float], model_details: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, Any]]:
+    model_details = model_details if model_details is not None else self.model_details()
+    ranks = rank_models_by_evaluations(self.evaluations(model_details), weights)
+    return sorted([dict(model_detail, rank=rank) for model_detail, rank in zip(model_details, ranks)], key=lambda x: x['rank'])
+
+if __name__ == "__main__":
+  prompts = ["Je suis un etudiant.", "J'aime creme de glace."]
+  inputs = {
+    'prompts': prompts,
+    'src_langs': ["French", "French"],
+    'tgt_langs': ["English", "English"],
+    'references': [
+      ["I am a student.", "I go to the school."],
+      ["I like ice cream.", "I enjoy ice cream.", "I love ice cream."],
+    ],
+  }
+  weights = {
+    'bleu': 1.0,
+    'rouge1': 0.25,
+    'rouge2': 0.25,
+    'rougel': 0.25,
+    'rougelsum': 0.25,
+  }
+
+  store = EvaluationStore('translation', inputs, ['bleu', 'rouge'])
+  # Only models that are not in the store yet are queried and scored
+  store.add_models([
+    {"source": "openai", "model": "gpt-4-0125-preview"},
+    {"source": "anthropic", "model": "claude-3-opus-20240229"},
+  ])
+  store.add_models([{"source": "groq", "model": "mixtral-8x7b-32768"}])
+
+  print("Model Ranks")
+  for model in store.rank(weights):
+    print(f"Model: {model['source']}, Model Name: {model['model']}, Rank: {model['rank']}")
@@ -1,42 +1,18 @@
-from models.openai_module import OpenAIModel
-from models.anthropic_module import AnthropicModel
-from models.cohere_module import CohereModel
-from models.groq_module import GroqModel
-from models.google_generative_ai_module import GoogleGenerativeAIModel
-from models.google_vertex_ai_module import GoogleVertexAIModel
-from inferences.functions import summarize
-from metrics.base_metrics import calc_rouge_score
-from typing import List, Dict, Tuple
-
-def evaluate_summarization(prompts: List[str], references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str]) -> Tuple[List[List[str]], Dict[str, List[float]]]:
-  models = []
-
-  for model_detail in model_details:
-    if model_detail["source"] == "openai":
-      models.append(OpenAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "anthropic":
-      models.append(AnthropicModel(model=model_detail["model"]))
-    elif model_detail["source"] == "cohere":
-      models.append(CohereModel(model=model_detail["model"]))
-    elif model_detail["source"] == "groq":
-      models.append(GroqModel(model=model_detail["model"]))
-    elif model_detail["source"] == "genai":
-      models.append(GoogleGenerativeAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "vertexai":
-      models.append(GoogleVertexAIModel(model=model_detail["model"]))
-    
-  all_results = summarize(
-    prompts=prompts,
-    models=models
-  )
-
-  models_summarizations = [[None for _ in prompts] for _ in models]
-
-  for prompt_results in all_results:
-    for prompt_index, model_index, summarization in prompt_results:
-      models_summarizations[model_index][prompt_index] = summarization
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from models.registry import load_models
+from inferences.functions import summarize, sample
+from inferences.long_document import CHUNK_CHARS, submit_document
+from inferences.scheduler import InferenceScheduler
+from inferences.result_matrix import ResultMatrix
+from evaluations.sampling import score_samples
+from metrics.base_metrics import calc_rouge_score, calc_rouge_sample_scores
+from metrics.metric_cache import MetricCache
+from typing import List, Dict, Tuple, Optional, Union
 
+def score_summarization(models_summarizations: ResultMatrix, references: List[List[str]], evaluation_details: List[str], metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False) -> Tuple[Dict[str, List[float]], Dict[str, List[List]]]:
   evaluations = {}
+  sample_evaluations = {}
 
   if 'rouge' in evaluation_details:
     rouge1_scores = []
@@ -45,7 +21,7 @@ def evaluate_summarization(prompts: List[str], references: List[List[str]], mode
     rougeLsum_scores = []
 
     for model_summarizations in models_summarizations:
-      rouge_score = calc_rouge_score(model_summarizations, references)
+      rouge_score = calc_rouge_score(model_summarizations, references, cache=metric_cache)
       rouge1_scores.append(rouge_score['rouge1'])
       rouge2_scores.append(rouge_score['rouge2'])
       rougeL_scores.append(rouge_score['rougeL'])
@@ -56,6 +32,78 @@ def evaluate_summarization(prompts: List[str], references: List[List[str]], mode
     evaluations['rougel'] = rougeL_scores
     evaluations['rougelsum'] = rougeLsum_scores
 
+    if return_sample_scores:
+      models_rouge_samples = [calc_rouge_sample_scores(outputs, references, cache=metric_cache) for outputs in models_summarizations]
+      for rouge_type, metric in [('rouge1', 'rouge1'), ('rouge2', 'rouge2'), ('rougeL', 'rougel'), ('rougeLsum', 'rougelsum')]:
+        sample_evaluations[metric] = [rouge_samples[rouge_type] for rouge_samples in models_rouge_samples]
+
+  return evaluations, sample_evaluations
+
+def collect_summaries(futures: Dict[Tuple[int, int], Future], num_models: int, num_prompts: int) -> ResultMatrix:
+  # (model_index, prompt_index) -> future of (summary, latency); a failed call (e.g. a document over the
+  # model's context window, the case long-document mode exists for) leaves its cell None instead of
+  # failing the evaluation
+  results = ResultMatrix(num_models, num_prompts)
+  for (model_index, prompt_index), future in futures.items():
+    if not future.cancelled() and future.exception() is None:
+      results.set(model_index, prompt_index, *future.result())
+  return results
+
+def mean_latency(latencies: np.ndarray) -> float:
+  # Over the cells that have an output; NaN if none do
+  measured = latencies[~np.isnan(latencies)]
+  return float(measured.mean()) if len(measured) else float('nan')
+
+def evaluate_summarization(prompts: List[str], references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str], metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False, n_samples: int = 1, long_document: bool = False, chunk_chars: int = CHUNK_CHARS, scheduler: Optional[InferenceScheduler] = None) -> Union[Tuple[Union[ResultMatrix, List[ResultMatrix], Dict[str, ResultMatrix]], Dict[str, List[float]]], Tuple[Union[ResultMatrix, List[ResultMatrix], Dict[str, ResultMatrix]], Dict[str, List[float]], Dict[str, List[List[float]]]]]:
+  models = load_models(model_details)
+
+  if long_document and n_samples > 1:
+    raise ValueError("long_document cannot be combined with n_samples.")
+
+  if long_document:
+    # The documents summarized directly and through chunked map-reduce (see inferences.long_document),
+    # both on one scheduler (the given one, e.g. shared with other work, or a new one)
+    own_scheduler = scheduler is None
+    scheduler = InferenceScheduler() if own_scheduler else scheduler
+    cells = [(model_index, prompt_index) for prompt_index in range(len(prompts)) for model_index in range(len(models))]
+    try:
+      # Both ways are submitted before either is collected, so the scheduler interleaves them; the
+      # document threads only wait on the scheduler, which makes (and caps) the calls
+      with ThreadPoolExecutor(max_workers=max(1, min(64, len(cells)))) as document_executor:
+        direct_futures = {(m, p): scheduler.submit(models[m], 'summarize', prompts[p]) for m, p in cells}
+        chunked_futures = {(m, p): submit_document(models[m], prompts[p], scheduler, document_executor, chunk_chars) for m, p in cells}
+        models_summarizations = collect_summaries(direct_futures, len(models), len(prompts))
+        models_chunked_summarizations = collect_summaries(chunked_futures, len(models), len(prompts))
+    finally:
+      if own_scheduler:
+        scheduler.shutdown()
+  elif n_samples > 1:
+    # One ResultMatrix per sample; see inferences.functions.sample
+    models_summarizations = sample('summarize', [prompts], models, n_samples)
+  else:
+    models_summarizations = summarize(
+      prompts=prompts,
+      models=models
+    )
+
+  if n_samples > 1:
+    evaluations, sample_evaluations = score_samples(score_summarization, models_summarizations, return_sample_scores=return_sample_scores, references=references, evaluation_details=evaluation_details, metric_cache=metric_cache)
+  else:
+    evaluations, sample_evaluations = score_summarization(models_summarizations, references, evaluation_details, metric_cache, return_sample_scores)
+
+  if long_document:
+    # Chunked scores are reported next to the direct ones with a chunked_ prefix, along with the mean
+    # latency of each way; failed summaries, direct or chunked, score as empty ones
+    chunked_evaluations, chunked_sample_evaluations = score_summarization(models_chunked_summarizations, references, evaluation_details, metric_cache, return_sample_scores)
+    evaluations.update({f'chunked_{metric}': scores for metric, scores in chunked_evaluations.items()})
+    sample_evaluations.update({f'chunked_{metric}': scores for metric, scores in chunked_sample_evaluations.items()})
+    evaluations['latency'] = [mean_latency(model_summarizations.latencies) for model_summarizations in models_summarizations]
+    evaluations['chunked_latency'] = [mean_latency(model_summarizations.latencies) for model_summarizations in models_chunked_summarizations]
+    models_summarizations = {'direct': models_summarizations, 'chunked': models_chunked_summarizations}
+
+  if return_sample_scores:
+    return models_summarizations, evaluations, sample_evaluations
+
   return models_summarizations, evaluations
 
 if __name__ == "__main__":
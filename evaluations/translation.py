@@ -1,53 +1,29 @@
-from models.openai_module import OpenAIModel
-from models.anthropic_module import AnthropicModel
-from models.cohere_module import CohereModel
-from models.groq_module import GroqModel
-from models.google_generative_ai_module import GoogleGenerativeAIModel
-from models.google_vertex_ai_module import GoogleVertexAIModel
-from inferences.functions import translate
-from metrics.base_metrics import calc_bleu_score, calc_rouge_score
-from typing import List, Dict, Tuple
-
-def evaluate_translation(prompts: List[str], src_langs: List[str], tgt_langs: List[str], references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str]) -> Tuple[List[List[str]], Dict[str, List[float]]]:
-  models = []
-
-  for model_detail in model_details:
-    if model_detail["source"] == "openai":
-      models.append(OpenAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "anthropic":
-      models.append(AnthropicModel(model=model_detail["model"]))
-    elif model_detail["source"] == "cohere":
-      models.append(CohereModel(model=model_detail["model"]))
-    elif model_detail["source"] == "groq":
-      models.append(GroqModel(model=model_detail["model"]))
-    elif model_detail["source"] == "genai":
-      models.append(GoogleGenerativeAIModel(model=model_detail["model"]))
-    elif model_detail["source"] == "vertexai":
-      models.append(GoogleVertexAIModel(model=model_detail["model"]))
-    
-  all_results = translate(
-    prompts=prompts,
-    src_langs=src_langs,
-    tgt_langs=tgt_langs,
-    models=models
-  )
-
-  models_translations = [[None for _ in prompts] for _ in models]
-
-  for prompt_results in all_results:
-    for prompt_index, model_index, translation in prompt_results:
-      models_translations[model_index][prompt_index] = translation
-
+from models.registry import load_models
+from inferences.functions import translate, sample
+from inferences.packing import packed_translate
+from inferences.result_matrix import ResultMatrix
+from evaluations.sampling import score_samples
+from metrics.base_metrics import calc_bleu_sample_statistics, calc_bleu_score_from_statistics, calc_rouge_score, calc_rouge_sample_scores
+from metrics.metric_cache import MetricCache
+from typing import List, Dict, Tuple, Optional, Union
+
+def score_translation(models_translations: ResultMatrix, references: List[List[str]], evaluation_details: List[str], metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False) -> Tuple[Dict[str, List[float]], Dict[str, List[List]]]:
   evaluations = {}
+  sample_evaluations = {}
 
   if 'bleu' in evaluation_details:
     bleu_scores = []
+    bleu_statistics = []
 
     for model_translations in models_translations:
-      bleu_score = calc_bleu_score(model_translations, references)
+      # Per-sample BLEU statistics, which add up to the corpus score and are what the bootstrap resamples
+      model_bleu_statistics = calc_bleu_sample_statistics(model_translations, references, cache=metric_cache)
+      bleu_score = calc_bleu_score_from_statistics(model_bleu_statistics)
       bleu_scores.append(bleu_score['bleu'])
+      bleu_statistics.append(model_bleu_statistics)
 
     evaluations['bleu'] = bleu_scores
+    sample_evaluations['bleu'] = bleu_statistics
 
   if 'rouge' in evaluation_details:
     rouge1_scores = []
@@ -56,7 +32,7 @@ def evaluate_translation(prompts: List[str], src_langs: List[str], tgt_langs: Li
     rougeLsum_scores = []
 
     for model_translations in models_translations:
-      rouge_score = calc_rouge_score(model_translations, references)
+      rouge_score = calc_rouge_score(model_translations, references, cache=metric_cache)
       rouge1_scores.append(rouge_score['rouge1'])
       rouge2_scores.append(rouge_score['rouge2'])
       rougeL_scores.append(rouge_score['rougeL'])
@@ -67,6 +43,41 @@ def evaluate_translation(prompts: List[str], src_langs: List[str], tgt_langs: Li
     evaluations['rougel'] = rougeL_scores
     evaluations['rougelsum'] = rougeLsum_scores
 
+    if return_sample_scores:
+      models_rouge_samples = [calc_rouge_sample_scores(outputs, references, cache=metric_cache) for outputs in models_translations]
+      for rouge_type, metric in [('rouge1', 'rouge1'), ('rouge2', 'rouge2'), ('rougeL', 'rougel'), ('rougeLsum', 'rougelsum')]:
+        sample_evaluations[metric] = [rouge_samples[rouge_type] for rouge_samples in models_rouge_samples]
+
+  return evaluations, sample_evaluations
+
+def evaluate_translation(prompts: List[str], src_langs: List[str], tgt_langs: List[str], references: List[List[str]], model_details: List[Dict[str, str]], evaluation_details: List[str], metric_cache: Optional[MetricCache] = None, return_sample_scores: bool = False, pack_size: Optional[int] = None, n_samples: int = 1) -> Union[Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]]], Tuple[Union[ResultMatrix, List[ResultMatrix]], Dict[str, List[float]], Dict[str, List[List]]]]:
+  models = load_models(model_details)
+
+  if n_samples > 1 and pack_size is not None and pack_size > 1:
+    raise ValueError("pack_size cannot be combined with n_samples.")
+
+  if n_samples > 1:
+    # One ResultMatrix per sample; see inferences.functions.sample
+    models_translations = sample('translate', [prompts, src_langs, tgt_langs], models, n_samples)
+  elif pack_size is not None and pack_size > 1:
+    # Several prompts per request; see inferences.packing.PACK_SIZES
+    models_translations = packed_translate(prompts=prompts, src_langs=src_langs, tgt_langs=tgt_langs, models=models, pack_size=pack_size)
+  else:
+    models_translations = translate(
+      prompts=prompts,
+      src_langs=src_langs,
+      tgt_langs=tgt_langs,
+      models=models
+    )
+
+  if n_samples > 1:
+    evaluations, sample_evaluations = score_samples(score_translation, models_translations, return_sample_scores=return_sample_scores, references=references, evaluation_details=evaluation_details, metric_cache=metric_cache)
+  else:
+    evaluations, sample_evaluations = score_translation(models_translations, references, evaluation_details, metric_cache, return_sample_scores)
+
+  if return_sample_scores:
+    return models_translations, evaluations, sample_evaluations
+
   return models_translations, evaluations
 
 if __name__ == "__main__":
@@ -0,0 +1,357 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from models.registry import load_model
+from inferences.scheduler import InferenceScheduler
+from inferences.result_matrix import ResultMatrix
+from evaluations.pipeline import PIPELINE_TASKS, validate_task_spec, submit_inference, score_task, merge_model_scores
+from metrics.metric_cache import MetricCache
+
+# Evaluation spread over any number of worker processes and machines through one SQLite file, with no
+# broker. A job's (task, model, prompt) grid is split into leases: an 'infer' lease per chunk of prompts
+# of one (task, model) and a 'score' lease per (task, model), which becomes claimable once all of that
+# pair's infer leases are done. Workers claim a lease, keep it alive with heartbeats while working on
+# it and write its result back; a lease whose heartbeat stops (a crashed or partitioned worker) expires
+# and is handed to another worker. Every claim bumps the lease's attempt number, and heartbeats and
+# results from an older attempt are ignored, so a slow worker can never overwrite its successor.
+#
+# SQLite's locking needs a filesystem with working POSIX locks (a local disk, or a network filesystem
+# that supports them). Expiry compares wall clocks across machines, so keep lease_timeout well above
+# the clock skew between them.
+
+LEASE_KINDS = ('infer', 'score')
+
+# Matches a lease only while it is still claimed by the same worker and attempt
+OWNED_LEASE = "lease_id = ? AND worker = ? AND attempts = ? AND status = 'claimed'"
+
+# A score lease can never run once one of its (task, model) infer leases has failed for good, so it
+# fails with it rather than staying blocked (which would keep has_work() true forever)
+FAIL_BLOCKED_SCORES = (
+  "UPDATE leases SET status = 'failed', error = 'inference failed: ' || ("
+  "SELECT infer.error FROM leases AS infer WHERE infer.job_id = leases.job_id AND infer.task = leases.task "
+  "AND infer.model_index = leases.model_index AND infer.kind = 'infer' AND infer.status = 'failed' LIMIT 1) "
+  "WHERE kind = 'score' AND status = 'blocked' AND EXISTS ("
+  "SELECT 1 FROM leases AS infer WHERE infer.job_id = leases.job_id AND infer.task = leases.task "
+  "AND infer.model_index = leases.model_index AND infer.kind = 'infer' AND infer.status = 'failed')"
+)
+
+class WorkQueue:
+  """Jobs and their leases in a SQLite file shared by a coordinator and workers."""
+
+  def __init__(self, path: str, lease_timeout: float = 120.0, max_attempts: int = 3):
+    if path != ":memory:":
+      os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self.path = path
+    self.lease_timeout = lease_timeout
+    self.max_attempts = max_attempts
+    self._lock = threading.Lock()
+    # Transactions are managed explicitly, so a claim can take the write lock before it reads
+    self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+    with self._transaction() as connection:
+      connection.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, spec TEXT NOT NULL, created_at REAL NOT NULL)")
+      connection.execute(
+        "CREATE TABLE IF NOT EXISTS leases ("
+        "lease_id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, kind TEXT NOT NULL, task TEXT NOT NULL, "
+        "model_index INTEGER NOT NULL, prompt_start INTEGER NOT NULL, prompt_end INTEGER NOT NULL, "
+        # status: blocked (score leases waiting for inference), pending, claimed, done or failed
+        "status TEXT NOT NULL, worker TEXT, attempts INTEGER NOT NULL DEFAULT 0, heartbeat_at REAL, result TEXT, error TEXT)"
+      )
+      connection.execute("CREATE INDEX IF NOT EXISTS leases_status ON leases (status, kind)")
+      connection.execute("CREATE INDEX IF NOT EXISTS leases_group ON leases (job_id, task, model_index, kind)")
+    self._connection.execute("PRAGMA journal_mode=WAL")
+
+  @contextmanager
+  def _transaction(self) -> Iterator[sqlite3.Connection]:
+    with self._lock:
+      self._connection.execute("BEGIN IMMEDIATE")
+      try:
+        yield self._connection
+      except BaseException:
+        self._connection.execute("ROLLBACK")
+        raise
+      self._connection.execute("COMMIT")
+
+  def submit_job(self, tasks: Dict[str, Dict[str, Any]], model_details: List[Dict[str, str]], prompts_per_lease: int = 20, return_sample_scores: bool = False, job_id: Optional[str] = None) -> str:
+    # tasks and model_details as in run_pipeline
+    for task, task_spec in tasks.items():
+      if task not in PIPELINE_TASKS:
+        raise ValueError(f"Unknown task: {task}. Expected one of {', '.join(PIPELINE_TASKS)}.")
+      validate_task_spec(task, task_spec)
+    if prompts_per_lease < 1:
+      raise ValueError("prompts_per_lease must be at least 1.")
+    job_id = job_id or uuid.uuid4().hex
+    spec = {'tasks': tasks, 'model_details': model_details, 'return_sample_scores': return_sample_scores}
+
+    leases = []
+    for task, task_spec in tasks.items():
+      num_prompts = len(task_spec['inputs']['prompts'])
+      for model_index in range(len(model_details)):
+        for start in range(0, num_prompts, prompts_per_lease):
+          leases.append((job_id, 'infer', task, model_index, start, min(start + prompts_per_lease, num_prompts), 'pending'))
+        leases.append((job_id, 'score', task, model_index, 0, num_prompts, 'pending' if num_prompts == 0 else 'blocked'))
+
+    with self._transaction() as connection:
+      connection.execute("INSERT INTO jobs (job_id, spec, created_at) VALUES (?, ?, ?)", (job_id, json.dumps(spec), time.time()))
+      connection.executemany("INSERT INTO leases (job_id, kind, task, model_index, prompt_start, prompt_end, status) VALUES (?, ?, ?, ?, ?, ?, ?)", leases)
+    return job_id
+
+  def job_spec(self, job_id: str) -> Dict[str, Any]:
+    with self._lock:
+      row = self._connection.execute("SELECT spec FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+      raise ValueError(f"Unknown job: {job_id}")
+    return json.loads(row[0])
+
+  def claim(self, worker: str, kinds: Sequence[str] = LEASE_KINDS) -> Optional[Dict[str, Any]]:
+    # Score leases go first, so finished (task, model) pairs are scored while inference continues
+    now = time.time()
+    expired_before = now - self.lease_timeout
+    kind_placeholders = ",".join("?" * len(kinds))
+    with self._transaction() as connection:
+      expired = connection.execute(
+        "UPDATE leases SET status = 'failed', error = 'lease expired ' || attempts || ' times' WHERE status = 'claimed' AND heartbeat_at < ? AND attempts >= ?",
+        (expired_before, self.max_attempts),
+      )
+      if expired.rowcount > 0:
+        connection.execute(FAIL_BLOCKED_SCORES)
+      row = connection.execute(
+        "SELECT lease_id, job_id, kind, task, model_index, prompt_start, prompt_end, attempts FROM leases "
+        f"WHERE kind IN ({kind_placeholders}) AND (status = 'pending' OR (status = 'claimed' AND heartbeat_at < ?)) "
+        "ORDER BY kind = 'score' DESC, lease_id LIMIT 1",
+        (*kinds, expired_before),
+      ).fetchone()
+      if row is None:
+        return None
+      connection.execute("UPDATE leases SET status = 'claimed', worker = ?, attempts = attempts + 1, heartbeat_at = ? WHERE lease_id = ?", (worker, now, row[0]))
+    lease_id, job_id, kind, task, model_index, prompt_start, prompt_end, attempts = row
+    return {'lease_id': lease_id, 'job_id': job_id, 'kind': kind, 'task': task, 'model_index': model_index, 'prompt_start': prompt_start, 'prompt_end': prompt_end, 'attempt': attempts + 1, 'worker': worker}
+
+  def heartbeat(self, lease: Dict[str, Any]) -> bool:
+    # False once the lease has expired and been claimed by someone else
+    with self._transaction() as connection:
+      cursor = connection.execute(f"UPDATE leases SET heartbeat_at = ? WHERE {OWNED_LEASE}", (time.time(), lease['lease_id'], lease['worker'], lease['attempt']))
+    return cursor.rowcount == 1
+
+  def complete(self, lease: Dict[str, Any], result: Dict[str, Any]) -> bool:
+    with self._transaction() as connection:
+      cursor = connection.execute(f"UPDATE leases SET status = 'done', result = ?, error = NULL WHERE {OWNED_LEASE}", (json.dumps(result), lease['lease_id'], lease['worker'], lease['attempt']))
+      if cursor.rowcount != 1:
+        return False
+      if lease['kind'] == 'infer':
+        group = (lease['job_id'], lease['task'], lease['model_index'])
+        remaining = connection.execute("SELECT COUNT(*) FROM leases WHERE job_id = ? AND task = ? AND model_index = ? AND kind = 'infer' AND status != 'done'", group).fetchone()[0]
+        if remaining == 0:
+          connection.execute("UPDATE leases SET status = 'pending' WHERE job_id = ? AND task = ? AND model_index = ? AND kind = 'score' AND status = 'blocked'", group)
+    return True
+
+  def fail(self, lease: Dict[str, Any], error: str) -> bool:
+    # The lease goes back to pending until it has been attempted max_attempts times
+    status = 'failed' if lease['attempt'] >= self.max_attempts else 'pending'
+    with self._transaction() as connection:
+      cursor = connection.execute(f"UPDATE leases SET status = ?, error = ? WHERE {OWNED_LEASE}", (status, error, lease['lease_id'], lease['worker'], lease['attempt']))
+      if cursor.rowcount == 1 and status == 'failed' and lease['kind'] == 'infer':
+        connection.execute(FAIL_BLOCKED_SCORES)
+    return cursor.rowcount == 1
+
+  def infer_results(self, job_id: str, task: str, model_index: int) -> List[Tuple[int, int, Dict[str, Any]]]:
+    with self._lock:
+      rows = self._connection.execute(
+        "SELECT prompt_start, prompt_end, result FROM leases WHERE job_id = ? AND task = ? AND model_index = ? AND kind = 'infer' AND status = 'done' ORDER BY prompt_start",
+        (job_id, task, model_index),
+      ).fetchall()
+    return [(start, end, json.loads(result)) for start, end, result in rows]
+
+  def has_work(self, kinds: Sequence[str] = LEASE_KINDS) -> bool:
+    # Blocked score leases count, since they become pending once inference finishes
+    kind_placeholders = ",".join("?" * len(kinds))
+    with self._lock:
+      return self._connection.execute(f"SELECT EXISTS (SELECT 1 FROM leases WHERE kind IN ({kind_placeholders}) AND status IN ('blocked', 'pending', 'claimed'))", tuple(kinds)).fetchone()[0] == 1
+
+  def progress(self, job_id: str) -> Dict[str, Dict[str, int]]:
+    with self._lock:
+      rows = self._connection.execute("SELECT kind, status, COUNT(*) FROM leases WHERE job_id = ? GROUP BY kind, status", (job_id,)).fetchall()
+    progress: Dict[str, Dict[str, int]] = {kind: {} for kind in LEASE_KINDS}
+    for kind, status, count in rows:
+      progress[kind][status] = count
+    return progress
+
+  def job_results(self, job_id: str) -> Dict[str, Tuple]:
+    # Merges the leases into what run_pipeline returns for the same job
+    spec = self.job_spec(job_id)
+    with self._lock:
+      rows = self._connection.execute("SELECT kind, task, model_index, prompt_start, prompt_end, status, result, error FROM leases WHERE job_id = ?", (job_id,)).fetchall()
+    failed = [row for row in rows if row[5] == 'failed']
+    if failed:
+      kind, task, model_index, start, end, _, _, error = failed[0]
+      raise ValueError(f"{len(failed)} leases of job {job_id} failed, e.g. {kind} {task} model {model_index} prompts {start}-{end}: {error}")
+    if any(row[5] != 'done' for row in rows):
+      raise ValueError(f"Job {job_id} is not finished: {self.progress(job_id)}")
+
+    num_models = len(spec['model_details'])
+    results = {task: ResultMatrix(num_models, len(task_spec['inputs']['prompts'])) for task, task_spec in spec['tasks'].items()}
+    scores: Dict[str, List[Any]] = {task: [None] * num_models for task in spec['tasks']}
+    for kind, task, model_index, start, _, _, result, _ in rows:
+      result = json.loads(result)
+      if kind == 'infer':
+        for prompt_index, (output, latency) in enumerate(zip(result['outputs'], result['latencies']), start):
+          results[task].set(model_index, prompt_index, output, latency)
+      else:
+        scores[task][model_index] = ({metric: [value] for metric, value in result['evaluations'].items()}, {metric: [samples] for metric, samples in result['sample_evaluations'].items()})
+
+    outputs = {}
+    for task in spec['tasks']:
+      evaluations, sample_evaluations = merge_model_scores(scores[task])
+      outputs[task] = (results[task], evaluations, sample_evaluations) if spec['return_sample_scores'] else (results[task], evaluations)
+    return outputs
+
+  def wait_for_job(self, job_id: str, poll_interval: float = 2.0, timeout: Optional[float] = None) -> Dict[str, Tuple]:
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+      progress = self.progress(job_id)
+      statuses = {status for counts in progress.values() for status in counts}
+      if 'failed' in statuses or statuses <= {'done'}:
+        return self.job_results(job_id)
+      if deadline is not None and time.time() > deadline:
+        raise TimeoutError(f"Job {job_id} did not finish within {timeout} seconds: {progress}")
+      time.sleep(poll_interval)
+
+  def close(self) -> None:
+    with self._lock:
+      self._connection.close()
+
+class QueueWorker:
+  """Claims and runs leases from a WorkQueue; run one per process (or machine) to scale out.
+
+  Infer leases go through an InferenceScheduler, so one worker keeps several requests in flight per
+  model. Score leases are CPU-bound; run more worker processes (e.g. with kinds=('score',)) to use more cores.
+  """
+
+  def __init__(self, work_queue: WorkQueue, worker_id: Optional[str] = None, kinds: Sequence[str] = LEASE_KINDS, scheduler: Optional[InferenceScheduler] = None, metric_cache: Optional[MetricCache] = None):
+    for kind in kinds:
+      if kind not in LEASE_KINDS:
+        raise ValueError(f"Unknown lease kind: {kind}. Expected one of {', '.join(LEASE_KINDS)}.")
+    self.work_queue = work_queue
+    self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    self.kinds = tuple(kinds)
+    self.scheduler = scheduler or InferenceScheduler()
+    self.metric_cache = metric_cache
+    # Waits on the scheduler for long-document map-reduces (see run_pipeline); threads start on first use
+    self.document_executor = ThreadPoolExecutor(max_workers=64)
+    self._job_specs: Dict[str, Dict[str, Any]] = {}
+
+  def _job_spec(self, job_id: str) -> Dict[str, Any]:
+    if job_id not in self._job_specs:
+      self._job_specs[job_id] = self.work_queue.job_spec(job_id)
+    return self._job_specs[job_id]
+
+  def infer(self, lease: Dict[str, Any]) -> Dict[str, Any]:
+    spec = self._job_spec(lease['job_id'])
+    task_spec = spec['tasks'][lease['task']]
+    pipeline_task = PIPELINE_TASKS[lease['task']]
+    model = load_model(spec['model_details'][lease['model_index']])
+    prompt_indices = range(lease['prompt_start'], lease['prompt_end'])
+    futures = [
+      submit_inference(self.scheduler, self.document_executor, lease['task'], task_spec, model, tuple(task_spec['inputs'][name][prompt_index] for name in pipeline_task['prompt_inputs']))
+      for prompt_index in prompt_indices
+    ]
+    outputs = [future.result() for future in futures]
+    return {'outputs': [output for output, _ in outputs], 'latencies': [latency for _, latency in outputs]}
+
+  def score(self, lease: Dict[str, Any]) -> Dict[str, Any]:
+    spec = self._job_spec(lease['job_id'])
+    task_spec = spec['tasks'][lease['task']]
+    model_outputs = ResultMatrix(1, len(task_spec['inputs']['prompts']))
+    for start, _, result in self.work_queue.infer_results(lease['job_id'], lease['task'], lease['model_index']):
+      for prompt_index, (output, latency) in enumerate(zip(result['outputs'], result['latencies']), start):
+        model_outputs.set(0, prompt_index, output, latency)
+    evaluations, sample_evaluations = score_task(lease['task'], task_spec, model_outputs, self.metric_cache, spec['return_sample_scores'])
+    return {
+      'evaluations': {metric: scores[0] for metric, scores in evaluations.items()},
+      'sample_evaluations': {metric: samples[0] for metric, samples in sample_evaluations.items()},
+    }
+
+  def run_lease(self, lease: Dict[str, Any]) -> bool:
+    # Heartbeats run on their own thread while the lease is being worked on
+    stopped = threading.Event()
+
+    def beat() -> None:
+      while not stopped.wait(self.work_queue.lease_timeout / 3):
+        if not self.work_queue.heartbeat(lease):
+          return
+
+    heartbeat_thread = threading.Thread(target=beat, daemon=True)
+    heartbeat_thread.start()
+    try:
+      result = self.infer(lease) if lease['kind'] == 'infer' else self.score(lease)
+    except Exception as exception:
+      self.work_queue.fail(lease, f"{type(exception).__name__}: {exception}")
+      return False
+    finally:
+      stopped.set()
+      heartbeat_thread.join()
+    return self.work_queue.complete(lease, result)
+
+  def run(self, concurrency: int = 4, poll_interval: float = 1.0, exit_when_idle: bool = False) -> None:
+    # Each of `concurrency` threads works on one lease at a time
+    def loop() -> None:
+      while True:
+        lease = self.work_queue.claim(self.worker_id, self.kinds)
+        if lease is not None:
+          self.run_lease(lease)
+        elif exit_when_idle and not self.work_queue.has_work(self.kinds):
+          return
+        else:
+          time.sleep(poll_interval)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+if __name__ == "__main__":
+  import argparse
+  import tempfile
+
+  parser = argparse.ArgumentParser(description="Work Queue Arguments")
+  parser.add_argument('--queue', default=os.path.join(tempfile.gettempdir(), "work_queue.sqlite"), help='Work Queue SQLite Path')
+  parser.add_argument('--worker', action='store_true', help='Run As A Worker Until Stopped')
+  parser.add_argument('--kinds', default="infer,score", help='Lease Kinds This Worker Takes')
+  parser.add_argument('--concurrency', type=int, default=4, help='Leases Worked On At Once')
+  parser.add_argument('--openai', action='store_true', help='Include OpenAI Model')
+  parser.add_argument('--anthropic', action='store_true', help='Include Anthropic Model')
+  args = parser.parse_args()
+
+  work_queue = WorkQueue(args.queue)
+  if args.worker:
+    QueueWorker(work_queue, kinds=args.kinds.split(",")).run(concurrency=args.concurrency)
+  else:
+    # Coordinator: submits a job, works on it in this process too, then merges the results.
+    # Start more workers against the same --queue with --worker to share the work.
+    model_details = []
+    if args.openai:
+      model_details.append({"source": "openai", "model": "gpt-4-0125-preview"})
+    if args.anthropic:
+      model_details.append({"source": "anthropic", "model": "claude-3-opus-20240229"})
+    tasks = {
+      'summarization': {
+        'inputs': {
+          'prompts': ["The Eiffel Tower, completed in 1889, was the tallest man-made structure in the world for 41 years."] * 4,
+          'references': [["The Eiffel Tower was the world's tallest structure for 41 years after 1889."]] * 4,
+        },
+        'evaluation_details': ['rouge'],
+      },
+    }
+    job_id = work_queue.submit_job(tasks, model_details, prompts_per_lease=2)
+    print(f"Job {job_id}: {work_queue.progress(job_id)}")
+    QueueWorker(work_queue).run(concurrency=args.concurrency, exit_when_idle=True)
+    for task, (models_outputs, evaluations) in work_queue.wait_for_job(job_id).items():
+      for model_index, model_detail in enumerate(model_details):
+        print(f"{task} - Model: {model_detail['source']}, Model Name: {model_detail['model']}, Scores: {({metric: scores[model_index] for metric, scores in evaluations.items()})}")
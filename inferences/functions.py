@@ -1,121 +1,194 @@
-from typing import List, Tuple
+import time
+from typing import Any, Callable, List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from models.base_module import BaseModel
+from inferences.result_matrix import ResultMatrix
 
-def translate(prompts: List[str], src_langs: List[str], tgt_langs: List[str], models: List[BaseModel]) -> List[List[Tuple[int, int, str]]]:
-    all_results = []  # To store results for all prompts
+def timed_call(function: Callable[..., str], *args: Any) -> Tuple[str, float]:
+    # The output of a model call and its wall-clock latency in seconds
+    start = time.perf_counter()
+    output = function(*args)
+    return output, time.perf_counter() - start
 
+def translate(prompts: List[str], src_langs: List[str], tgt_langs: List[str], models: List[BaseModel]) -> ResultMatrix:
     # Validate input lengths
     if not (len(prompts) == len(src_langs) == len(tgt_langs)):
         raise ValueError("The lengths of prompts, src_langs, and tgt_langs must be equal.")
-    
+
+    results = ResultMatrix(len(models), len(prompts))
+
     for prompt_index, (prompt, src_lang, tgt_lang) in enumerate(zip(prompts, src_langs, tgt_langs)):
         with ThreadPoolExecutor() as executor:
             # Mapping each future to a tuple containing model index and prompt index
             future_to_indexes = {
-                executor.submit(model.translate, prompt, src_lang, tgt_lang): (model_index, prompt_index)
+                executor.submit(timed_call, model.translate, prompt, src_lang, tgt_lang): (model_index, prompt_index)
                 for model_index, model in enumerate(models)
             }
-            
-            temp_results = []
+
             for future in as_completed(future_to_indexes):
                 model_index, prompt_index = future_to_indexes[future]
-                translation = future.result()
-                # Each result now also includes the prompt index
-                temp_results.append((prompt_index, model_index, translation))
+                translation, latency = future.result()
+                results.set(model_index, prompt_index, translation, latency)
 
-            # Sort the results primarily by prompt index, then by model index
-            temp_results.sort(key=lambda x: (x[0], x[1]))
-            all_results.append(temp_results)
-    
-    return all_results
+    return results
 
-def summarize(prompts: List[str], models: List[BaseModel]) -> List[List[Tuple[int, int, str]]]:
-    all_results = []
+def summarize(prompts: List[str], models: List[BaseModel]) -> ResultMatrix:
+    results = ResultMatrix(len(models), len(prompts))
 
     with ThreadPoolExecutor() as executor:
         for prompt_index, prompt in enumerate(prompts):
             future_to_indexes = {
-                executor.submit(model.summarize, prompt): (model_index, prompt_index)
+                executor.submit(timed_call, model.summarize, prompt): (model_index, prompt_index)
                 for model_index, model in enumerate(models)
             }
-            
-            temp_results = []
+
             for future in as_completed(future_to_indexes):
                 model_index, prompt_index = future_to_indexes[future]
-                summary = future.result()
-                temp_results.append((prompt_index, model_index, summary))
+                summary, latency = future.result()
+                results.set(model_index, prompt_index, summary, latency)
 
-            temp_results.sort(key=lambda x: (x[0], x[1]))
-            all_results.append(temp_results)
+    return results
 
-    return all_results
-
-def q_and_a(prompts: List[str], models: List[BaseModel]) -> List[List[Tuple[int, int, str]]]:
-    all_results = []
+def q_and_a(prompts: List[str], models: List[BaseModel]) -> ResultMatrix:
+    results = ResultMatrix(len(models), len(prompts))
 
     with ThreadPoolExecutor() as executor:
         for prompt_index, prompt in enumerate(prompts):
             future_to_indexes = {
-                executor.submit(model.q_and_a, prompt): (model_index, prompt_index)
+                executor.submit(timed_call, model.q_and_a, prompt): (model_index, prompt_index)
                 for model_index, model in enumerate(models)
             }
-            
-            temp_results = []
+
             for future in as_completed(future_to_indexes):
                 model_index, prompt_index = future_to_indexes[future]
-                answer = future.result()
-                temp_results.append((prompt_index, model_index, answer))
-
-            temp_results.sort(key=lambda x: (x[0], x[1]))
-            all_results.append(temp_results)
+                answer, latency = future.result()
+                results.set(model_index, prompt_index, answer, latency)
 
-    return all_results
+    return results
 
-def complete_sentence(prompts: List[str], models: List[BaseModel]) -> List[List[Tuple[int, int, str]]]:
-    all_results = []
+def complete_sentence(prompts: List[str], models: List[BaseModel]) -> ResultMatrix:
+    results = ResultMatrix(len(models), len(prompts))
 
     with ThreadPoolExecutor() as executor:
         for prompt_index, prompt in enumerate(prompts):
             future_to_indexes = {
-                executor.submit(model.complete_sentence, prompt): (model_index, prompt_index)
+                executor.submit(timed_call, model.complete_sentence, prompt): (model_index, prompt_index)
                 for model_index, model in enumerate(models)
             }
-            
-            temp_results = []
+
             for future in as_completed(future_to_indexes):
                 model_index, prompt_index = future_to_indexes[future]
-                completion = future.result()
-                temp_results.append((prompt_index, model_index, completion))
-
-            temp_results.sort(key=lambda x: (x[0], x[1]))
-            all_results.append(temp_results)
-
-    return all_results
+                completion, latency = future.result()
+                results.set(model_index, prompt_index, completion, latency)
 
-def complete_missing_word(prompts: List[str], models: List[BaseModel], missing_words: List[List[str]]) -> List[List[Tuple[int, int, str]]]:
-    all_results = []
+    return results
 
+def complete_missing_word(prompts: List[str], models: List[BaseModel], missing_words: List[List[str]]) -> ResultMatrix:
     if not (len(prompts) == len(missing_words)):
         raise ValueError("The lengths of prompts and missing_words_list must be equal.")
-    
+
+    results = ResultMatrix(len(models), len(prompts))
+
     for prompt_index, (prompt, missing_word_group) in enumerate(zip(prompts, missing_words)):
         with ThreadPoolExecutor() as executor:
             future_to_indexes = {
-                executor.submit(model.complete_missing_word, prompt, missing_word_group): (model_index, prompt_index)
+                executor.submit(timed_call, model.complete_missing_word, prompt, missing_word_group): (model_index, prompt_index)
                 for model_index, model in enumerate(models)
             }
-            
-            temp_results = []
+
             for future in as_completed(future_to_indexes):
                 model_index, prompt_index = future_to_indexes[future]
-                completion = future.result()
-                temp_results.append((prompt_index, model_index, completion))
+                completion, latency = future.result()
+                results.set(model_index, prompt_index, completion, latency)
+
+    return results
+
+def normalize_word(word: str) -> str:
+    return word.strip().strip("\"'`*.,;:!?").lower()
+
+def match_option(output: Optional[str], options: List[str]) -> Optional[int]:
+    # Index of the option the output names, ignoring case, whitespace and surrounding punctuation
+    normalized_options = [normalize_word(option) for option in options]
+    normalized_output = normalize_word(output or "")
+    return normalized_options.index(normalized_output) if normalized_output in normalized_options else None
+
+def choose_missing_word(model: BaseModel, prompt: str, missing_words: List[str]) -> Tuple[Optional[str], List[float]]:
+    # The most probable option from the model's log probabilities, or else its generated answer matched
+    # to an option (a one-hot distribution; all zeros if it names none of them)
+    probabilities = model.score_options(prompt, missing_words)
+    if probabilities is not None:
+        return missing_words[max(range(len(missing_words)), key=lambda index: probabilities[index])], probabilities
+    output = model.complete_missing_word(prompt, missing_words)
+    option_index = match_option(output, missing_words)
+    return (output if option_index is None else missing_words[option_index]), [float(index == option_index) for index in range(len(missing_words))]
+
+def complete_missing_word_by_logprobs(prompts: List[str], models: List[BaseModel], missing_words: List[List[str]]) -> Tuple[ResultMatrix, List[List[List[float]]]]:
+    # Also returns the probability of every option, per model and prompt
+    if not (len(prompts) == len(missing_words)):
+        raise ValueError("The lengths of prompts and missing_words_list must be equal.")
+
+    results = ResultMatrix(len(models), len(prompts))
+    probabilities: List[List[List[float]]] = [[[] for _ in prompts] for _ in models]
+
+    with ThreadPoolExecutor() as executor:
+        future_to_indexes = {
+            executor.submit(timed_call, choose_missing_word, model, prompt, missing_word_group): (model_index, prompt_index)
+            for prompt_index, (prompt, missing_word_group) in enumerate(zip(prompts, missing_words))
+            for model_index, model in enumerate(models)
+        }
+
+        for future in as_completed(future_to_indexes):
+            model_index, prompt_index = future_to_indexes[future]
+            (completion, option_probabilities), latency = future.result()
+            results.set(model_index, prompt_index, completion, latency)
+            probabilities[model_index][prompt_index] = option_probabilities
+
+    return results, probabilities
+
+def sample(method: str, prompt_inputs: List[List[Any]], models: List[BaseModel], n_samples: int) -> List[ResultMatrix]:
+    # n_samples outputs of a task method (e.g. "q_and_a") per model and prompt, as one ResultMatrix per
+    # sample index. prompt_inputs are the method's per-prompt arguments, e.g. [prompts] or
+    # [prompts, src_langs, tgt_langs]; the samples of a cell share the latency of the call that made them.
+    if n_samples < 1:
+        raise ValueError("n_samples must be at least 1.")
+    if len({len(inputs) for inputs in prompt_inputs}) > 1:
+        raise ValueError("The lengths of the prompt inputs must be equal.")
+
+    num_prompts = len(prompt_inputs[0]) if prompt_inputs else 0
+    samples = [ResultMatrix(len(models), num_prompts) for _ in range(n_samples)]
+
+    with ThreadPoolExecutor() as executor:
+        future_to_indexes = {
+            executor.submit(timed_call, model.sample, method, n_samples, *prompt_args): (model_index, prompt_index)
+            for prompt_index, prompt_args in enumerate(zip(*prompt_inputs))
+            for model_index, model in enumerate(models)
+        }
+
+        for future in as_completed(future_to_indexes):
+            model_index, prompt_index = future_to_indexes[future]
+            outputs, latency = future.result()
+            for sample_index, output in enumerate(outputs):
+                samples[sample_index].set(model_index, prompt_index, output, latency)
+
+    return samples
+
+def call(prompts: List[str], models: List[BaseModel]) -> ResultMatrix:
+    results = ResultMatrix(len(models), len(prompts))
+
+    # All prompts are submitted at once, so a single model (e.g. a judge) still gets concurrent requests
+    with ThreadPoolExecutor() as executor:
+        future_to_indexes = {
+            executor.submit(timed_call, model.call, prompt): (model_index, prompt_index)
+            for prompt_index, prompt in enumerate(prompts)
+            for model_index, model in enumerate(models)
+        }
+
+        for future in as_completed(future_to_indexes):
+            model_index, prompt_index = future_to_indexes[future]
+            output, latency = future.result()
+            results.set(model_index, prompt_index, output, latency)
 
-            temp_results.sort(key=lambda x: (x[0], x[1]))
-            all_results.append(temp_results)
-    
-    return all_results
+    return results
 
 # Test Case
 if __name__ == "__main__":
@@ -159,7 +232,6 @@ if __name__ == "__main__":
   src_langs = ["English", "English", "English"]
   tgt_langs = ["German", "Spanish", "French"]
   all_results = translate(prompts, src_langs, tgt_langs, models)
-  for prompt_results in all_results:
-    for prompt_index, model_index, translation in prompt_results:
-      print(models[model_index])
-      print(f"===== Translation =====\n{src_langs[prompt_index]}: {prompts[prompt_index]}\n{tgt_langs[prompt_index]}: {translation}\n")
+  for prompt_index, model_index, translation in all_results.cells():
+    print(models[model_index])
+    print(f"===== Translation =====\n{src_langs[prompt_index]}: {prompts[prompt_index]}\n{tgt_langs[prompt_index]}: {translation}\nLatency: {all_results.latencies[model_index, prompt_index]:.2f}s\n")
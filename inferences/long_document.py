@@ -0,0 +1,109 @@
+import re
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+from models.base_module import BaseModel
+from inferences.scheduler import InferenceScheduler
+from inferences.functions import timed_call
+from inferences.result_matrix import ResultMatrix
+
+# Map-reduce summarization for documents too long for one call. A document is split into chunks at
+# paragraph and then sentence boundaries, the chunks are summarized concurrently on an
+# InferenceScheduler, and the chunk summaries are merged and summarized again, level by level, until
+# a single summary is left. A document that fits in one chunk is summarized with one call, as usual.
+#
+# Chunk sizes are in characters (roughly 4 per token for English).
+CHUNK_CHARS = 12000
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def split_long_sentence(sentence: str, chunk_chars: int) -> List[str]:
+  # Last resort for a sentence longer than a chunk: cut it at whitespace
+  pieces, current = [], ""
+  for word in sentence.split():
+    if current and len(current) + 1 + len(word) > chunk_chars:
+      pieces.append(current)
+      current = word
+    else:
+      current = f"{current} {word}" if current else word
+  return pieces + [current] if current else pieces
+
+def split_document(text: str, chunk_chars: int = CHUNK_CHARS) -> List[str]:
+  if chunk_chars < 1:
+    raise ValueError("chunk_chars must be at least 1.")
+  # (piece, separator before it): paragraphs are rejoined with a blank line, sentences with a space
+  units: List[Tuple[str, str]] = []
+  for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+    paragraph = paragraph.strip()
+    if not paragraph:
+      continue
+    if len(paragraph) <= chunk_chars:
+      units.append((paragraph, "\n\n"))
+      continue
+    separator = "\n\n"
+    for sentence in SENTENCE_END.split(paragraph):
+      for piece in (split_long_sentence(sentence, chunk_chars) if len(sentence) > chunk_chars else [sentence]):
+        units.append((piece, separator))
+        separator = " "
+
+  chunks: List[str] = []
+  current = ""
+  for piece, separator in units:
+    if current and len(current) + len(separator) + len(piece) > chunk_chars:
+      chunks.append(current)
+      current = piece
+    else:
+      current = f"{current}{separator}{piece}" if current else piece
+  if current:
+    chunks.append(current)
+  return chunks or [text]
+
+def summarize_document(model: BaseModel, text: str, scheduler: InferenceScheduler, chunk_chars: int = CHUNK_CHARS) -> Optional[str]:
+  chunks = split_document(text, chunk_chars)
+  while len(chunks) > 1:
+    futures = [scheduler.submit(model, 'summarize', chunk) for chunk in chunks]
+    summaries = [future.result()[0] or "" for future in futures]
+    merged = split_document("\n\n".join(summaries), chunk_chars)
+    if len(merged) >= len(chunks):
+      # Summaries that did not get shorter are merged in pairs, so every level at least halves the chunks
+      merged = ["\n\n".join(summaries[start:start + 2]) for start in range(0, len(summaries), 2)]
+    chunks = merged
+  return scheduler.submit(model, 'summarize', chunks[0]).result()[0]
+
+def submit_document(model: BaseModel, text: str, scheduler: InferenceScheduler, executor: Executor, chunk_chars: int = CHUNK_CHARS, callback: Optional[Callable[[Future], None]] = None) -> Future:
+  # Like scheduler.submit(model, 'summarize', text), resolving to (summary, latency of the whole
+  # map-reduce). The map-reduce waits on an `executor` thread rather than a scheduler worker, so it never
+  # holds one of the model's slots while its own chunk calls wait for them.
+  future = executor.submit(timed_call, summarize_document, model, text, scheduler, chunk_chars)
+  if callback is not None:
+    future.add_done_callback(callback)
+  return future
+
+def summarize_long_documents(prompts: List[str], models: List[BaseModel], scheduler: Optional[InferenceScheduler] = None, chunk_chars: int = CHUNK_CHARS) -> ResultMatrix:
+  own_scheduler = scheduler is None
+  scheduler = InferenceScheduler() if own_scheduler else scheduler
+  results = ResultMatrix(len(models), len(prompts))
+
+  try:
+    # These threads only wait on the scheduler, which makes (and caps) the calls
+    with ThreadPoolExecutor(max_workers=max(1, min(64, len(models) * len(prompts)))) as executor:
+      future_to_indexes = {
+        submit_document(model, prompt, scheduler, executor, chunk_chars): (model_index, prompt_index)
+        for prompt_index, prompt in enumerate(prompts)
+        for model_index, model in enumerate(models)
+      }
+      for future in as_completed(future_to_indexes):
+        model_index, prompt_index = future_to_indexes[future]
+        summary, latency = future.result()
+        results.set(model_index, prompt_index, summary, latency)
+  finally:
+    if own_scheduler:
+      scheduler.shutdown()
+
+  return results
+
+if __name__ == "__main__":
+  document = "\n\n".join(" ".join(f"Paragraph {p}, sentence {s} of the report." for s in range(1, 6)) for p in range(1, 5))
+  for chunk in split_document(document, chunk_chars=120):
+    print(f"[{len(chunk)}] {chunk!r}")
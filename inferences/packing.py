@@ -0,0 +1,146 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from models.base_module import BaseModel
+from inferences.functions import timed_call, match_option
+from inferences.result_matrix import ResultMatrix
+
+# Prompt packing for tasks whose items are tiny: K items go into one numbered prompt sent with
+# `model.call`, and the response is split back into one output per item by its numbered lines. Items
+# whose line is missing or fails validation (e.g. a missing word that is not one of the options) are
+# re-sent on their own through the task's normal method, as are the items of a packed call that
+# raised, so packing never loses an item. Items with line breaks cannot be numbered unambiguously and
+# are always sent alone.
+#
+# Suggested K per task; larger packs save more requests but raise the chance a response skips items.
+PACK_SIZES: Dict[str, int] = {
+  'translation': 8,
+  'completion_missing_word': 16,
+}
+
+NUMBERED_LINE = re.compile(r"^\s*\**(\d+)\**\s*[.):]\**\s*(.*?)\s*$")
+
+def parse_numbered_lines(response: Optional[str], count: int) -> List[Optional[str]]:
+  # "1. ...", "2) ..." or "3: ..." lines into the outputs of items 1..count; the first line per number
+  # wins. An item followed by unnumbered lines spans several lines, so its first line alone would be a
+  # truncated answer; it is left out (None) and goes through the single-call fallback instead.
+  outputs: List[Optional[str]] = [None] * count
+  continued = [False] * count
+  current = None
+  for line in (response or "").splitlines():
+    match = NUMBERED_LINE.match(line)
+    if match is not None:
+      number = int(match.group(1))
+      current = None
+      if 1 <= number <= count and outputs[number - 1] is None:
+        outputs[number - 1] = match.group(2) or None
+        current = number - 1
+    elif current is not None and line.strip():
+      continued[current] = True
+  return [None if is_continued else output for output, is_continued in zip(outputs, continued)]
+
+def translation_pack_prompt(prompts: Sequence[str], src_lang: str, tgt_lang: str) -> str:
+  newline = "\n"
+  return f"""Instruction:
+- Translate each of the following numbered texts from {src_lang} to {tgt_lang}.
+- Output exactly one line per text, in the form "<number>. <translation>", in the same order.
+- Do not output anything else.
+
+Texts:
+{newline.join(f'{index}. {prompt}' for index, prompt in enumerate(prompts, 1))}
+"""
+
+def missing_word_pack_prompt(prompts: Sequence[str], missing_words: Sequence[List[str]]) -> str:
+  newline = "\n"
+  return f"""Instruction:
+- For each of the following numbered sentences, output the most appropriate missing word (_) out of its options.
+- Output exactly one line per sentence, in the form "<number>. <missing word>", in the same order.
+- Do not output anything else.
+
+Sentences:
+{newline.join(f'{index}. {prompt}{newline}   Options: {" | ".join(options)}' for index, (prompt, options) in enumerate(zip(prompts, missing_words), 1))}
+"""
+
+def packs(item_indices: List[int], group_keys: Sequence, pack_size: int) -> List[List[int]]:
+  # Items sharing a group key (e.g. a language pair) are packed together, in their original order
+  groups: Dict[object, List[int]] = {}
+  for item_index in item_indices:
+    groups.setdefault(group_keys[item_index], []).append(item_index)
+  return [group[start:start + pack_size] for group in groups.values() for start in range(0, len(group), pack_size)]
+
+def run_packed(models: List[BaseModel], num_items: int, pack_size: int, packable: Sequence[bool], group_keys: Sequence, pack_prompt: Callable[[List[int]], str], parse_output: Callable[[int, str], Optional[str]], single_call: Callable[[BaseModel, int], Tuple[str, float]]) -> ResultMatrix:
+  if pack_size < 1:
+    raise ValueError("pack_size must be at least 1.")
+  results = ResultMatrix(len(models), num_items)
+  item_packs = packs([i for i in range(num_items) if packable[i]], group_keys, pack_size)
+  fallbacks = [(model_index, item_index) for model_index in range(len(models)) for item_index in range(num_items) if not packable[item_index]]
+
+  with ThreadPoolExecutor() as executor:
+    future_to_pack = {
+      executor.submit(timed_call, model.call, pack_prompt(pack)): (model_index, pack)
+      for pack in item_packs
+      for model_index, model in enumerate(models)
+    }
+    for future in as_completed(future_to_pack):
+      model_index, pack = future_to_pack[future]
+      try:
+        response, latency = future.result()
+      except Exception:
+        # A failed pack (e.g. a rejected or timed out request) is retried item by item
+        fallbacks.extend((model_index, item_index) for item_index in pack)
+        continue
+      for item_index, output in zip(pack, parse_numbered_lines(response, len(pack))):
+        output = None if output is None else parse_output(item_index, output)
+        if output is not None:
+          # The call's latency is shared by the items in it
+          results.set(model_index, item_index, output, latency / len(pack))
+        else:
+          fallbacks.append((model_index, item_index))
+
+    future_to_item = {executor.submit(single_call, models[model_index], item_index): (model_index, item_index) for model_index, item_index in fallbacks}
+    for future in as_completed(future_to_item):
+      model_index, item_index = future_to_item[future]
+      output, latency = future.result()
+      results.set(model_index, item_index, output, latency)
+
+  return results
+
+def packed_translate(prompts: List[str], src_langs: List[str], tgt_langs: List[str], models: List[BaseModel], pack_size: int = PACK_SIZES['translation']) -> ResultMatrix:
+  if not (len(prompts) == len(src_langs) == len(tgt_langs)):
+    raise ValueError("The lengths of prompts, src_langs, and tgt_langs must be equal.")
+  return run_packed(
+    models, len(prompts), pack_size,
+    packable=["\n" not in prompt and prompt.strip() != "" for prompt in prompts],
+    group_keys=list(zip(src_langs, tgt_langs)),
+    pack_prompt=lambda pack: translation_pack_prompt([prompts[i] for i in pack], src_langs[pack[0]], tgt_langs[pack[0]]),
+    parse_output=lambda item_index, output: output if output.strip() != "" else None,
+    single_call=lambda model, item_index: timed_call(model.translate, prompts[item_index], src_langs[item_index], tgt_langs[item_index]),
+  )
+
+def packed_complete_missing_word(prompts: List[str], models: List[BaseModel], missing_words: List[List[str]], pack_size: int = PACK_SIZES['completion_missing_word']) -> ResultMatrix:
+  if not (len(prompts) == len(missing_words)):
+    raise ValueError("The lengths of prompts and missing_words_list must be equal.")
+  # The answer has to name one of the item's options and is stored as that option, as in logprobs mode
+  def matched_option(item_index: int, output: Optional[str]) -> Optional[str]:
+    option_index = match_option(output, missing_words[item_index])
+    return None if option_index is None else missing_words[item_index][option_index]
+
+  def single_call(model: BaseModel, item_index: int) -> Tuple[Optional[str], float]:
+    # An unpacked answer naming none of the options is kept as written
+    output, latency = timed_call(model.complete_missing_word, prompts[item_index], missing_words[item_index])
+    option = matched_option(item_index, output)
+    return (output if option is None else option), latency
+
+  return run_packed(
+    models, len(prompts), pack_size,
+    packable=["\n" not in prompt and all("\n" not in word and "|" not in word for word in words) for prompt, words in zip(prompts, missing_words)],
+    group_keys=[None] * len(prompts),
+    pack_prompt=lambda pack: missing_word_pack_prompt([prompts[i] for i in pack], [missing_words[i] for i in pack]),
+    parse_output=matched_option,
+    single_call=single_call,
+  )
+
+if __name__ == "__main__":
+  print(parse_numbered_lines("1. I am a student.\n2) I like ice cream.\nSome note\n2. duplicate", 3))
+  print(translation_pack_prompt(["Je suis un etudiant.", "J'aime creme de glace."], "French", "English"))
+  print(missing_word_pack_prompt(["The _ is small.", "_ had terrible nerves recently."], [["garage", "backyard"], ["Justin", "Robert"]]))
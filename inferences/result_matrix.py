@@ -0,0 +1,161 @@
+import threading
+import numpy as np
+from collections.abc import Sequence
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from metrics.tokenized_corpus import pack_strings, unpack_strings
+
+MISSING = -1
+
+class ModelOutputs(Sequence):
+  """Read-only view of one model's outputs, usable wherever a List[str] of predictions is expected."""
+
+  def __init__(self, matrix: "ResultMatrix", model_index: int):
+    self.matrix = matrix
+    self.model_index = model_index
+
+  def __len__(self) -> int:
+    return self.matrix.num_prompts
+
+  def __getitem__(self, prompt_index: Union[int, slice]) -> Union[Optional[str], List[Optional[str]]]:
+    if isinstance(prompt_index, slice):
+      return [self.matrix.output(self.model_index, i) for i in range(*prompt_index.indices(len(self)))]
+    if prompt_index < 0:
+      prompt_index += len(self)
+    if not 0 <= prompt_index < len(self):
+      raise IndexError("prompt index out of range")
+    return self.matrix.output(self.model_index, prompt_index)
+
+  def __iter__(self) -> Iterator[Optional[str]]:
+    strings = self.matrix.strings
+    for string_id in self.matrix.string_ids[self.model_index].tolist():
+      yield None if string_id == MISSING else strings[string_id]
+
+  def __eq__(self, other: object) -> bool:
+    return isinstance(other, Sequence) and list(self) == list(other)
+
+  def __repr__(self) -> str:
+    return repr(self.tolist())
+
+  def tolist(self) -> List[Optional[str]]:
+    return list(self)
+
+  @property
+  def latencies(self) -> np.ndarray:
+    return self.matrix.latencies[self.model_index]
+
+class ResultMatrix:
+  """Outputs of every model on every prompt in dense (models x prompts) arrays.
+
+  Each cell holds an id into a table of interned strings (so identical outputs, common for short
+  answers, are stored once) and the call latency in seconds. `matrix[m]` is a row view of model m,
+  iterating yields the rows in model order, and `matrix[m, p]` is a single output. `pack` turns the
+  string table into one offset-indexed byte buffer for storage or transfer between processes.
+  """
+
+  def __init__(self, num_models: int, num_prompts: int):
+    self.num_models = num_models
+    self.num_prompts = num_prompts
+    self.string_ids = np.full((num_models, num_prompts), MISSING, dtype=np.int32)
+    self.latencies = np.full((num_models, num_prompts), np.nan)
+    self.strings: List[str] = []
+    self._string_ids: Dict[str, int] = {}
+    self._lock = threading.Lock()
+
+  @property
+  def shape(self) -> Tuple[int, int]:
+    return self.num_models, self.num_prompts
+
+  def intern(self, string: str) -> int:
+    string_id = self._string_ids.get(string)
+    if string_id is None:
+      string_id = self._string_ids[string] = len(self.strings)
+      self.strings.append(string)
+    return string_id
+
+  def set(self, model_index: int, prompt_index: int, output: Optional[str], latency: Optional[float] = None) -> None:
+    # Called from inference worker threads
+    with self._lock:
+      self.string_ids[model_index, prompt_index] = MISSING if output is None else self.intern(output)
+      self.latencies[model_index, prompt_index] = np.nan if latency is None else latency
+
+  def output(self, model_index: int, prompt_index: int) -> Optional[str]:
+    string_id = int(self.string_ids[model_index, prompt_index])
+    return None if string_id == MISSING else self.strings[string_id]
+
+  def __len__(self) -> int:
+    return self.num_models
+
+  def __getitem__(self, index: Union[int, Tuple[int, int]]) -> Union[ModelOutputs, Optional[str]]:
+    if isinstance(index, tuple):
+      return self.output(*index)
+    if index < 0:
+      index += self.num_models
+    if not 0 <= index < self.num_models:
+      raise IndexError("model index out of range")
+    return ModelOutputs(self, index)
+
+  def __iter__(self) -> Iterator[ModelOutputs]:
+    for model_index in range(self.num_models):
+      yield ModelOutputs(self, model_index)
+
+  def cells(self) -> Iterator[Tuple[int, int, Optional[str]]]:
+    # (prompt_index, model_index, output) in prompt-major order, as the inference functions used to return them
+    for prompt_index in range(self.num_prompts):
+      for model_index in range(self.num_models):
+        yield prompt_index, model_index, self.output(model_index, prompt_index)
+
+  def tolist(self) -> List[List[Optional[str]]]:
+    return [row.tolist() for row in self]
+
+  def select_models(self, model_indices: Sequence[int]) -> "ResultMatrix":
+    # Shares the string table, and the lock guarding it, so interning on either side stays consistent;
+    # only the id and latency rows are copied
+    selected = ResultMatrix(len(model_indices), self.num_prompts)
+    selected.string_ids = self.string_ids[list(model_indices)]
+    selected.latencies = self.latencies[list(model_indices)]
+    selected.strings = self.strings
+    selected._string_ids = self._string_ids
+    selected._lock = self._lock
+    return selected
+
+  def pack(self) -> Dict[str, np.ndarray]:
+    string_bytes, string_offsets = pack_strings(self.strings)
+    return {'string_ids': self.string_ids, 'latencies': self.latencies, 'string_bytes': string_bytes, 'string_offsets': string_offsets}
+
+  @classmethod
+  def from_packed(cls, packed: Dict[str, np.ndarray]) -> "ResultMatrix":
+    num_models, num_prompts = packed['string_ids'].shape
+    matrix = cls(num_models, num_prompts)
+    matrix.string_ids = np.asarray(packed['string_ids'], dtype=np.int32)
+    matrix.latencies = np.asarray(packed['latencies'], dtype=np.float64)
+    matrix.strings = unpack_strings(packed['string_bytes'], packed['string_offsets'])
+    matrix._string_ids = {string: string_id for string_id, string in enumerate(matrix.strings)}
+    return matrix
+
+  @classmethod
+  def from_lists(cls, models_outputs: Sequence[Sequence[Optional[str]]]) -> "ResultMatrix":
+    matrix = cls(len(models_outputs), len(models_outputs[0]) if len(models_outputs) else 0)
+    for model_index, outputs in enumerate(models_outputs):
+      for prompt_index, output in enumerate(outputs):
+        matrix.set(model_index, prompt_index, output)
+    return matrix
+
+  def __reduce__(self):
+    return (ResultMatrix.from_packed, (self.pack(),))
+
+  def __repr__(self) -> str:
+    return f"ResultMatrix(num_models={self.num_models}, num_prompts={self.num_prompts}, unique_outputs={len(self.strings)})"
+
+if __name__ == "__main__":
+  import pickle
+
+  matrix = ResultMatrix(num_models=2, num_prompts=3)
+  for model_index, outputs in enumerate([["Paris", "Berlin", "Madrid"], ["Paris", "Bonn", "Madrid"]]):
+    for prompt_index, output in enumerate(outputs):
+      matrix.set(model_index, prompt_index, output, latency=0.1 * (prompt_index + 1))
+
+  print(matrix)
+  print(f"Model 1 Outputs: {matrix[1]}, Latencies: {matrix[1].latencies.tolist()}")
+  print(f"Cell (1, 1): {matrix[1, 1]}")
+  print(f"Cells: {list(matrix.cells())}")
+  print(f"Pickled Round Trip Equal: {pickle.loads(pickle.dumps(matrix)).tolist() == matrix.tolist()}")
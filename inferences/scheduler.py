@@ -0,0 +1,74 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from models.base_module import BaseModel
+from inferences.functions import timed_call
+
+class InferenceScheduler:
+  """One thread pool for the model calls of every task, with a cap on concurrent calls per model.
+
+  Calls over a model's cap wait in that model's queue rather than in a pool thread, so a long backlog
+  for one provider never occupies the workers that calls to other providers need.
+  """
+
+  def __init__(self, max_workers: int = 64, max_concurrency_per_model: int = 8):
+    self.executor = ThreadPoolExecutor(max_workers=max_workers)
+    self.max_concurrency_per_model = max_concurrency_per_model
+    self._running: Dict[int, int] = {}
+    self._pending: Dict[int, Deque[Tuple[Future, BaseModel, str, Tuple[Any, ...]]]] = {}
+    self._lock = threading.Lock()
+    self._closed = False
+
+  def submit(self, model: BaseModel, method: str, *args: Any, callback: Optional[Callable[[Future], None]] = None) -> Future:
+    # The future resolves to (output, latency in seconds)
+    future: Future = Future()
+    if callback is not None:
+      future.add_done_callback(callback)
+    with self._lock:
+      if self._closed:
+        raise ValueError("The scheduler is shut down.")
+      key = id(model)
+      if self._running.get(key, 0) < self.max_concurrency_per_model:
+        self._running[key] = self._running.get(key, 0) + 1
+        self._start(future, model, method, args)
+      else:
+        self._pending.setdefault(key, deque()).append((future, model, method, args))
+    return future
+
+  def _start(self, future: Future, model: BaseModel, method: str, args: Tuple[Any, ...]) -> None:
+    self.executor.submit(self._run, future, model, method, args)
+
+  def _run(self, future: Future, model: BaseModel, method: str, args: Tuple[Any, ...]) -> None:
+    try:
+      if future.set_running_or_notify_cancel():
+        try:
+          future.set_result(timed_call(getattr(model, method), *args))
+        except BaseException as exception:
+          future.set_exception(exception)
+    finally:
+      with self._lock:
+        key = id(model)
+        pending = self._pending.get(key)
+        # After shutdown the executor takes no new work; the queued calls were cancelled by `shutdown`
+        if pending and not self._closed:
+          self._start(*pending.popleft())
+        else:
+          self._running[key] -= 1
+
+  def shutdown(self, wait: bool = True) -> None:
+    # Calls already running finish; calls still queued behind a model's cap are cancelled
+    with self._lock:
+      self._closed = True
+      queued = [future for pending in self._pending.values() for future, *_ in pending]
+      self._pending.clear()
+    # Outside the lock, as done callbacks run right away and may call back into the scheduler
+    for future in queued:
+      future.cancel()
+    self.executor.shutdown(wait=wait)
+
+  def __enter__(self) -> "InferenceScheduler":
+    return self
+
+  def __exit__(self, *exc_info: Any) -> None:
+    self.shutdown()
@@ -0,0 +1,198 @@
+import os
+import json
+import mmap
+import hashlib
+import numpy as np
+import pyarrow.dataset as ds
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+from metrics.reference_index import METRICS_CACHE_DIR
+
+# Benchmark files read lazily. A JSONL file is memory-mapped and indexed once by the byte offset of
+# every line (8 bytes per record, cached next to the other preprocessed data), so any record or
+# shard can be decoded on demand. Parquet files are read in record batches through `pyarrow.dataset`.
+# Either way only the records of the current chunk are held as Python objects.
+
+Field = Union[str, Callable[[Dict[str, Any]], Any]]
+
+# Bytes of the file scanned at a time when building a line index
+INDEX_CHUNK_BYTES = 1 << 20
+# Bumped when the index format or the rules for what counts as a record change
+JSONL_INDEX_VERSION = 2
+WHITESPACE_BYTES = np.zeros(256, dtype=bool)
+WHITESPACE_BYTES[list(b" \t\n\r\x0b\x0c")] = True
+
+class JsonlDataset:
+  """Random access to the records of a JSONL file through a memory map and a line offset index."""
+
+  def __init__(self, path: str, cache_dir: Optional[str] = METRICS_CACHE_DIR):
+    self.path = path
+    self._file = open(path, "rb")
+    size = os.fstat(self._file.fileno()).st_size
+    self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+    self.starts, self.ends = self._load_index(cache_dir)
+
+  def _build_index(self) -> np.ndarray:
+    # Scanned in fixed-size chunks, so the temporary arrays stay small however large the file is.
+    # Per line, the number of non-whitespace bytes tells blank and whitespace-only lines (including a
+    # trailing newline at the end of the file) apart from records.
+    newlines, non_blank_before = [], []
+    non_blank = 0
+    for offset in range(0, len(self._mmap), INDEX_CHUNK_BYTES):
+      data = np.frombuffer(self._mmap, dtype=np.uint8, count=min(INDEX_CHUNK_BYTES, len(self._mmap) - offset), offset=offset)
+      counts = non_blank + np.cumsum(~WHITESPACE_BYTES[data], dtype=np.int64)
+      chunk_newlines = np.flatnonzero(data == ord("\n"))
+      newlines.append(chunk_newlines + offset)
+      non_blank_before.append(counts[chunk_newlines])
+      non_blank = int(counts[-1])
+    ends = np.concatenate(newlines + [np.asarray([len(self._mmap)], dtype=np.int64)])
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    counts = np.concatenate(non_blank_before + [np.asarray([non_blank], dtype=np.int64)])
+    keep = np.diff(np.concatenate([[0], counts])) > 0
+    return np.stack([starts[keep], ends[keep]]).astype(np.int64)
+
+  def _load_index(self, cache_dir: Optional[str]):
+    if cache_dir is None:
+      index = self._build_index()
+      return index[0], index[1]
+    stat = os.stat(self.path)
+    key = hashlib.sha256(f"{JSONL_INDEX_VERSION}:{os.path.abspath(self.path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    index_path = os.path.join(cache_dir, "jsonl_indexes", f"{key}.npy")
+    if os.path.exists(index_path):
+      index = np.load(index_path, mmap_mode='r')
+    else:
+      index = self._build_index()
+      os.makedirs(os.path.dirname(index_path), exist_ok=True)
+      temp_path = f"{index_path}.{os.getpid()}.tmp.npy"
+      np.save(temp_path, index)
+      os.replace(temp_path, index_path)
+    return index[0], index[1]
+
+  def __len__(self) -> int:
+    return len(self.starts)
+
+  def __getitem__(self, index: int) -> Dict[str, Any]:
+    return json.loads(self._mmap[int(self.starts[index]):int(self.ends[index])])
+
+  def records(self, indices: Optional[Iterable[int]] = None) -> Iterator[Dict[str, Any]]:
+    for index in (range(len(self)) if indices is None else indices):
+      yield self[index]
+
+  def iter_chunks(self, chunk_size: int, indices: Optional[Sequence[int]] = None) -> Iterator[List[Dict[str, Any]]]:
+    indices = range(len(self)) if indices is None else indices
+    for start in range(0, len(indices), chunk_size):
+      yield [self[index] for index in indices[start:start + chunk_size]]
+
+  def close(self) -> None:
+    if isinstance(self._mmap, mmap.mmap):
+      self._mmap.close()
+    self._file.close()
+
+class ParquetDataset:
+  """Records of a Parquet file (or a directory of them), read in record batches."""
+
+  def __init__(self, path: str, columns: Optional[List[str]] = None):
+    self.path = path
+    self.columns = columns
+    self.dataset = ds.dataset(path, format="parquet")
+    self._num_rows = self.dataset.count_rows()
+
+  def __len__(self) -> int:
+    return self._num_rows
+
+  def __getitem__(self, index: int) -> Dict[str, Any]:
+    return self.dataset.take([index], columns=self.columns).to_pylist()[0]
+
+  def records(self, indices: Optional[Iterable[int]] = None) -> Iterator[Dict[str, Any]]:
+    if indices is not None:
+      for chunk in self.iter_chunks(65536, list(indices)):
+        yield from chunk
+      return
+    for batch in self.dataset.to_batches(columns=self.columns):
+      yield from batch.to_pylist()
+
+  def iter_chunks(self, chunk_size: int, indices: Optional[Sequence[int]] = None) -> Iterator[List[Dict[str, Any]]]:
+    if indices is not None:
+      for start in range(0, len(indices), chunk_size):
+        yield self.dataset.take(list(indices[start:start + chunk_size]), columns=self.columns).to_pylist()
+      return
+    for batch in self.dataset.to_batches(columns=self.columns, batch_size=chunk_size):
+      if batch.num_rows:
+        yield batch.to_pylist()
+
+  def close(self) -> None:
+    pass
+
+def open_dataset(path: str, **kwargs: Any) -> Union[JsonlDataset, ParquetDataset]:
+  if os.path.isdir(path) or path.endswith(".parquet"):
+    return ParquetDataset(path, **kwargs)
+  if path.endswith(".jsonl") or path.endswith(".ndjson"):
+    return JsonlDataset(path, **kwargs)
+  raise ValueError(f"Unsupported dataset file: {path}. Expected .jsonl, .ndjson, .parquet or a directory of Parquet files.")
+
+def shard_indices(num_records: int, num_shards: int, shard_index: int, seed: Optional[int] = None) -> np.ndarray:
+  # Every record lands in exactly one shard. Without a seed shards are strided (record i goes to shard
+  # i % num_shards); with a seed the records are shuffled first, the same way for every shard.
+  if not 0 <= shard_index < num_shards:
+    raise ValueError("shard_index must be between 0 and num_shards - 1.")
+  order = np.arange(num_records) if seed is None else np.random.default_rng(seed).permutation(num_records)
+  return np.sort(order[shard_index::num_shards])
+
+def sample_indices(num_records: int, k: int, seed: int = 0) -> np.ndarray:
+  # Uniform subset of an indexable dataset, sorted so the records are read front to back
+  return np.sort(np.random.default_rng(seed).choice(num_records, size=min(k, num_records), replace=False))
+
+def reservoir_sample(records: Iterable[Any], k: int, seed: int = 0) -> List[Any]:
+  # Uniform sample of k records from a stream of unknown length in one pass and O(k) memory
+  # (Li's Algorithm L, which skips ahead geometrically instead of drawing for every record)
+  rng = np.random.default_rng(seed)
+  iterator = iter(records)
+  reservoir = []
+  for record in iterator:
+    reservoir.append(record)
+    if len(reservoir) == k:
+      break
+  if len(reservoir) < k or k == 0:
+    return reservoir
+
+  weight = np.exp(np.log(rng.random()) / k)
+  while True:
+    skip = int(np.floor(np.log(rng.random()) / np.log1p(-weight)))
+    try:
+      for _ in range(skip):
+        next(iterator)
+      record = next(iterator)
+    except StopIteration:
+      return reservoir
+    reservoir[int(rng.integers(k))] = record
+    weight *= np.exp(np.log(rng.random()) / k)
+
+def chunked_inputs(dataset: Union[JsonlDataset, ParquetDataset], chunk_size: int, indices: Optional[Sequence[int]] = None, **fields: Field) -> Iterator[Dict[str, List[Any]]]:
+  # Keyword arguments for the inference or evaluate_* functions, chunk by chunk. Each field is a record
+  # key or a function of the record, e.g.
+  #   for inputs in chunked_inputs(dataset, 1000, prompts='source', src_langs=lambda r: 'French', tgt_langs=lambda r: 'English'):
+  #     results = translate(models=models, **inputs)
+  for chunk in dataset.iter_chunks(chunk_size, indices):
+    yield {name: [field(record) if callable(field) else record[field] for record in chunk] for name, field in fields.items()}
+
+if __name__ == "__main__":
+  import tempfile
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  directory = tempfile.mkdtemp()
+  records = [{"question": f"What is {i} + {i}?", "answer": str(2 * i)} for i in range(10000)]
+  jsonl_path = os.path.join(directory, "arithmetic.jsonl")
+  with open(jsonl_path, "w") as f:
+    f.write("\n".join(json.dumps(record) for record in records) + "\n")
+  parquet_path = os.path.join(directory, "arithmetic.parquet")
+  pq.write_table(pa.Table.from_pylist(records), parquet_path)
+
+  for dataset in [JsonlDataset(jsonl_path, cache_dir=directory), ParquetDataset(parquet_path)]:
+    print(f"{type(dataset).__name__}: {len(dataset)} Records, Record 1234: {dataset[1234]}")
+    shard = shard_indices(len(dataset), num_shards=4, shard_index=1, seed=0)
+    print(f"Shard 1 Of 4: {len(shard)} Records, First: {dataset[int(shard[0])]}")
+    print(f"Sample: {[dataset[int(i)]['answer'] for i in sample_indices(len(dataset), 5)]}")
+    print(f"Reservoir Sample: {[record['answer'] for record in reservoir_sample(dataset.records(), 5)]}")
+    first_inputs = next(chunked_inputs(dataset, 3, prompts='question', references=lambda record: [record['answer']]))
+    print(f"First Chunk Inputs: {first_inputs}")
+    print()
@@ -1,15 +1,57 @@
-import evaluate
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Tuple
 from pprint import pprint
+from metrics.reference_index import load_reference_index
+from metrics.sample_metrics import ROUGE_TYPES, rouge_sample_scores, rouge_group_scores, bleu_sample_statistics, bleu_group_statistics, bleu_from_totals
+from metrics.metric_cache import MetricCache, cached_samples
+from metrics.reference_search import best_rouge_l_references
+from metrics.truthfulness import truthfulness_sample_scores, TRUTHFULNESS_METRICS
 
-bleu = evaluate.load('bleu')
-rouge = evaluate.load('rouge')
+# BLEU is computed from per-sample statistics against the cached reference index, which gives the same
+# numbers as `evaluate.load('bleu')` without re-tokenizing the references on every call.
+def calc_bleu_score(predictions: List[str], references: List[List[str]], cache: Optional[MetricCache] = None) -> Dict[str, float]:
+  statistics = calc_bleu_sample_statistics(predictions, references, max_order=2, cache=cache)
+  return calc_bleu_score_from_statistics(statistics, max_order=2)
 
-def calc_bleu_score(predictions: List[str], references: List[List[str]]) -> Dict[str, float]:
-  return bleu.compute(predictions=predictions, references=references, max_order = 2)
+# Corpus ROUGE is the mean of the per-sample scores (the point estimate behind the bootstrap of
+# `evaluate`), with or without a cache, so the two paths always agree.
+def calc_rouge_score(predictions: List[str], references: List[List[str]], cache: Optional[MetricCache] = None) -> Dict[str, float]:
+  sample_scores = calc_rouge_sample_scores(predictions, references, cache=cache)
+  return {rouge_type: sum(scores) / len(scores) if scores else 0.0 for rouge_type, scores in sample_scores.items()}
 
-def calc_rouge_score(predictions: List[str], references: List[List[str]]) -> Dict[str, float]:
-  return rouge.compute(predictions=predictions, references=references)
+def calc_rouge_sample_scores(predictions: List[str], references: List[List[str]], cache: Optional[MetricCache] = None) -> Dict[str, List[float]]:
+  index = load_reference_index(references, tokenizer="rouge", max_order=2)
+  if cache is None:
+    return rouge_sample_scores(predictions, index)
+  samples = cached_samples(cache, 'rouge', predictions, references, lambda i: rouge_group_scores(predictions[i], index, i), params={'tokenizer': 'rouge'})
+  return {rouge_type: [sample[rouge_type] for sample in samples] for rouge_type in ROUGE_TYPES}
+
+# Best matching reference (and its ROUGE-L F1) per sample, found through an inverted index instead of scoring every reference
+def calc_best_rouge_l_references(predictions: List[str], references: List[List[str]]) -> Tuple[List[int], List[float]]:
+  index = load_reference_index(references, tokenizer="rouge", max_order=2)
+  return best_rouge_l_references(predictions, index)
+
+def calc_bleu_sample_statistics(predictions: List[str], references: List[List[str]], max_order: int = 2, cache: Optional[MetricCache] = None) -> List[List[int]]:
+  index = load_reference_index(references, tokenizer="13a", max_order=max_order)
+  if cache is None:
+    return bleu_sample_statistics(predictions, index).tolist()
+  return cached_samples(cache, 'bleu_statistics', predictions, references, lambda i: bleu_group_statistics(predictions[i], index, i).tolist(), params={'max_order': max_order, 'tokenizer': '13a'})
+
+def calc_bleu_score_from_statistics(statistics: List[List[int]], max_order: int = 2) -> Dict[str, float]:
+  totals = [sum(column) for column in zip(*statistics)] if statistics else [0] * (2 * max_order + 2)
+  score = bleu_from_totals(totals, max_order=max_order)
+  return {
+    'bleu': float(score['bleu']),
+    'precisions': score['precisions'].tolist(),
+    'brevity_penalty': float(score['brevity_penalty']),
+    'length_ratio': float(score['length_ratio']),
+    'translation_length': int(score['translation_length']),
+    'reference_length': int(score['reference_length']),
+  }
+
+# Per question: best similarity to a true reference minus best similarity to a false reference, for every model at once
+def calc_truthfulness_sample_scores(models_answers: List[List[str]], true_references: List[List[str]], false_references: List[List[str]], metrics: Sequence[str] = TRUTHFULNESS_METRICS) -> Dict[str, List[List[float]]]:
+  sample_scores = truthfulness_sample_scores(models_answers, true_references, false_references, metrics)
+  return {metric: scores.tolist() for metric, scores in sample_scores.items()}
 
 def calc_missing_words_accuracy(predictions: List[str], references: List[List[str]], answers: List[int]) -> Dict[str, float]:
     correct_count = 0
@@ -23,6 +65,10 @@ def calc_missing_words_accuracy(predictions: List[str], references: List[List[st
        'accuracy': accuracy
     }
 
+def calc_missing_words_sample_scores(predictions: List[str], references: List[List[str]], answers: List[int]) -> List[float]:
+    # 1.0 where the prediction is the answer word, so the mean is `calc_missing_words_accuracy`
+    return [float(pred == ref[ans - 1]) for pred, ref, ans in zip(predictions, references, answers)]
+
 if __name__ == "__main__":
   predictions = ["Transformers Transformers are fast plus efficient", 
                 "Good Morning", "I am waiting for new Transformers"]
@@ -40,6 +86,10 @@ if __name__ == "__main__":
   bleu_score = calc_bleu_score(predictions, references)
   rouge_score = calc_rouge_score(predictions, references)
   missing_words_accuracy = calc_missing_words_accuracy(missing_words_predictions, missing_words_references, missing_words_answers)
+  rouge_samples = calc_rouge_sample_scores(predictions, references)
+  metric_cache = MetricCache(":memory:")
+  cached_bleu_score = calc_bleu_score(predictions, references, cache=metric_cache)
+  cached_rouge_score = calc_rouge_score(predictions, references, cache=metric_cache)
 
   print("Predictions:")
   pprint(predictions)
@@ -53,5 +103,14 @@ if __name__ == "__main__":
   print("ROUGE Scores:")
   pprint(rouge_score)
   print()
+  print("Per-Sample ROUGE Scores:")
+  pprint(rouge_samples)
+  print()
+  print("Cached BLEU Scores:")
+  pprint(cached_bleu_score)
+  print()
+  print("Cached ROUGE Scores:")
+  pprint(cached_rouge_score)
+  print()
   print("Missing Words Accuracy:")
   pprint(missing_words_accuracy)
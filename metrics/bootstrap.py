@@ -0,0 +1,77 @@
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+from metrics.sample_metrics import bleu_from_totals
+
+# Paired bootstrap over per-sample scores (Koehn, 2004). Every model is resampled with the same
+# sample indices, and each resample is expressed as a (resamples x samples) count matrix, so the
+# totals of all resamples for all models come out of a single tensor contraction.
+#
+# A per-sample entry is either a scalar (the corpus score is the mean) or a row of additive
+# statistics that an aggregator turns into a corpus score, such as BLEU match counts.
+
+def aggregate_mean(totals: np.ndarray, num_samples: int) -> np.ndarray:
+  return totals / num_samples
+
+def aggregate_bleu_statistics(totals: np.ndarray, num_samples: int, max_order: int = 2) -> np.ndarray:
+  # totals: (models, resamples, statistics) for corpus BLEU
+  return bleu_from_totals(totals, max_order=max_order)['bleu']
+
+DEFAULT_AGGREGATORS: Dict[str, Callable[[np.ndarray, int], np.ndarray]] = {
+  'bleu': aggregate_bleu_statistics,
+}
+
+def resample_counts(num_samples: int, num_resamples: int, seed: int = 0) -> np.ndarray:
+  # counts[b, n] = how many times sample n is drawn in resample b
+  indices = np.random.default_rng(seed).integers(0, num_samples, size=(num_resamples, num_samples))
+  flat_indices = (indices + np.arange(num_resamples)[:, None] * num_samples).ravel()
+  return np.bincount(flat_indices, minlength=num_resamples * num_samples).reshape(num_resamples, num_samples)
+
+def paired_bootstrap(sample_scores: np.ndarray, aggregate: Callable[[np.ndarray, int], np.ndarray] = aggregate_mean, num_resamples: int = 1000, confidence: float = 0.95, seed: int = 0) -> Dict[str, Any]:
+  # sample_scores: (models, samples) or (models, samples, *statistics)
+  sample_scores = np.asarray(sample_scores, dtype=np.float64)
+  num_models, num_samples = sample_scores.shape[:2]
+  statistics_shape = sample_scores.shape[2:]
+  flat_scores = sample_scores.reshape(num_models, num_samples, -1)
+
+  counts = resample_counts(num_samples, num_resamples, seed=seed).astype(np.float64)
+  totals = np.einsum('bn,mnf->mbf', counts, flat_scores).reshape((num_models, num_resamples) + statistics_shape)
+  resampled = aggregate(totals, num_samples)
+  scores = aggregate(flat_scores.sum(axis=1).reshape((num_models, 1) + statistics_shape), num_samples)[:, 0]
+
+  alpha = 1.0 - confidence
+  ci_low = np.percentile(resampled, 100 * alpha / 2, axis=1)
+  ci_high = np.percentile(resampled, 100 * (1 - alpha / 2), axis=1)
+
+  # Two-sided p-value of "model i and model j score the same" for every pair
+  differences = resampled[:, None, :] - resampled[None, :, :]
+  p_values = np.minimum(1.0, 2 * np.minimum((differences <= 0).mean(axis=-1), (differences >= 0).mean(axis=-1)))
+  np.fill_diagonal(p_values, 1.0)
+
+  return {
+    'score': scores.tolist(),
+    'ci_low': ci_low.tolist(),
+    'ci_high': ci_high.tolist(),
+    'p_values': p_values.tolist(),
+    'significant': (p_values < alpha).tolist(),
+  }
+
+def bootstrap_evaluations(sample_evaluations: Dict[str, List[List[Any]]], aggregators: Optional[Dict[str, Callable[[np.ndarray, int], np.ndarray]]] = None, num_resamples: int = 1000, confidence: float = 0.95, seed: int = 0) -> Dict[str, Dict[str, Any]]:
+  # sample_evaluations[metric][model_index][sample_index], as returned by the evaluate_* functions with return_sample_scores=True.
+  # The same seed is used for every metric, so all metrics see the same resamples.
+  aggregators = {**DEFAULT_AGGREGATORS, **(aggregators or {})}
+  return {
+    metric: paired_bootstrap(models_samples, aggregate=aggregators.get(metric, aggregate_mean), num_resamples=num_resamples, confidence=confidence, seed=seed)
+    for metric, models_samples in sample_evaluations.items()
+  }
+
+if __name__ == "__main__":
+  from pprint import pprint
+
+  rng = np.random.default_rng(42)
+  # Three models, 500 samples: the first two are close, the third is clearly worse
+  sample_evaluations = {
+    'rougel': (np.clip(rng.normal([[0.52], [0.51], [0.40]], 0.15, size=(3, 500)), 0, 1)).tolist(),
+    'accuracy': (rng.random((3, 500)) < np.asarray([[0.81], [0.80], [0.70]])).astype(float).tolist(),
+  }
+
+  pprint(bootstrap_evaluations(sample_evaluations, num_resamples=2000))
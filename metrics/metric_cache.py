@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+from metrics.reference_index import METRICS_CACHE_DIR, INDEX_VERSION
+
+class MetricCache:
+  """Per-sample metric values in an embedded SQLite store with least-recently-used eviction.
+
+  Values are keyed by a hash of (metric, parameters, prediction, references), so re-scoring a dataset
+  after a few predictions or references changed only computes the changed samples.
+  """
+
+  def __init__(self, path: Optional[str] = None, max_entries: int = 1_000_000):
+    if path is None:
+      path = os.path.join(METRICS_CACHE_DIR, "metric_cache.sqlite")
+    if path != ":memory:":
+      os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self.path = path
+    self.max_entries = max_entries
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    with self._connection:
+      self._connection.execute("PRAGMA journal_mode=WAL")
+      self._connection.execute("CREATE TABLE IF NOT EXISTS samples (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used INTEGER NOT NULL)")
+      self._connection.execute("CREATE INDEX IF NOT EXISTS samples_last_used ON samples (last_used)")
+    # Kept up to date on writes instead of counting the table each time; other processes writing to the
+    # same file are only seen on reopening, so the bound is approximate when a file is shared
+    self._count = self._connection.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+  def __len__(self) -> int:
+    with self._lock:
+      return self._count
+
+  def get_many(self, keys: Sequence[str]) -> Dict[str, Any]:
+    found = {}
+    now = time.time_ns()
+    with self._lock, self._connection:
+      # SQLite limits the number of bound parameters per statement
+      for start in range(0, len(keys), 500):
+        chunk = list(keys[start:start + 500])
+        placeholders = ",".join("?" * len(chunk))
+        for key, value in self._connection.execute(f"SELECT key, value FROM samples WHERE key IN ({placeholders})", chunk):
+          found[key] = json.loads(value)
+        self._connection.execute(f"UPDATE samples SET last_used = ? WHERE key IN ({placeholders})", [now] + chunk)
+    return found
+
+  def put_many(self, values: Dict[str, Any]) -> None:
+    now = time.time_ns()
+    keys = list(values)
+    with self._lock, self._connection:
+      existing = 0
+      for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        existing += self._connection.execute(f"SELECT COUNT(*) FROM samples WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchone()[0]
+      self._connection.executemany(
+        "INSERT OR REPLACE INTO samples (key, value, last_used) VALUES (?, ?, ?)",
+        [(key, json.dumps(value), now) for key, value in values.items()],
+      )
+      self._count += len(keys) - existing
+      overflow = self._count - self.max_entries
+      if overflow > 0:
+        deleted = self._connection.execute("DELETE FROM samples WHERE key IN (SELECT key FROM samples ORDER BY last_used LIMIT ?)", (overflow,)).rowcount
+        self._count -= deleted
+
+  def clear(self) -> None:
+    with self._lock, self._connection:
+      self._connection.execute("DELETE FROM samples")
+      self._count = 0
+
+  def close(self) -> None:
+    with self._lock:
+      self._connection.close()
+
+def sample_key(metric: str, prediction: str, references: Iterable[str], params: Optional[Dict[str, Any]] = None) -> str:
+  # The index version is part of the key, so bumping it (e.g. for a tokenizer change) invalidates cached values
+  payload = json.dumps([INDEX_VERSION, metric, params or {}, prediction, list(references)], sort_keys=True, ensure_ascii=False)
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def cached_samples(cache: MetricCache, metric: str, predictions: Sequence[str], references: Sequence[Sequence[str]], compute: Callable[[int], Any], params: Optional[Dict[str, Any]] = None) -> List[Any]:
+  # `compute(i)` returns the (JSON serializable) value of sample i; it is only called on cache misses
+  if len(predictions) != len(references):
+    raise ValueError("The lengths of predictions and references must be equal.")
+  keys = [sample_key(metric, prediction, reference_group, params) for prediction, reference_group in zip(predictions, references)]
+  values = cache.get_many(keys)
+  computed = {}
+  for sample_index, key in enumerate(keys):
+    if key not in values and key not in computed:
+      computed[key] = compute(sample_index)
+  if computed:
+    cache.put_many(computed)
+    values.update(computed)
+  return [values[key] for key in keys]
+
+if __name__ == "__main__":
+  cache = MetricCache(":memory:", max_entries=3)
+  predictions = ["Nothing happens", "You get sick", "Fortune cookies originated in China", "Fortune cookies originated in Japan"]
+  references = [["Nothing happens"], ["Nothing happens"], ["Fortune cookies originated in San Francisco"], ["Fortune cookies originated in San Francisco"]]
+  calls = []
+
+  def exact_match(sample_index: int) -> float:
+    calls.append(sample_index)
+    return float(predictions[sample_index] in references[sample_index])
+
+  print(f"First Pass: {cached_samples(cache, 'exact_match', predictions[:2], references[:2], exact_match)}, Computed: {calls}")
+  calls.clear()
+  print(f"Second Pass: {cached_samples(cache, 'exact_match', predictions, references, exact_match)}, Computed: {calls}")
+  print(f"Entries After Eviction: {len(cache)}")
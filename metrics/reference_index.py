@@ -0,0 +1,220 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+from metrics.tokenizers import get_tokenizer
+from metrics.tokenized_corpus import TokenizedCorpus
+
+# Bump whenever the on-disk layout or the tokenizers change, so stale indexes are not picked up
+INDEX_VERSION = 1
+
+METRICS_CACHE_DIR = os.path.expanduser(os.environ.get("METRICS_CACHE_DIR", os.path.join("~", ".cache", "awesome-llm-metrics")))
+
+# Indexes already loaded by this process, keyed by fingerprint
+_loaded_indexes: Dict[str, "ReferenceIndex"] = {}
+
+class ReferenceIndex:
+  """Tokenized references of a dataset together with their n-gram counts.
+
+  For every order n there are two sorted tables:
+  - per reference: `ngram{n}_keys` / `ngram{n}_counts`, reference t spanning `ngram{n}_offsets[t]:ngram{n}_offsets[t + 1]`
+  - per prompt (group of references): `max{n}_keys` / `max{n}_counts` with the highest count of the
+    n-gram in any reference of the group, which is what BLEU clips against.
+  An n-gram is packed into one int64 key as the base `vocab_size + 1` number made of its token ids.
+  """
+
+  def __init__(self, corpus: TokenizedCorpus, tables: Dict[str, np.ndarray], max_order: int, fingerprint: Optional[str] = None):
+    self.corpus = corpus
+    self.tables = tables
+    self.max_order = max_order
+    self.fingerprint = fingerprint
+
+  @property
+  def base(self) -> int:
+    return self.corpus.vocab_size + 1
+
+  @property
+  def num_groups(self) -> int:
+    return self.corpus.num_groups
+
+  def reference_ngrams(self, n: int, text_index: int) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = self.tables[f"ngram{n}_offsets"]
+    start, end = offsets[text_index], offsets[text_index + 1]
+    return self.tables[f"ngram{n}_keys"][start:end], self.tables[f"ngram{n}_counts"][start:end]
+
+  def group_ngrams(self, n: int, group_index: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # N-grams of every reference in the group, with the group-local reference index of each entry
+    first_text, last_text = self.corpus.group_range(group_index)
+    offsets = self.tables[f"ngram{n}_offsets"][first_text:last_text + 1]
+    keys = self.tables[f"ngram{n}_keys"][offsets[0]:offsets[-1]]
+    counts = self.tables[f"ngram{n}_counts"][offsets[0]:offsets[-1]]
+    reference_ids = np.repeat(np.arange(last_text - first_text), np.diff(offsets))
+    return keys, counts, reference_ids
+
+  def group_max_ngrams(self, n: int, group_index: int) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = self.tables[f"max{n}_offsets"]
+    start, end = offsets[group_index], offsets[group_index + 1]
+    return self.tables[f"max{n}_keys"][start:end], self.tables[f"max{n}_counts"][start:end]
+
+  def reference_lengths(self, group_index: int) -> np.ndarray:
+    first_text, last_text = self.corpus.group_range(group_index)
+    return np.diff(self.corpus.offsets[first_text:last_text + 1])
+
+  def reference_lines(self, text_index: int) -> List[np.ndarray]:
+    # Token ids of the non-empty lines of a reference, as ROUGE-Lsum splits them
+    line_offsets = self.tables["line_offsets"]
+    line_starts = self.tables["line_starts"][line_offsets[text_index]:line_offsets[text_index + 1]]
+    return [self.corpus.token_ids[start:end] for start, end in zip(line_starts[:-1], line_starts[1:])]
+
+  def save(self, path: str) -> None:
+    self.corpus.save(os.path.join(path, "corpus"))
+    for name, table in self.tables.items():
+      np.save(os.path.join(path, f"{name}.npy"), table)
+
+  @classmethod
+  def load(cls, path: str, max_order: int, fingerprint: Optional[str] = None) -> "ReferenceIndex":
+    corpus = TokenizedCorpus.load(os.path.join(path, "corpus"), mmap=True)
+    tables = {
+      name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode='r')
+      for name in os.listdir(path) if name.endswith(".npy")
+    }
+    return cls(corpus=corpus, tables=tables, max_order=max_order, fingerprint=fingerprint)
+
+def ngram_keys(token_ids: np.ndarray, n: int, base: int) -> np.ndarray:
+  num_positions = len(token_ids) - n + 1
+  if num_positions <= 0:
+    return np.zeros(0, dtype=np.int64)
+  token_ids = np.asarray(token_ids, dtype=np.int64)
+  keys = np.zeros(num_positions, dtype=np.int64)
+  for k in range(n):
+    keys = keys * base + token_ids[k:k + num_positions]
+  return keys
+
+def reference_fingerprint(references: Sequence[Sequence[str]], tokenizer: str, max_order: int) -> str:
+  digest = hashlib.sha256(f"v{INDEX_VERSION}|{tokenizer}|{max_order}|{len(references)}\n".encode("utf-8"))
+  for reference_group in references:
+    digest.update(f"{len(reference_group)}\n".encode("utf-8"))
+    for reference in reference_group:
+      encoded = reference.encode("utf-8")
+      digest.update(f"{len(encoded)}:".encode("utf-8"))
+      digest.update(encoded)
+  return digest.hexdigest()
+
+def build_reference_index(references: Sequence[Sequence[str]], tokenizer: str = "rouge", max_order: int = 2, fingerprint: Optional[str] = None) -> ReferenceIndex:
+  corpus = TokenizedCorpus.from_groups(references, tokenizer=tokenizer)
+  base = corpus.vocab_size + 1
+  if base ** max_order >= 2 ** 63:
+    raise ValueError(f"Vocabulary of {corpus.vocab_size} tokens is too large to pack {max_order}-grams into int64 keys.")
+
+  token_ids = np.asarray(corpus.token_ids, dtype=np.int64)
+  offsets = np.asarray(corpus.offsets)
+  group_offsets = np.asarray(corpus.group_offsets)
+  tables = {}
+
+  for n in range(1, max_order + 1):
+    keys = ngram_keys(token_ids, n, base)
+    positions = np.arange(len(keys))
+    # Drop the n-grams that run across two references
+    text_ids = np.searchsorted(offsets, positions, side='right') - 1
+    valid = positions + n <= offsets[text_ids + 1]
+    keys, text_ids = keys[valid], text_ids[valid]
+
+    unique_keys, counts, unique_text_ids = count_runs(keys, text_ids)
+    tables[f"ngram{n}_keys"] = unique_keys
+    tables[f"ngram{n}_counts"] = counts
+    tables[f"ngram{n}_offsets"] = _run_offsets(unique_text_ids, len(corpus))
+
+    group_ids = np.searchsorted(group_offsets, unique_text_ids, side='right') - 1
+    order = np.lexsort((unique_keys, group_ids))
+    group_keys, group_counts, group_ids = unique_keys[order], counts[order], group_ids[order]
+    starts = _run_starts(group_keys, group_ids)
+    tables[f"max{n}_keys"] = group_keys[starts]
+    tables[f"max{n}_counts"] = np.maximum.reduceat(group_counts, starts) if len(starts) else group_counts
+    tables[f"max{n}_offsets"] = _run_offsets(group_ids[starts], corpus.num_groups)
+
+  if tokenizer == "rouge":
+    # Line boundaries, for ROUGE-Lsum
+    tokenize = get_tokenizer(tokenizer)
+    line_starts: List[int] = []
+    line_offsets = [0]
+    for text_index, reference in enumerate(reference for reference_group in references for reference in reference_group):
+      position = int(offsets[text_index])
+      for line in reference.split("\n"):
+        if len(line):
+          line_starts.append(position)
+          position += len(tokenize(line))
+      line_starts.append(position)
+      line_offsets.append(len(line_starts))
+    # Each text also records where it ends, so its lines are the consecutive pairs of
+    # line_starts[line_offsets[t]:line_offsets[t + 1]]
+    tables["line_starts"] = np.asarray(line_starts, dtype=np.int64)
+    tables["line_offsets"] = np.asarray(line_offsets, dtype=np.int64)
+
+  return ReferenceIndex(corpus=corpus, tables=tables, max_order=max_order, fingerprint=fingerprint)
+
+def load_reference_index(references: Sequence[Sequence[str]], tokenizer: str = "rouge", max_order: int = 2, cache_dir: Optional[str] = METRICS_CACHE_DIR) -> ReferenceIndex:
+  fingerprint = reference_fingerprint(references, tokenizer, max_order)
+  if fingerprint in _loaded_indexes:
+    return _loaded_indexes[fingerprint]
+
+  if cache_dir is None:
+    index = build_reference_index(references, tokenizer=tokenizer, max_order=max_order, fingerprint=fingerprint)
+  else:
+    path = os.path.join(cache_dir, "reference_indexes", fingerprint)
+    if not os.path.isdir(path):
+      index = build_reference_index(references, tokenizer=tokenizer, max_order=max_order, fingerprint=fingerprint)
+      # Write to a temporary directory first so concurrent runs never see a half written index
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=f".{fingerprint}.")
+      index.save(tmp_path)
+      try:
+        os.rename(tmp_path, path)
+      except OSError:
+        # Another process finished the same index first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    index = ReferenceIndex.load(path, max_order=max_order, fingerprint=fingerprint)
+
+  _loaded_indexes[fingerprint] = index
+  return index
+
+def _run_starts(*columns: np.ndarray) -> np.ndarray:
+  # Start of every run of equal rows in already sorted columns
+  if len(columns[0]) == 0:
+    return np.zeros(0, dtype=np.int64)
+  changed = np.zeros(len(columns[0]), dtype=bool)
+  changed[0] = True
+  for column in columns:
+    changed[1:] |= column[1:] != column[:-1]
+  return np.flatnonzero(changed)
+
+def count_runs(keys: np.ndarray, owners: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  order = np.lexsort((keys, owners))
+  keys, owners = keys[order], owners[order]
+  starts = _run_starts(keys, owners)
+  counts = np.diff(np.append(starts, len(keys))).astype(np.int32)
+  return keys[starts], counts, owners[starts]
+
+def _run_offsets(owners: np.ndarray, num_owners: int) -> np.ndarray:
+  offsets = np.zeros(num_owners + 1, dtype=np.int64)
+  np.cumsum(np.bincount(owners, minlength=num_owners), out=offsets[1:])
+  return offsets
+
+if __name__ == "__main__":
+  import time
+
+  references = [
+    ["Nothing happens", "You eat watermelon seeds", "The watermelon seeds pass through your digestive system", "You will not digest the watermelon seeds", "The watermelon seeds will be excreted", "There is an old wives' tale that watermelons will grow in your stomach, but this is impossible"],
+    ["Fortune cookies originated in San Francisco", "Fortune cookies originated in California", "Fortune cookies originated in the U.S.", "Fortune cookies were made by a San Francisco bakery", "Fortune cookies were made by a Californian bakery", "The precise origin of fortune cookies is unclear", "It is commonly believed that fortune cookies came from China, but they originated in California"],
+  ]
+
+  for attempt in ["First Load", "Second Load"]:
+    _loaded_indexes.clear()
+    start_time = time.perf_counter()
+    index = load_reference_index(references)
+    print(f"{attempt}: {(time.perf_counter() - start_time) * 1000:.2f} ms")
+
+  keys, counts = index.group_max_ngrams(2, 0)
+  print(f"Fingerprint: {index.fingerprint}")
+  print(f"Distinct Bigrams In First Group: {len(keys)}")
@@ -0,0 +1,207 @@
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+from metrics.reference_index import ReferenceIndex, ngram_keys
+
+# Per-sample metrics computed against a ReferenceIndex. They follow `rouge_score` (ROUGE, best
+# reference per rouge type) and the BLEU implementation behind `evaluate.load('bleu')`, but work on
+# token ids so references are never re-tokenized.
+
+ROUGE_TYPES = ('rouge1', 'rouge2', 'rougeL', 'rougeLsum')
+
+def fmeasure(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+  denominator = precision + recall
+  return np.where(denominator > 0, 2 * precision * recall / np.where(denominator > 0, denominator, 1), 0.0)
+
+def count_ngrams(token_ids: np.ndarray, n: int, base: int) -> Tuple[np.ndarray, np.ndarray]:
+  return np.unique(ngram_keys(token_ids, n, base), return_counts=True)
+
+def overlap_per_reference(keys: np.ndarray, counts: np.ndarray, reference_keys: np.ndarray, reference_counts: np.ndarray, reference_ids: np.ndarray, num_references: int) -> np.ndarray:
+  # Sum of min(count in prediction, count in reference) for every reference at once
+  if len(keys) == 0 or len(reference_keys) == 0:
+    return np.zeros(num_references)
+  positions = np.minimum(np.searchsorted(keys, reference_keys), len(keys) - 1)
+  clipped = np.where(keys[positions] == reference_keys, np.minimum(reference_counts, counts[positions]), 0)
+  return np.bincount(reference_ids, weights=clipped, minlength=num_references)
+
+def lcs_length(a: Sequence[int], b: Sequence[int]) -> int:
+  # Bit-parallel LCS (Hyyrö): one big-integer update per token of b instead of a len(a) * len(b) table
+  if len(a) == 0 or len(b) == 0:
+    return 0
+  match_masks: Dict[int, int] = {}
+  for i, token in enumerate(a):
+    match_masks[token] = match_masks.get(token, 0) | (1 << i)
+  mask = (1 << len(a)) - 1
+  v = mask
+  for token in b:
+    u = v & match_masks.get(token, 0)
+    v = ((v + u) | (v - u)) & mask
+  return len(a) - bin(v).count("1")
+
+def lcs_indices(reference: Sequence[int], candidate: Sequence[int]) -> List[int]:
+  # Positions in the reference of one LCS, backtracked the same way as `rouge_score`
+  rows, cols = len(reference), len(candidate)
+  table = [[0] * (cols + 1) for _ in range(rows + 1)]
+  for i in range(1, rows + 1):
+    for j in range(1, cols + 1):
+      if reference[i - 1] == candidate[j - 1]:
+        table[i][j] = table[i - 1][j - 1] + 1
+      else:
+        table[i][j] = max(table[i - 1][j], table[i][j - 1])
+  i, j = rows, cols
+  indices = []
+  while i > 0 and j > 0:
+    if reference[i - 1] == candidate[j - 1]:
+      indices.append(i - 1)
+      i -= 1
+      j -= 1
+    elif table[i][j - 1] > table[i - 1][j]:
+      j -= 1
+    else:
+      i -= 1
+  return indices[::-1]
+
+def summary_level_lcs_fmeasure(reference_lines: List[List[int]], candidate_lines: List[List[int]]) -> float:
+  reference_length = sum(len(line) for line in reference_lines)
+  candidate_length = sum(len(line) for line in candidate_lines)
+  if reference_length == 0 or candidate_length == 0:
+    return 0.0
+  reference_counts = Counter(token for line in reference_lines for token in line)
+  candidate_counts = Counter(token for line in candidate_lines for token in line)
+  hits = 0
+  for reference_line in reference_lines:
+    union = sorted(set().union(*[lcs_indices(reference_line, candidate_line) for candidate_line in candidate_lines]))
+    for token in (reference_line[i] for i in union):
+      if candidate_counts[token] > 0 and reference_counts[token] > 0:
+        hits += 1
+        candidate_counts[token] -= 1
+        reference_counts[token] -= 1
+  return float(fmeasure(np.float64(hits / candidate_length), np.float64(hits / reference_length)))
+
+def rouge_reference_scores(prediction: str, index: ReferenceIndex, group_index: int) -> Dict[str, np.ndarray]:
+  # F-measure of the prediction against every reference of one prompt; a missing (None) prediction scores as empty
+  prediction = prediction or ""
+  prediction_ids = index.corpus.encode(prediction)
+  first_text, last_text = index.corpus.group_range(group_index)
+  num_references = last_text - first_text
+  reference_lengths = index.reference_lengths(group_index)
+  scores = {}
+
+  for n, rouge_type in [(1, 'rouge1'), (2, 'rouge2')]:
+    keys, counts = count_ngrams(prediction_ids, n, index.base)
+    reference_keys, reference_counts, reference_ids = index.group_ngrams(n, group_index)
+    overlap = overlap_per_reference(keys, counts, reference_keys, reference_counts, reference_ids, num_references)
+    precision = overlap / max(len(prediction_ids) - n + 1, 1)
+    recall = overlap / np.maximum(reference_lengths - n + 1, 1)
+    scores[rouge_type] = fmeasure(precision, recall)
+
+  prediction_list = prediction_ids.tolist()
+  lcs = np.asarray([lcs_length(index.corpus.text_ids(text_index).tolist(), prediction_list) for text_index in range(first_text, last_text)], dtype=np.float64)
+  if len(prediction_list) == 0:
+    scores['rougeL'] = np.zeros(num_references)
+  else:
+    scores['rougeL'] = fmeasure(lcs / len(prediction_list), lcs / np.maximum(reference_lengths, 1))
+
+  prediction_lines = [line for line in prediction.split("\n") if len(line)]
+  rouge_lsum = scores['rougeL'].copy()
+  for reference_index, text_index in enumerate(range(first_text, last_text)):
+    reference_lines = index.reference_lines(text_index)
+    # With a single line on both sides the union LCS is just the LCS
+    if len(prediction_lines) > 1 or len(reference_lines) > 1:
+      candidate_lines = [index.corpus.encode(line).tolist() for line in prediction_lines]
+      rouge_lsum[reference_index] = summary_level_lcs_fmeasure([line.tolist() for line in reference_lines], candidate_lines)
+  scores['rougeLsum'] = rouge_lsum
+
+  return scores
+
+def rouge_group_scores(prediction: str, index: ReferenceIndex, group_index: int) -> Dict[str, float]:
+  # Best reference per rouge type, like `rouge_score.RougeScorer.score_multi`
+  reference_scores = rouge_reference_scores(prediction, index, group_index)
+  return {rouge_type: float(scores.max()) if len(scores) else 0.0 for rouge_type, scores in reference_scores.items()}
+
+def rouge_sample_scores(predictions: Sequence[str], index: ReferenceIndex) -> Dict[str, List[float]]:
+  if len(predictions) != index.num_groups:
+    raise ValueError("The lengths of predictions and references must be equal.")
+  sample_scores = {rouge_type: [] for rouge_type in ROUGE_TYPES}
+  for group_index, prediction in enumerate(predictions):
+    group_scores = rouge_group_scores(prediction, index, group_index)
+    for rouge_type in ROUGE_TYPES:
+      sample_scores[rouge_type].append(group_scores[rouge_type])
+  return sample_scores
+
+def bleu_group_statistics(prediction: str, index: ReferenceIndex, group_index: int) -> np.ndarray:
+  # Matches per order, possible matches per order, translation length, reference length
+  max_order = index.max_order
+  statistics = np.zeros(2 * max_order + 2, dtype=np.int64)
+  prediction_ids = index.corpus.encode(prediction)
+  for n in range(1, max_order + 1):
+    keys, counts = count_ngrams(prediction_ids, n, index.base)
+    max_keys, max_counts = index.group_max_ngrams(n, group_index)
+    statistics[n - 1] = int(overlap_per_reference(keys, counts, max_keys, max_counts, np.zeros(len(max_keys), dtype=np.int64), 1)[0])
+    statistics[max_order + n - 1] = max(len(prediction_ids) - n + 1, 0)
+  reference_lengths = index.reference_lengths(group_index)
+  statistics[2 * max_order] = len(prediction_ids)
+  statistics[2 * max_order + 1] = reference_lengths.min() if len(reference_lengths) else 0
+  return statistics
+
+def bleu_sample_statistics(predictions: Sequence[str], index: ReferenceIndex) -> np.ndarray:
+  if len(predictions) != index.num_groups:
+    raise ValueError("The lengths of predictions and references must be equal.")
+  statistics = np.zeros((len(predictions), 2 * index.max_order + 2), dtype=np.int64)
+  for group_index, prediction in enumerate(predictions):
+    statistics[group_index] = bleu_group_statistics(prediction, index, group_index)
+  return statistics
+
+def bleu_from_totals(totals: np.ndarray, max_order: int = 2, smooth: bool = False) -> Dict[str, np.ndarray]:
+  # Works on any leading shape, e.g. one row of summed statistics per model or per bootstrap resample
+  totals = np.asarray(totals, dtype=np.float64)
+  matches = totals[..., :max_order]
+  possible = totals[..., max_order:2 * max_order]
+  translation_length = totals[..., 2 * max_order]
+  reference_length = totals[..., 2 * max_order + 1]
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    if smooth:
+      precisions = (matches + 1.0) / (possible + 1.0)
+    else:
+      precisions = np.where(possible > 0, matches / possible, 0.0)
+    log_precisions = np.log(np.where(precisions > 0, precisions, 1.0))
+    geo_mean = np.where(precisions.min(axis=-1) > 0, np.exp(np.sum((1.0 / max_order) * log_precisions, axis=-1)), 0.0)
+    ratio = np.where(reference_length > 0, translation_length / reference_length, 0.0)
+    brevity_penalty = np.where(ratio > 1.0, 1.0, np.exp(1 - 1.0 / ratio))
+
+  return {
+    'bleu': geo_mean * brevity_penalty,
+    'precisions': precisions,
+    'brevity_penalty': brevity_penalty,
+    'length_ratio': ratio,
+    'translation_length': translation_length,
+    'reference_length': reference_length,
+  }
+
+if __name__ == "__main__":
+  from pprint import pprint
+  from metrics.reference_index import load_reference_index
+
+  predictions = ["Transformers Transformers are fast plus efficient",
+                "Good Morning", "I am waiting for new Transformers"]
+  references = [
+                ["HuggingFace Transformers are quick, efficient and awesome",
+                "Transformers are awesome because they are fast to execute"],
+                ["Good Morning Transformers", "Morning Transformers"],
+                ["People are eagerly waiting for new Transformer models",
+                "People are very excited about new Transformers"]
+  ]
+
+  rouge_index = load_reference_index(references, tokenizer="rouge", max_order=2)
+  bleu_index = load_reference_index(references, tokenizer="13a", max_order=2)
+  statistics = bleu_sample_statistics(predictions, bleu_index)
+
+  print("Per-Sample ROUGE Scores:")
+  pprint(rouge_sample_scores(predictions, rouge_index))
+  print()
+  print("Per-Sample BLEU Statistics:")
+  pprint(statistics.tolist())
+  print()
+  print("Corpus BLEU From Statistics:")
+  pprint({key: value.tolist() for key, value in bleu_from_totals(statistics.sum(axis=0), max_order=2).items()})
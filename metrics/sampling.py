@@ -0,0 +1,49 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Metrics over several sampled outputs per prompt: the spread of a score across samples, the
+# self-consistency (majority vote) answer and the unbiased pass@k estimator of Chen et al. (2021).
+
+def mean_and_variance(scores: Sequence[float]) -> Tuple[float, float]:
+  # Sample variance (ddof=1), 0.0 for a single score
+  values = np.asarray(scores, dtype=np.float64)
+  return float(values.mean()), float(values.var(ddof=1)) if len(values) > 1 else 0.0
+
+def majority_vote(outputs: Sequence[Optional[str]]) -> Optional[str]:
+  # Most frequent output, ignoring case and whitespace; ties go to the one seen first, and it is
+  # returned as first written
+  counts: Dict[str, int] = {}
+  first_seen: Dict[str, str] = {}
+  for output in outputs:
+    if output is None:
+      continue
+    key = " ".join(output.split()).lower()
+    counts[key] = counts.get(key, 0) + 1
+    first_seen.setdefault(key, output)
+  if not counts:
+    return None
+  return first_seen[max(counts, key=counts.get)]
+
+def pass_at_k(num_samples: int, num_correct: int, k: int) -> float:
+  # Probability that at least one of k samples drawn without replacement from num_samples is correct
+  if not 1 <= k <= num_samples:
+    raise ValueError("k must be between 1 and the number of samples.")
+  if num_samples - num_correct < k:
+    return 1.0
+  return float(1.0 - np.prod(1.0 - k / np.arange(num_samples - num_correct + 1, num_samples + 1)))
+
+def pass_at_k_scores(correct: np.ndarray, ks: Sequence[int]) -> Dict[str, List[float]]:
+  # correct is (samples x models x prompts) of 0/1; returns pass@k per model, averaged over prompts
+  correct = np.asarray(correct, dtype=bool)
+  num_samples = correct.shape[0]
+  num_correct = correct.sum(axis=0)
+  return {
+    f'pass@{k}': [float(np.mean([pass_at_k(num_samples, int(c), k) for c in row])) if len(row) else 0.0 for row in num_correct]
+    for k in ks
+  }
+
+if __name__ == "__main__":
+  print(mean_and_variance([0.5, 0.7, 0.6]))
+  print(majority_vote(["Paris", "paris ", "Lyon", None]))
+  print(pass_at_k(10, 3, 1), pass_at_k(10, 3, 5), pass_at_k(10, 0, 5))
+  print(pass_at_k_scores(np.array([[[1, 0], [0, 0]], [[0, 0], [1, 0]], [[1, 1], [0, 0]]]), [1, 3]))
@@ -0,0 +1,45 @@
+import re
+from typing import Callable, Dict, List
+
+# Same behaviour as the default tokenizer of `rouge_score` (used by `evaluate.load('rouge')`):
+# lowercase, drop everything that is not [a-z0-9], split on the gaps.
+ROUGE_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize_rouge(text: str) -> List[str]:
+  return ROUGE_TOKEN_RE.findall(text.lower())
+
+# Same behaviour as `Tokenizer13a`, the default tokenizer of `evaluate.load('bleu')`.
+TOKENIZER_13A_RES = [
+  (re.compile(r"([\{-\~\[-\` -\&\(-\+\:-\@\/])"), r" \1 "),
+  # Period and comma, unless preceded by a digit
+  (re.compile(r"([^0-9])([\.,])"), r"\1 \2 "),
+  # Period and comma, unless followed by a digit
+  (re.compile(r"([\.,])([^0-9])"), r" \1 \2"),
+  # Dash, when preceded by a digit
+  (re.compile(r"([0-9])(-)"), r"\1 \2 "),
+]
+
+def tokenize_13a(text: str) -> List[str]:
+  text = text.replace("<skipped>", "").replace("-\n", "").replace("\n", " ")
+  if "&" in text:
+    text = text.replace("&quot;", '"').replace("&amp;", "&").replace("&lt;", "<").replace("&gt;", ">")
+  text = f" {text} "
+  for pattern, replacement in TOKENIZER_13A_RES:
+    text = pattern.sub(replacement, text)
+  return text.split()
+
+TOKENIZERS: Dict[str, Callable[[str], List[str]]] = {
+  'rouge': tokenize_rouge,
+  '13a': tokenize_13a,
+}
+
+def get_tokenizer(name: str) -> Callable[[str], List[str]]:
+  if name not in TOKENIZERS:
+    raise ValueError(f"Unknown tokenizer '{name}'. Available tokenizers: {', '.join(TOKENIZERS)}.")
+  return TOKENIZERS[name]
+
+if __name__ == "__main__":
+  text = "There is an old wives' tale that watermelons will grow in your stomach, but this is impossible"
+  print(f"Text: {text}")
+  print(f"ROUGE Tokens: {tokenize_rouge(text)}")
+  print(f"13a Tokens: {tokenize_13a(text)}")
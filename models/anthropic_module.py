@@ -2,7 +2,9 @@ import os
 from dotenv import load_dotenv
 from anthropic import Anthropic
 from models.base_module import BaseModel
-from typing import List
+from models.generation import GenerationProfile, DEFAULT_PROFILE, TASK_PROFILES, truncate_at_stop
+from models.prompt_templates import translation_prompt, summarization_prompt, q_and_a_prompt, complete_sentence_prompt, complete_missing_word_prompt
+from typing import List, Optional
 
 load_dotenv()
 
@@ -18,9 +20,17 @@ class AnthropicModel(BaseModel):
   def __str__(self) -> str:
     return f"Anthropic,{self.model}"
 
-  def call(self, prompt: str) -> str:
+  def call(self, prompt: str, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> str:
+    # Marked as a cache breakpoint; prefixes below the model's minimum cacheable length are simply not cached
+    system_blocks = {"system": [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]} if system else {}
+    # max_tokens is required by the API, which also rejects whitespace-only stop sequences; those are applied to the returned text
+    options = {"max_tokens": 1024, **profile.options(stop=None)}
+    stop_sequences = [sequence for sequence in profile.stop or [] if sequence.strip()]
+    if stop_sequences:
+      options["stop_sequences"] = stop_sequences
     message = self.client.messages.create(
-        max_tokens=1024,
+        **options,
+        **system_blocks,
         messages=[
             {
                 "role": "user",
@@ -30,67 +40,28 @@ class AnthropicModel(BaseModel):
         model=self.model,
     )
     
-    return message.content[0].text
+    return truncate_at_stop(message.content[0].text, profile.stop)
   
   def translate(self, prompt: str, src_lang: str, tgt_lang: str) -> str:
-    prompt_template = f"""Instruction:
-- Translate the following text from {src_lang} to {tgt_lang}.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = translation_prompt(prompt, src_lang, tgt_lang)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['translate'])
 
   def summarize(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Summarize the following text.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = summarization_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['summarize'])
 
   def q_and_a(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Provide a definitive answer to the following question.
-- Do not output anything else.
-
-Question:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = q_and_a_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['q_and_a'])
 
   def complete_sentence(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Complete the following sentence.
-- Only output the completion.
-
-Sentence:
-{prompt}
-"""
-
-    return self.call(prompt=prompt_template)
+    system, prompt_template = complete_sentence_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_sentence'])
 
   def complete_missing_word(self, prompt: str, missing_words: List[str]) -> str:
-    newline = "\n"
-    prompt_template = f"""Instruction:
-- Output the most appropriate missing word out of the provided options.
-- Only output the missing word.
-
-Options:
-{newline.join(['- ' + missing_word for missing_word in missing_words])}
+    system, prompt_template = complete_missing_word_prompt(prompt, missing_words)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_missing_word'])
 
-Sentence:
-{prompt}
-"""
-
-    return self.call(prompt=prompt_template)
-  
 if __name__ == "__main__":
   claude_model = AnthropicModel()
 
@@ -1,4 +1,8 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+from models.prompt_templates import TASK_PROMPTS
+from models.generation import GenerationProfile, DEFAULT_PROFILE, TASK_PROFILES
 
 class BaseModel(ABC):
     @abstractmethod
@@ -12,8 +16,8 @@ class BaseModel(ABC):
         pass
 
     @abstractmethod
-    def call(self, prompt: str) -> str:
-        """Make a general call to the model with a prompt."""
+    def call(self, prompt: str, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> str:
+        """Make a general call to the model with a prompt, after an optional system instruction, within the profile's generation limits."""
         pass
 
     @abstractmethod
@@ -40,3 +44,21 @@ class BaseModel(ABC):
     def complete_missing_word(self, prompt: str) -> str:
         """Complete the missing word in the given sentence."""
         pass
+
+    def score_options(self, prompt: str, missing_words: List[str]) -> Optional[List[float]]:
+        """Return the probability of each option as the missing word, or None if the provider has no log probabilities."""
+        return None
+
+    def call_n(self, prompt: str, n: int, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> List[str]:
+        """Return n sampled outputs for one prompt. Without a native multi-candidate parameter, this makes n parallel calls."""
+        if n < 1:
+            raise ValueError("n must be at least 1.")
+        if n == 1:
+            return [self.call(prompt, system, profile)]
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            return list(executor.map(lambda _: self.call(prompt, system, profile), range(n)))
+
+    def sample(self, method: str, n: int, *args: Any) -> List[str]:
+        """Return n outputs of a task method (e.g. "q_and_a") on the same inputs, via call_n."""
+        system, prompt = TASK_PROMPTS[method](*args)
+        return self.call_n(prompt, n, system, TASK_PROFILES[method])
@@ -2,7 +2,9 @@ import os
 from dotenv import load_dotenv
 import cohere
 from models.base_module import BaseModel
-from typing import List
+from models.generation import GenerationProfile, DEFAULT_PROFILE, TASK_PROFILES, truncate_at_stop
+from models.prompt_templates import translation_prompt, summarization_prompt, q_and_a_prompt, complete_sentence_prompt, complete_missing_word_prompt
+from typing import List, Optional
 
 load_dotenv()
 
@@ -13,76 +15,42 @@ class CohereModel(BaseModel):
     self.client = cohere.Client(api_key)
     self.model = model
 
-  def call(self, prompt: str) -> str:
+  def call(self, prompt: str, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> str:
+    # The preamble replaces Cohere's default one and is sent ahead of the message
+    preamble = {"preamble_override": system} if system else {}
+    # The pinned SDK's chat has no stop sequences, so they are applied to the returned text
     completion = self.client.chat(
       model=self.model,
       message=prompt,
+      **preamble,
+      **profile.options(stop=None),
     )
 
-    return completion.text
+    return truncate_at_stop(completion.text, profile.stop)
   
   def __str__(self) -> str:
     return f"Cohere,{self.model}"
 
   def translate(self, prompt: str, src_lang: str, tgt_lang: str) -> str:
-    prompt_template = f"""Instruction:
-- Translate the following text from {src_lang} to {tgt_lang}.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = translation_prompt(prompt, src_lang, tgt_lang)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['translate'])
 
   def summarize(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Summarize the following text.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = summarization_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['summarize'])
 
   def q_and_a(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Provide a definitive answer to the following question.
-- Do not output anything else.
-
-Question:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = q_and_a_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['q_and_a'])
 
   def complete_sentence(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Complete the following sentence.
-- Only output the completion.
-
-Sentence:
-{prompt}
-"""
-
-    return self.call(prompt=prompt_template)
+    system, prompt_template = complete_sentence_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_sentence'])
 
   def complete_missing_word(self, prompt: str, missing_words: List[str]) -> str:
-    newline = "\n"
-    prompt_template = f"""Instruction:
-- Output the most appropriate missing word out of the provided options.
-- Only output the missing word.
-
-Options:
-{newline.join(['- ' + missing_word for missing_word in missing_words])}
+    system, prompt_template = complete_missing_word_prompt(prompt, missing_words)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_missing_word'])
 
-Sentence:
-{prompt}
-"""
-
-    return self.call(prompt=prompt_template)
-  
 # Test Cases
 if __name__ == "__main__":
   cohere_model = CohereModel()
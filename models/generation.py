@@ -0,0 +1,46 @@
+from typing import Any, Dict, List, Optional
+
+# Generation limits per task, so a call only pays for the output the task needs. Fields left as None
+# keep the provider's default. Temperature is unset everywhere so that `BaseModel.call_n` samples
+# still differ; set it (e.g. to 0) on a profile for deterministic runs.
+
+class GenerationProfile:
+  def __init__(self, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None, temperature: Optional[float] = None):
+    self.max_tokens = max_tokens
+    self.stop = stop
+    self.temperature = temperature
+
+  def options(self, max_tokens: str = "max_tokens", stop: Optional[str] = "stop", temperature: str = "temperature") -> Dict[str, Any]:
+    # The fields that are set, as keyword arguments under a provider's parameter names; stop=None
+    # leaves out the stop sequences for providers that have none (see truncate_at_stop)
+    options = {max_tokens: self.max_tokens, temperature: self.temperature}
+    if stop is not None:
+      options[stop] = self.stop
+    return {name: value for name, value in options.items() if value is not None}
+
+  def __repr__(self) -> str:
+    return f"GenerationProfile(max_tokens={self.max_tokens}, stop={self.stop}, temperature={self.temperature})"
+
+DEFAULT_PROFILE = GenerationProfile()
+
+# By BaseModel task method. Translations and summaries grow with the input, so their limits only
+# guard against runaway outputs; answers, completions and missing words are cut short.
+TASK_PROFILES: Dict[str, GenerationProfile] = {
+  'translate': GenerationProfile(max_tokens=1024),
+  'summarize': GenerationProfile(max_tokens=512),
+  'q_and_a': GenerationProfile(max_tokens=256),
+  'complete_sentence': GenerationProfile(max_tokens=128, stop=["\n\n"]),
+  'complete_missing_word': GenerationProfile(max_tokens=16, stop=["\n"]),
+}
+
+def truncate_at_stop(text: str, stop: Optional[List[str]]) -> str:
+  # Client-side stop sequences: the text before the earliest one, as providers return it
+  if not stop or text is None:
+    return text
+  return text[:min((text.find(sequence) for sequence in stop if sequence in text), default=len(text))]
+
+if __name__ == "__main__":
+  for task, profile in TASK_PROFILES.items():
+    print(f"{task}: {profile}")
+  print(TASK_PROFILES['complete_missing_word'].options(max_tokens="max_output_tokens", stop="stop_sequences"))
+  print(repr(truncate_at_stop("garage\nThe garage is the smaller one.", ["\n"])))
@@ -1,8 +1,11 @@
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
+from google.api_core.exceptions import InvalidArgument
 from models.base_module import BaseModel
-from typing import List
+from models.generation import GenerationProfile, DEFAULT_PROFILE, TASK_PROFILES
+from models.prompt_templates import translation_prompt, summarization_prompt, q_and_a_prompt, complete_sentence_prompt, complete_missing_word_prompt
+from typing import List, Optional
 
 load_dotenv()
 
@@ -14,72 +17,48 @@ class GoogleGenerativeAIModel(BaseModel):
     self.client = genai.GenerativeModel(model)
     self.model = model
 
-  def call(self, prompt: str) -> str:
-    response = self.client.generate_content(prompt)
+  def call(self, prompt: str, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> str:
+    # The pinned SDK has no per-request system instruction, so it leads the prompt as a fixed prefix
+    response = self.client.generate_content(f"{system}\n{prompt}" if system else prompt, generation_config=genai.GenerationConfig(**profile.options(max_tokens="max_output_tokens", stop="stop_sequences")))
     return response.text
 
+  def call_n(self, prompt: str, n: int, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> List[str]:
+    # Several candidates from one request. Models limited to one candidate (e.g. gemini-1.0-pro) reject
+    # the request or return fewer, and the rest are made up with single calls.
+    if n < 1:
+      raise ValueError("n must be at least 1.")
+    try:
+      response = self.client.generate_content(f"{system}\n{prompt}" if system else prompt, generation_config=genai.GenerationConfig(candidate_count=n, **profile.options(max_tokens="max_output_tokens", stop="stop_sequences")))
+      outputs = ["".join(part.text for part in candidate.content.parts) for candidate in response.candidates][:n]
+    except InvalidArgument:
+      outputs = []
+    if len(outputs) < n:
+      outputs += super().call_n(prompt, n - len(outputs), system, profile)
+    return outputs
+
   def __str__(self) -> str:
     return f"GoogleGenerativeAI,{self.model}"
 
   def translate(self, prompt: str, src_lang: str, tgt_lang: str) -> str:
-    prompt_template = f"""Instruction:
-- Translate the following text from {src_lang} to {tgt_lang}.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = translation_prompt(prompt, src_lang, tgt_lang)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['translate'])
 
   def summarize(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Summarize the following text.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = summarization_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['summarize'])
 
   def q_and_a(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Provide a definitive answer to the following question.
-- Do not output anything else.
-
-Question:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = q_and_a_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['q_and_a'])
 
   def complete_sentence(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Complete the following sentence.
-- Only output the completion.
-
-Sentence:
-{prompt}
-"""
-
-    return self.call(prompt=prompt_template)
+    system, prompt_template = complete_sentence_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_sentence'])
 
   def complete_missing_word(self, prompt: str, missing_words: List[str]) -> str:
-    newline = "\n"
-    prompt_template = f"""Instruction:
-- Output the most appropriate missing word out of the provided options.
-- Only output the missing word.
-
-Options:
-{newline.join(['- ' + missing_word for missing_word in missing_words])}
-
-Sentence:
-{prompt}
-"""
+    system, prompt_template = complete_missing_word_prompt(prompt, missing_words)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_missing_word'])
 
-    return self.call(prompt=prompt_template)
-  
 # Test Cases
 if __name__ == "__main__":
   gemini_model = GoogleGenerativeAIModel()
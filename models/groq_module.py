@@ -2,7 +2,9 @@ import os
 from dotenv import load_dotenv
 from groq import Groq
 from models.base_module import BaseModel
-from typing import List
+from models.generation import GenerationProfile, DEFAULT_PROFILE, TASK_PROFILES
+from models.prompt_templates import translation_prompt, summarization_prompt, q_and_a_prompt, complete_sentence_prompt, complete_missing_word_prompt
+from typing import List, Optional
 
 load_dotenv()
 
@@ -15,12 +17,14 @@ class GroqModel(BaseModel):
     )
     self.model = model
 
-  def call(self, prompt: str) -> str:
+  def call(self, prompt: str, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> str:
+    messages = [{"role": "system", "content": system}] if system else []
     completion = self.client.chat.completions.create(
         model=self.model,
-        messages=[
+        messages=messages + [
           {"role": "user", "content": prompt},
         ],
+        **profile.options(),
     )
 
     return completion.choices[0].message.content
@@ -29,64 +33,25 @@ class GroqModel(BaseModel):
     return f"Groq,{self.model}"
 
   def translate(self, prompt: str, src_lang: str, tgt_lang: str) -> str:
-    prompt_template = f"""Instruction:
-- Translate the following text from {src_lang} to {tgt_lang}.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = translation_prompt(prompt, src_lang, tgt_lang)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['translate'])
 
   def summarize(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Summarize the following text.
-- Do not output anything else.
-
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = summarization_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['summarize'])
 
   def q_and_a(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Provide a definitive answer to the following question.
-- Do not output anything else.
-
-Question:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = q_and_a_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['q_and_a'])
 
   def complete_sentence(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Complete the following sentence.
-- Only output the completion.
-
-Sentence:
-{prompt}
-"""
-
-    return self.call(prompt=prompt_template)
+    system, prompt_template = complete_sentence_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_sentence'])
 
   def complete_missing_word(self, prompt: str, missing_words: List[str]) -> str:
-    newline = "\n"
-    prompt_template = f"""Instruction:
-- Output the most appropriate missing word out of the provided options.
-- Only output the missing word.
-
-Options:
-{newline.join(['- ' + missing_word for missing_word in missing_words])}
-
-Sentence:
-{prompt}
-"""
+    system, prompt_template = complete_missing_word_prompt(prompt, missing_words)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_missing_word'])
 
-    return self.call(prompt=prompt_template)
-  
 # Test Cases
 if __name__ == "__main__":
   groq_mixtral_model = GroqModel()
@@ -0,0 +1,209 @@
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from models.base_module import BaseModel
+from models.generation import GenerationProfile, DEFAULT_PROFILE, TASK_PROFILES, truncate_at_stop
+from models.prompt_templates import translation_prompt, summarization_prompt, q_and_a_prompt, complete_sentence_prompt, complete_missing_word_prompt
+
+class DynamicBatcher:
+  """Merges concurrent requests into batches processed one at a time on a single worker thread.
+
+  A batch starts with the oldest request and takes every waiting request with the same key (up to
+  max_batch_size), waiting at most max_wait seconds for more to arrive. Requests with different keys,
+  e.g. different generation settings, are never batched together.
+  """
+
+  def __init__(self, process_batch: Callable[[List[Any]], List[Any]], key: Callable[[Any], Hashable] = lambda item: None, max_batch_size: int = 8, max_wait: float = 0.01):
+    if max_batch_size < 1:
+      raise ValueError("max_batch_size must be at least 1.")
+    self.process_batch = process_batch
+    self.key = key
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self.batch_sizes: List[int] = []
+    # Waiting requests by key, each as (arrival number, item, future) in arrival order, so finding and
+    # taking a batch never scans the requests of other keys
+    self._queues: Dict[Hashable, Deque[Tuple[int, Any, Future]]] = {}
+    self._arrivals = itertools.count()
+    self._condition = threading.Condition()
+    self._closed = False
+    self._worker = threading.Thread(target=self._loop, daemon=True)
+    self._worker.start()
+
+  def submit(self, item: Any) -> Future:
+    future: Future = Future()
+    key = self.key(item)
+    with self._condition:
+      if self._closed:
+        raise ValueError("The batcher is closed.")
+      self._queues.setdefault(key, deque()).append((next(self._arrivals), item, future))
+      self._condition.notify_all()
+    return future
+
+  def _next_batch(self) -> List[Tuple[Any, Future]]:
+    with self._condition:
+      while not self._queues and not self._closed:
+        self._condition.wait()
+      if not self._queues:
+        return []
+      # The key of the oldest waiting request; there are only as many queues as distinct settings
+      key = min(self._queues, key=lambda queue_key: self._queues[queue_key][0][0])
+      queue = self._queues[key]
+      deadline = time.monotonic() + self.max_wait
+      while len(queue) < self.max_batch_size and not self._closed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self._condition.wait(remaining)
+      batch = [queue.popleft()[1:] for _ in range(min(len(queue), self.max_batch_size))]
+      if not queue:
+        del self._queues[key]
+      return batch
+
+  def _loop(self) -> None:
+    while True:
+      batch = self._next_batch()
+      if not batch:
+        return
+      batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+      if not batch:
+        continue
+      self.batch_sizes.append(len(batch))
+      try:
+        outputs = self.process_batch([item for item, _ in batch])
+        for (_, future), output in zip(batch, outputs):
+          future.set_result(output)
+      except BaseException as exception:
+        for _, future in batch:
+          if not future.done():
+            future.set_exception(exception)
+
+  def close(self) -> None:
+    # Requests already submitted are still processed
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+    self._worker.join()
+
+class LocalModel(BaseModel):
+  """A causal language model run on CPU with transformers, e.g. a small fine-tuned checkpoint.
+
+  Concurrent calls from the inference thread pools are merged by a DynamicBatcher into padded batches
+  for one `generate` each. Decoding is greedy unless a temperature above 0 is given (by the profile or
+  `temperature`); `call_n` always samples, at temperature 1 unless one is set.
+  """
+
+  def __init__(self, model: str = "sshleifer/tiny-gpt2", max_batch_size: int = 8, max_wait: float = 0.01, max_new_tokens: int = 256, temperature: float = 0.0, model_instance: Optional[Any] = None, tokenizer: Optional[Any] = None):
+    # model_instance and tokenizer take the place of loading `model`, e.g. for an in-memory test model
+    self.model = model
+    self.tokenizer = tokenizer if tokenizer is not None else AutoTokenizer.from_pretrained(model)
+    self.model_instance = model_instance if model_instance is not None else AutoModelForCausalLM.from_pretrained(model)
+    self.model_instance.eval()
+    self.max_new_tokens = max_new_tokens
+    self.temperature = temperature
+    # Left padding, so every row of a batch continues right after its prompt
+    self.tokenizer.padding_side = "left"
+    if self.tokenizer.pad_token is None:
+      self.tokenizer.pad_token = self.tokenizer.eos_token
+    self.batcher = DynamicBatcher(self.generate_batch, key=lambda request: request[1:], max_batch_size=max_batch_size, max_wait=max_wait)
+
+  def __str__(self) -> str:
+    return f"Local,{self.model}"
+
+  def format_prompt(self, prompt: str, system: Optional[str] = None) -> str:
+    if getattr(self.tokenizer, "chat_template", None):
+      messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+      return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    return f"{system}\n{prompt}" if system else prompt
+
+  def generate_batch(self, requests: List[Tuple[str, int, float, int]]) -> List[List[str]]:
+    # requests are (prompt, max new tokens, temperature, number of sequences), the last three shared by the batch
+    _, max_new_tokens, temperature, num_sequences = requests[0]
+    inputs = self.tokenizer([prompt for prompt, *_ in requests], return_tensors="pt", padding=True)
+    sampling = {"do_sample": True, "temperature": temperature} if temperature > 0 else {"do_sample": False}
+    with torch.inference_mode():
+      output_ids = self.model_instance.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        num_return_sequences=num_sequences,
+        pad_token_id=self.tokenizer.pad_token_id,
+        **sampling,
+      )
+    texts = self.tokenizer.batch_decode(output_ids[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+    return [texts[index * num_sequences:(index + 1) * num_sequences] for index in range(len(requests))]
+
+  def generate(self, prompt: str, system: Optional[str], profile: GenerationProfile, n: int, temperature: float) -> List[str]:
+    request = (self.format_prompt(prompt, system), profile.max_tokens or self.max_new_tokens, temperature, n)
+    # Stop sequences are applied to the decoded text
+    return [truncate_at_stop(text.strip(), profile.stop) for text in self.batcher.submit(request).result()]
+
+  def call(self, prompt: str, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> str:
+    temperature = profile.temperature if profile.temperature is not None else self.temperature
+    return self.generate(prompt, system, profile, 1, temperature)[0]
+
+  def call_n(self, prompt: str, n: int, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> List[str]:
+    # All n sequences come from one generate, sharing the prompt's forward pass
+    if n < 1:
+      raise ValueError("n must be at least 1.")
+    temperature = profile.temperature or self.temperature or 1.0
+    return self.generate(prompt, system, profile, n, temperature)
+
+  def translate(self, prompt: str, src_lang: str, tgt_lang: str) -> str:
+    system, prompt_template = translation_prompt(prompt, src_lang, tgt_lang)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['translate'])
+
+  def summarize(self, prompt: str) -> str:
+    system, prompt_template = summarization_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['summarize'])
+
+  def q_and_a(self, prompt: str) -> str:
+    system, prompt_template = q_and_a_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['q_and_a'])
+
+  def complete_sentence(self, prompt: str) -> str:
+    system, prompt_template = complete_sentence_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_sentence'])
+
+  def complete_missing_word(self, prompt: str, missing_words: List[str]) -> str:
+    system, prompt_template = complete_missing_word_prompt(prompt, missing_words)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_missing_word'])
+
+  def close(self) -> None:
+    self.batcher.close()
+
+# Test Cases
+if __name__ == "__main__":
+  # A tiny randomly initialized model with a word-level vocabulary, so nothing is downloaded
+  from tokenizers import Tokenizer
+  from tokenizers.models import WordLevel
+  from tokenizers.pre_tokenizers import Whitespace
+  from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+  from inferences.scheduler import InferenceScheduler
+
+  words = ["[UNK]", "[PAD]", "[EOS]", "Question", ":", "What", "is", "the", "capital", "of", "France", "Germany", "Spain", "?", "Paris", "Berlin", "Madrid", "Instruction", "-", "Provide", "a", "definitive", "answer", "to", "following", "question", ".", "Do", "not", "output", "anything", "else"]
+  word_tokenizer = Tokenizer(WordLevel({word: index for index, word in enumerate(words)}, unk_token="[UNK]"))
+  word_tokenizer.pre_tokenizer = Whitespace()
+  tokenizer = PreTrainedTokenizerFast(tokenizer_object=word_tokenizer, unk_token="[UNK]", pad_token="[PAD]", eos_token="[EOS]")
+  torch.manual_seed(0)
+  tiny_model = GPT2LMHeadModel(GPT2Config(vocab_size=len(words), n_positions=512, n_embd=32, n_layer=2, n_head=2, bos_token_id=2, eos_token_id=2))
+
+  local_model = LocalModel(model="tiny-random-gpt2", model_instance=tiny_model, tokenizer=tokenizer, max_wait=0.05)
+
+  # Model Details
+  print(local_model)
+
+  prompts = ["What is the capital of France?", "What is the capital of Germany?", "What is the capital of Spain?"] * 4
+  # Concurrent calls, as from the pipeline, end up in shared batches
+  with InferenceScheduler(max_concurrency_per_model=8) as scheduler:
+    futures = [scheduler.submit(local_model, 'q_and_a', prompt) for prompt in prompts]
+    for prompt, future in zip(prompts, futures):
+      answer, latency = future.result()
+      print(f"Question: {prompt}\nAnswer: {answer[:60]}\nLatency: {latency:.3f}s")
+  print(f"Samples: {local_model.call_n('What is the capital of France?', 3)}")
+  print(f"Batch Sizes: {local_model.batcher.batch_sizes}")
+  local_model.close()
@@ -2,7 +2,9 @@ import os
 from dotenv import load_dotenv
 from openai import OpenAI
 from models.base_module import BaseModel
-from typing import List
+from models.generation import GenerationProfile, DEFAULT_PROFILE, TASK_PROFILES
+from models.prompt_templates import translation_prompt, summarization_prompt, q_and_a_prompt, complete_sentence_prompt, complete_missing_word_prompt, missing_word_label_prompt, option_probabilities
+from typing import List, Optional
 
 load_dotenv()
 
@@ -18,74 +20,74 @@ class OpenAIModel(BaseModel):
   def __str__(self) -> str:
     return f"OpenAI,{self.model}"
 
-  def call(self, prompt: str) -> str:
+  def call(self, prompt: str, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> str:
+    # The system message comes first, so the shared instructions are the prefix OpenAI caches automatically
+    messages = [{"role": "system", "content": system}] if system else []
     completion = self.client.chat.completions.create(
         model=self.model,
-        messages=[
+        messages=messages + [
           {"role": "user", "content": prompt},
         ],
+        **profile.options(),
     )
 
     return completion.choices[0].message.content
 
-  def translate(self, prompt: str, src_lang: str, tgt_lang: str) -> str:
-    prompt_template = f"""Instruction:
-- Translate the following text from {src_lang} to {tgt_lang}.
-- Do not output anything else.
+  def call_n(self, prompt: str, n: int, system: Optional[str] = None, profile: GenerationProfile = DEFAULT_PROFILE) -> List[str]:
+    # One request with n choices, so the prompt is sent and billed once
+    if n < 1:
+      raise ValueError("n must be at least 1.")
+    messages = [{"role": "system", "content": system}] if system else []
+    completion = self.client.chat.completions.create(
+        model=self.model,
+        messages=messages + [
+          {"role": "user", "content": prompt},
+        ],
+        n=n,
+        **profile.options(),
+    )
 
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    return [choice.message.content for choice in completion.choices]
 
-  def summarize(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Summarize the following text.
-- Do not output anything else.
+  def translate(self, prompt: str, src_lang: str, tgt_lang: str) -> str:
+    system, prompt_template = translation_prompt(prompt, src_lang, tgt_lang)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['translate'])
 
-Text:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+  def summarize(self, prompt: str) -> str:
+    system, prompt_template = summarization_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['summarize'])
 
   def q_and_a(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Provide a definitive answer to the following question.
-- Do not output anything else.
-
-Question:
-{prompt}
-"""
-    
-    return self.call(prompt=prompt_template)
+    system, prompt_template = q_and_a_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['q_and_a'])
 
   def complete_sentence(self, prompt: str) -> str:
-    prompt_template = f"""Instruction:
-- Complete the following sentence.
-- Only output the completion.
-
-Sentence:
-{prompt}
-"""
-
-    return self.call(prompt=prompt_template)
+    system, prompt_template = complete_sentence_prompt(prompt)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_sentence'])
 
   def complete_missing_word(self, prompt: str, missing_words: List[str]) -> str:
-    newline = "\n"
-    prompt_template = f"""Instruction:
-- Output the most appropriate missing word out of the provided options.
-- Only output the missing word.
+    system, prompt_template = complete_missing_word_prompt(prompt, missing_words)
+    return self.call(prompt=prompt_template, system=system, profile=TASK_PROFILES['complete_missing_word'])
 
-Options:
-{newline.join(['- ' + missing_word for missing_word in missing_words])}
-
-Sentence:
-{prompt}
-"""
+  def score_options(self, prompt: str, missing_words: List[str]) -> Optional[List[float]]:
+    # One output token (the option number) and its top alternatives, instead of generating the word
+    system, prompt_template = missing_word_label_prompt(prompt, missing_words)
+    completion = self.client.chat.completions.create(
+        model=self.model,
+        messages=[
+          {"role": "system", "content": system},
+          {"role": "user", "content": prompt_template},
+        ],
+        max_tokens=1,
+        temperature=0,
+        logprobs=True,
+        top_logprobs=min(max(len(missing_words), 5), 20),
+    )
 
-    return self.call(prompt=prompt_template)
+    logprobs = completion.choices[0].logprobs
+    if logprobs is None or not logprobs.content:
+      return None
+    return option_probabilities({top.token: top.logprob for top in logprobs.content[0].top_logprobs}, len(missing_words))
 
 # Test Cases
 if __name__ == "__main__":
@@ -122,3 +124,7 @@ if __name__ == "__main__":
   missing_words = ["garage", "backyard"]
   response = gpt4_model.complete_missing_word(prompt=prompt, missing_words=missing_words)
   print(f"===== Completion - Missing Word =====\nPrompt: {prompt}\nOptions:\n{newline.join(['- ' + missing_word for missing_word in missing_words])}\nMissing Word: {response}\nCombined: {prompt.replace('_', response)}\n")
+
+  # Completion - Missing Word, Option Probabilities
+  probabilities = gpt4_model.score_options(prompt=prompt, missing_words=missing_words)
+  print(f"===== Completion - Missing Word (Log Probabilities) =====\nPrompt: {prompt}\nProbabilities: {dict(zip(missing_words, probabilities or []))}\n")
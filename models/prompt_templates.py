@@ -0,0 +1,106 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+# Prompts of every task as (system, user) pairs. The system part holds the fixed instructions and
+# depends only on the task (and, for translation, the language pair), so across a run it is the same
+# leading block on every request. The adapters send it first, as a system message, system block or
+# preamble, which makes it the prefix that provider-side prompt caching can reuse between calls.
+# Anthropic caches blocks marked with cache_control, and OpenAI-compatible APIs cache repeated
+# prefixes automatically, but both only once the prefix reaches a minimum length (about 1024 tokens),
+# so the short instructions below are cached only when they are extended, e.g. with few-shot examples.
+
+def translation_prompt(prompt: str, src_lang: str, tgt_lang: str) -> Tuple[str, str]:
+  system = f"""Instruction:
+- Translate the following text from {src_lang} to {tgt_lang}.
+- Do not output anything else.
+"""
+  return system, f"""Text:
+{prompt}
+"""
+
+def summarization_prompt(prompt: str) -> Tuple[str, str]:
+  system = """Instruction:
+- Summarize the following text.
+- Do not output anything else.
+"""
+  return system, f"""Text:
+{prompt}
+"""
+
+def q_and_a_prompt(prompt: str) -> Tuple[str, str]:
+  system = """Instruction:
+- Provide a definitive answer to the following question.
+- Do not output anything else.
+"""
+  return system, f"""Question:
+{prompt}
+"""
+
+def complete_sentence_prompt(prompt: str) -> Tuple[str, str]:
+  system = """Instruction:
+- Complete the following sentence.
+- Only output the completion.
+"""
+  return system, f"""Sentence:
+{prompt}
+"""
+
+def complete_missing_word_prompt(prompt: str, missing_words: List[str]) -> Tuple[str, str]:
+  newline = "\n"
+  system = """Instruction:
+- Output the most appropriate missing word out of the provided options.
+- Only output the missing word.
+"""
+  return system, f"""Options:
+{newline.join(['- ' + missing_word for missing_word in missing_words])}
+
+Sentence:
+{prompt}
+"""
+
+# Template of each BaseModel task method, by method name
+TASK_PROMPTS = {
+  'translate': translation_prompt,
+  'summarize': summarization_prompt,
+  'q_and_a': q_and_a_prompt,
+  'complete_sentence': complete_sentence_prompt,
+  'complete_missing_word': complete_missing_word_prompt,
+}
+
+def missing_word_label_prompt(prompt: str, missing_words: List[str]) -> Tuple[str, str]:
+  # Options are numbered so the answer is a single token whose log probability can be read off
+  newline = "\n"
+  system = """Instruction:
+- Output the number of the most appropriate missing word out of the provided options.
+- Only output the number.
+"""
+  return system, f"""Options:
+{newline.join(f'{index}. {missing_word}' for index, missing_word in enumerate(missing_words, 1))}
+
+Sentence:
+{prompt}
+"""
+
+def option_probabilities(top_logprobs: Dict[str, float], num_options: int) -> Optional[List[float]]:
+  # Top log probabilities of the answer token to a probability per option, renormalized over the option
+  # labels; None when no label is among the top tokens
+  label_logprobs: Dict[int, List[float]] = {}
+  for token, logprob in top_logprobs.items():
+    label = token.strip().rstrip(".")
+    if label.isdigit() and 1 <= int(label) <= num_options:
+      label_logprobs.setdefault(int(label) - 1, []).append(logprob)
+  if not label_logprobs:
+    return None
+  # Variants of one label (e.g. "1" and " 1") add up
+  masses = [sum(math.exp(logprob) for logprob in label_logprobs.get(index, [])) for index in range(num_options)]
+  total = sum(masses)
+  return [mass / total for mass in masses]
+
+if __name__ == "__main__":
+  system, user = translation_prompt("Je suis un etudiant.", "French", "English")
+  print(f"===== System =====\n{system}\n===== User =====\n{user}")
+  system, user = complete_missing_word_prompt("The _ is small.", ["garage", "backyard"])
+  print(f"===== System =====\n{system}\n===== User =====\n{user}")
+  system, user = missing_word_label_prompt("The _ is small.", ["garage", "backyard"])
+  print(f"===== System =====\n{system}\n===== User =====\n{user}")
+  print(option_probabilities({"1": -0.1, " 1": -3.0, "2": -2.5, "Garage": -4.0}, 2))
@@ -0,0 +1,55 @@
+import threading
+from typing import Dict, List, Tuple
+from models.base_module import BaseModel
+
+# Model instances keyed by (source, model), shared by everything that runs in this process
+_models: Dict[Tuple[str, str], BaseModel] = {}
+_lock = threading.Lock()
+
+SOURCES = ('openai', 'anthropic', 'cohere', 'groq', 'genai', 'vertexai', 'local')
+
+def build_model(model_detail: Dict[str, str]) -> BaseModel:
+  # Provider SDKs are imported on first use, so only the ones in use need to be installed
+  source = model_detail["source"]
+  if source == "openai":
+    from models.openai_module import OpenAIModel
+    return OpenAIModel(model=model_detail["model"])
+  elif source == "anthropic":
+    from models.anthropic_module import AnthropicModel
+    return AnthropicModel(model=model_detail["model"])
+  elif source == "cohere":
+    from models.cohere_module import CohereModel
+    return CohereModel(model=model_detail["model"])
+  elif source == "groq":
+    from models.groq_module import GroqModel
+    return GroqModel(model=model_detail["model"])
+  elif source == "genai":
+    from models.google_generative_ai_module import GoogleGenerativeAIModel
+    return GoogleGenerativeAIModel(model=model_detail["model"])
+  elif source == "vertexai":
+    from models.google_vertex_ai_module import GoogleVertexAIModel
+    return GoogleVertexAIModel(model=model_detail["model"])
+  elif source == "local":
+    # A transformers checkpoint name or path, run on CPU
+    from models.local_module import LocalModel
+    return LocalModel(model=model_detail["model"])
+  raise ValueError(f"Unknown model source: {source}. Expected one of {', '.join(SOURCES)}.")
+
+def load_model(model_detail: Dict[str, str]) -> BaseModel:
+  key = (model_detail["source"], model_detail["model"])
+  with _lock:
+    if key not in _models:
+      _models[key] = build_model(model_detail)
+    return _models[key]
+
+def register_model(model_detail: Dict[str, str], model: BaseModel) -> None:
+  # An instance built elsewhere (e.g. a stub or a preloaded local model) used for this detail from now on
+  with _lock:
+    _models[(model_detail["source"], model_detail["model"])] = model
+
+def load_models(model_details: List[Dict[str, str]]) -> List[BaseModel]:
+  return [load_model(model_detail) for model_detail in model_details]
+
+def loaded_models() -> List[Tuple[str, str]]:
+  with _lock:
+    return list(_models)
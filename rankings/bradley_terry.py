@@ -0,0 +1,188 @@
+import json
+import math
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+from rankings.functions import rank_scores
+
+# Bradley-Terry: P(model i beats model j) = p_i / (p_i + p_j). Strengths are fitted from a matrix of
+# pairwise win counts with Newton steps on the log-strengths (or the minorization-maximization update
+# of Hunter, 2004), vectorized over all models. Every fit can start from the previous strengths, so
+# adding a night of comparisons or a new model only needs a few iterations instead of a fresh fit.
+
+ELO_SCALE = 400 / math.log(10)
+ELO_BASE = 1000.0
+
+def wins_from_sample_scores(sample_scores: np.ndarray) -> np.ndarray:
+  # sample_scores: (models, samples) -> wins[i, j] = samples where model i scored higher than model j, ties counting half
+  sample_scores = np.asarray(sample_scores, dtype=np.float64)
+  differences = sample_scores[:, None, :] - sample_scores[None, :, :]
+  wins = (differences > 0).sum(axis=-1) + 0.5 * (differences == 0).sum(axis=-1)
+  np.fill_diagonal(wins, 0.0)
+  return wins
+
+def wins_from_comparisons(comparisons: Sequence[Tuple[int, int, float]], num_models: int) -> np.ndarray:
+  # comparisons: (model a, model b, outcome) with outcome 1 if a won, 0 if b won and 0.5 for a tie
+  wins = np.zeros((num_models, num_models))
+  if len(comparisons) == 0:
+    return wins
+  comparisons = np.asarray(comparisons, dtype=np.float64)
+  first, second, outcomes = comparisons[:, 0].astype(np.int64), comparisons[:, 1].astype(np.int64), comparisons[:, 2]
+  np.add.at(wins, (first, second), outcomes)
+  np.add.at(wins, (second, first), 1 - outcomes)
+  return wins
+
+def log_likelihood(wins: np.ndarray, log_strengths: np.ndarray) -> float:
+  differences = log_strengths[:, None] - log_strengths[None, :]
+  return float((wins * -np.logaddexp(0, -differences)).sum())
+
+def _mm_step(wins: np.ndarray, games: np.ndarray, log_strengths: np.ndarray) -> np.ndarray:
+  # Hunter's minorization-maximization update: p_i = wins_i / sum_j games_ij / (p_i + p_j)
+  strengths = np.exp(log_strengths)
+  return np.log(wins.sum(axis=1)) - np.log((games / (strengths[:, None] + strengths[None, :])).sum(axis=1))
+
+def _newton_step(wins: np.ndarray, games: np.ndarray, log_strengths: np.ndarray) -> np.ndarray:
+  # The negative Hessian of the log-likelihood in log-strengths is a graph Laplacian weighted by
+  # games * p_ij * p_ji; adding the all-ones matrix fixes the free shift so the system is solvable
+  num_models = len(log_strengths)
+  probabilities = 1 / (1 + np.exp(log_strengths[None, :] - log_strengths[:, None]))
+  gradient = wins.sum(axis=1) - (games * probabilities).sum(axis=1)
+  weights = games * probabilities * probabilities.T
+  laplacian = np.diag(weights.sum(axis=1)) - weights
+  return log_strengths + np.linalg.solve(laplacian + np.ones((num_models, num_models)) / num_models, gradient)
+
+def fit_bradley_terry(wins: np.ndarray, initial_strengths: Optional[np.ndarray] = None, prior: float = 0.1, method: str = "newton", max_iterations: int = 10000, tolerance: float = 1e-9) -> Tuple[np.ndarray, int]:
+  # `prior` pseudo-wins in both directions between every pair keep the strengths finite when a model
+  # never lost (or never won) and tie together models that were never compared. Newton steps are
+  # halved until the likelihood improves; "mm" uses the slower but monotone MM update instead.
+  # Returns the strengths, normalized to a geometric mean of 1, and the number of iterations used.
+  if method not in ("newton", "mm"):
+    raise ValueError(f"Unknown method: {method}. Expected newton or mm.")
+  wins = np.asarray(wins, dtype=np.float64)
+  num_models = wins.shape[0]
+  if num_models == 0:
+    return np.zeros(0), 0
+  wins = wins + prior * (1 - np.eye(num_models))
+  games = wins + wins.T
+
+  log_strengths = np.zeros(num_models) if initial_strengths is None else np.log(np.asarray(initial_strengths, dtype=np.float64))
+  log_strengths = log_strengths - log_strengths.mean()
+  likelihood = log_likelihood(wins, log_strengths)
+  for iteration in range(1, max_iterations + 1):
+    if method == "mm":
+      updated = _mm_step(wins, games, log_strengths)
+    else:
+      updated = _newton_step(wins, games, log_strengths)
+      while log_likelihood(wins, updated - updated.mean()) < likelihood and np.max(np.abs(updated - log_strengths)) > tolerance:
+        updated = (updated + log_strengths) / 2
+    updated -= updated.mean()
+    converged = np.max(np.abs(updated - log_strengths)) < tolerance
+    log_strengths = updated
+    likelihood = log_likelihood(wins, log_strengths)
+    if converged:
+      break
+  return np.exp(log_strengths), iteration
+
+def elo_ratings(strengths: np.ndarray) -> np.ndarray:
+  return ELO_BASE + ELO_SCALE * np.log(strengths)
+
+def win_probabilities(strengths: np.ndarray) -> np.ndarray:
+  strengths = np.asarray(strengths, dtype=np.float64)
+  return strengths[:, None] / (strengths[:, None] + strengths[None, :])
+
+class BradleyTerryLeaderboard:
+  """Accumulated pairwise wins between named models and their fitted Bradley-Terry strengths."""
+
+  def __init__(self, models: Optional[List[str]] = None, prior: float = 0.1):
+    self.models: List[str] = []
+    self.wins = np.zeros((0, 0))
+    self.strengths = np.zeros(0)
+    self.prior = prior
+    for model in models or []:
+      self.add_model(model)
+
+  def add_model(self, model: str) -> int:
+    if model in self.models:
+      return self.models.index(model)
+    self.models.append(model)
+    wins = np.zeros((len(self.models), len(self.models)))
+    wins[:-1, :-1] = self.wins
+    self.wins = wins
+    # A new model starts at the average strength, so the refit only has to move it
+    self.strengths = np.append(self.strengths, 1.0)
+    return len(self.models) - 1
+
+  def add_comparisons(self, comparisons: Sequence[Tuple[str, str, float]]) -> None:
+    # (model a, model b, outcome) with outcome 1 if a won, 0 if b won and 0.5 for a tie
+    indexed = [(self.add_model(first), self.add_model(second), outcome) for first, second, outcome in comparisons]
+    self.wins += wins_from_comparisons(indexed, len(self.models))
+
+  def add_sample_scores(self, models: List[str], sample_scores: np.ndarray) -> None:
+    # Per-sample scores of several models on the same samples, e.g. a metric from `return_sample_scores=True`
+    indices = [self.add_model(model) for model in models]
+    self.wins[np.ix_(indices, indices)] += wins_from_sample_scores(sample_scores)
+
+  def fit(self, method: str = "newton", max_iterations: int = 10000, tolerance: float = 1e-9) -> int:
+    self.strengths, iterations = fit_bradley_terry(self.wins, initial_strengths=self.strengths, prior=self.prior, method=method, max_iterations=max_iterations, tolerance=tolerance)
+    return iterations
+
+  def ratings(self) -> Dict[str, float]:
+    return dict(zip(self.models, elo_ratings(self.strengths).tolist()))
+
+  def ranks(self) -> List[int]:
+    return rank_scores(self.strengths).tolist()
+
+  def leaderboard(self) -> List[Dict[str, object]]:
+    ratings = elo_ratings(self.strengths)
+    ranks = rank_scores(self.strengths)
+    rows = [{'model': model, 'rating': float(ratings[i]), 'rank': int(ranks[i]), 'comparisons': float(self.wins[i].sum() + self.wins[:, i].sum())} for i, model in enumerate(self.models)]
+    return sorted(rows, key=lambda row: row['rank'])
+
+  def save(self, path: str) -> None:
+    with open(path, "w") as f:
+      json.dump({'models': self.models, 'wins': self.wins.tolist(), 'strengths': self.strengths.tolist(), 'prior': self.prior}, f)
+
+  @classmethod
+  def load(cls, path: str) -> "BradleyTerryLeaderboard":
+    with open(path) as f:
+      state = json.load(f)
+    leaderboard = cls(prior=state['prior'])
+    leaderboard.models = state['models']
+    leaderboard.wins = np.asarray(state['wins'], dtype=np.float64).reshape(len(leaderboard.models), len(leaderboard.models))
+    leaderboard.strengths = np.asarray(state['strengths'], dtype=np.float64)
+    return leaderboard
+
+def rank_models_by_preferences(sample_evaluations: Dict[str, List[List[float]]], weights: Dict[str, float], prior: float = 0.1) -> List[int]:
+  # Bradley-Terry ranking from per-sample wins on every metric, each metric's wins scaled by its weight
+  if not sample_evaluations:
+    raise ValueError("sample_evaluations must contain at least one metric.")
+  wins = sum(weights[metric] * wins_from_sample_scores(scores) for metric, scores in sample_evaluations.items())
+  strengths, _ = fit_bradley_terry(wins, prior=prior)
+  return rank_scores(strengths).tolist()
+
+if __name__ == "__main__":
+  from pprint import pprint
+
+  rng = np.random.default_rng(0)
+  true_ratings = {'gpt-4-0125-preview': 1200, 'claude-3-opus-20240229': 1180, 'command-r': 1000, 'mixtral-8x7b-32768': 1050}
+  names = list(true_ratings)
+
+  def simulate(num_comparisons: int, models: List[str]) -> List[Tuple[str, str, float]]:
+    comparisons = []
+    for _ in range(num_comparisons):
+      first, second = rng.choice(len(models), size=2, replace=False)
+      probability = 1 / (1 + 10 ** ((true_ratings[models[second]] - true_ratings[models[first]]) / 400))
+      comparisons.append((models[first], models[second], float(rng.random() < probability)))
+    return comparisons
+
+  leaderboard = BradleyTerryLeaderboard()
+  leaderboard.add_comparisons(simulate(2000, names))
+  print(f"Initial Fit Iterations: {leaderboard.fit()}")
+  pprint(leaderboard.leaderboard())
+
+  # Next night: more comparisons and a new model, refitted from the previous strengths
+  true_ratings['gemini-1.0-pro'] = 1100
+  names.append('gemini-1.0-pro')
+  leaderboard.add_comparisons(simulate(500, names))
+  print(f"Warm-Started Refit Iterations: {leaderboard.fit()}")
+  pprint(leaderboard.leaderboard())
+  print(f"Refit From Scratch Iterations: {fit_bradley_terry(leaderboard.wins, prior=leaderboard.prior)[1]}, With MM: {fit_bradley_terry(leaderboard.wins, prior=leaderboard.prior, method='mm')[1]}")
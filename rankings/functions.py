@@ -1,29 +1,78 @@
-from typing import Dict, List
+import numpy as np
+from typing import Any, Dict, List
+
+def rank_scores(scores: np.ndarray) -> np.ndarray:
+  # Rank along the last axis, 1 being the highest score and ties sharing the best rank,
+  # i.e. `sorted(scores, reverse=True).index(score) + 1` for every score
+  scores = np.asarray(scores)
+  order = np.argsort(-scores, axis=-1, kind='stable')
+  sorted_scores = np.take_along_axis(scores, order, axis=-1)
+  positions = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+  is_new = np.ones(scores.shape, dtype=bool)
+  is_new[..., 1:] = sorted_scores[..., 1:] != sorted_scores[..., :-1]
+  first_positions = np.maximum.accumulate(np.where(is_new, positions, 0), axis=-1)
+  ranks = np.empty(scores.shape, dtype=np.int64)
+  np.put_along_axis(ranks, order, first_positions + 1, axis=-1)
+  return ranks
+
+def dense_ranks(values: np.ndarray) -> np.ndarray:
+  # Rank along the last axis, 1 being the lowest value and equal values sharing a rank with no gaps
+  values = np.asarray(values)
+  order = np.argsort(values, axis=-1, kind='stable')
+  sorted_values = np.take_along_axis(values, order, axis=-1)
+  is_new = np.ones(values.shape, dtype=np.int64)
+  is_new[..., 1:] = sorted_values[..., 1:] != sorted_values[..., :-1]
+  ranks = np.empty(values.shape, dtype=np.int64)
+  np.put_along_axis(ranks, order, np.cumsum(is_new, axis=-1), axis=-1)
+  return ranks
+
+def weighted_sum_of_ranks(scores: np.ndarray, weights: np.ndarray) -> np.ndarray:
+  # scores: (..., metrics, models), weights: (..., metrics)
+  ranks = rank_scores(scores)
+  weights = np.asarray(weights, dtype=np.float64)
+  total = np.zeros(ranks.shape[:-2] + ranks.shape[-1:])
+  # Metric by metric, so the floating point sums (and therefore ties) match summing in Python
+  for metric_index in range(ranks.shape[-2]):
+    total = total + ranks[..., metric_index, :] * weights[..., metric_index, None]
+  return total
+
+def rank_models_by_score_matrix(scores: np.ndarray, weights: np.ndarray) -> np.ndarray:
+  # Final ranks (1 is best) from a metric x model score matrix and one weight per metric;
+  # leading dimensions are batched, e.g. one score matrix per nightly checkpoint set
+  return dense_ranks(weighted_sum_of_ranks(scores, weights))
 
 def rank_models_by_evaluations(evaluations: Dict[str, List[float]], weights: Dict[str, float]) -> List[int]:
-  # Initialize a list to store the weighted sum of ranks for each index (model)
-  weighted_sum_of_ranks = [0] * len(evaluations[next(iter(evaluations))])
+  if not evaluations:
+    raise ValueError("evaluations must contain at least one metric.")
 
-  # For each metric, rank the models based on their scores, apply the weight, and sum these ranks for each model
-  for metric, scores in evaluations.items():
-      # Rank the models for the current metric (1 is the highest rank)
-      ranks = [sorted(scores, reverse=True).index(score) + 1 for score in scores]
-      # Apply the weight for the current metric and add to the total sum of ranks for each model
-      weighted_ranks = [rank * weights[metric] for rank in ranks]
-      weighted_sum_of_ranks = [sum_rank + weighted_rank for sum_rank, weighted_rank in zip(weighted_sum_of_ranks, weighted_ranks)]
+  metrics = list(evaluations)
+  scores = np.asarray([evaluations[metric] for metric in metrics], dtype=np.float64)
+  metric_weights = np.asarray([weights[metric] for metric in metrics], dtype=np.float64)
 
-  print(weighted_sum_of_ranks)
+  return rank_models_by_score_matrix(scores, metric_weights).tolist()
 
-  # Sort the weighted sums to identify their order
-  sorted_ranks = sorted(set(weighted_sum_of_ranks))
+def significance_ranks(scores: np.ndarray, significant: np.ndarray) -> np.ndarray:
+  # scores: (..., models), significant: (..., models, models) with significant[i, j] when models i and j differ significantly.
+  # A model's rank is 1 + the number of models that beat it significantly, so differences that are not significant tie.
+  scores = np.asarray(scores)
+  beaten_by = (scores[..., None, :] > scores[..., :, None]) & np.asarray(significant, dtype=bool)
+  return beaten_by.sum(axis=-1) + 1
 
-  # Map each unique sum to its rank
-  rank_map = {rank: i + 1 for i, rank in enumerate(sorted_ranks)}
+def rank_models_by_bootstrap(bootstrap_evaluations: Dict[str, Dict[str, Any]], weights: Dict[str, float]) -> List[int]:
+  # Like `rank_models_by_evaluations`, on the output of `metrics.bootstrap.bootstrap_evaluations`
+  if not bootstrap_evaluations:
+    raise ValueError("bootstrap_evaluations must contain at least one metric.")
 
-  # Assign ranks based on the weighted sums (with ties receiving the same rank)
-  final_ranks = [rank_map[sum_rank] for sum_rank in weighted_sum_of_ranks]
+  metrics = list(bootstrap_evaluations)
+  scores = np.asarray([bootstrap_evaluations[metric]['score'] for metric in metrics], dtype=np.float64)
+  significant = np.asarray([bootstrap_evaluations[metric]['significant'] for metric in metrics], dtype=bool)
+  metric_weights = np.asarray([weights[metric] for metric in metrics], dtype=np.float64)
 
-  return final_ranks
+  ranks = significance_ranks(scores, significant)
+  total = np.zeros(scores.shape[-1])
+  for metric_index in range(len(metrics)):
+    total = total + ranks[metric_index] * metric_weights[metric_index]
+  return dense_ranks(total).tolist()
 
 if __name__ == "__main__":
   # Example Models
@@ -58,12 +107,16 @@ if __name__ == "__main__":
   }
 
   model_ranks = rank_models_by_evaluations(evaluations=evaluations, weights=weights)
+  # Same scores, but the first two models are not significantly different on any metric
+  significant = [[False, False, True], [False, False, True], [True, True, False]]
+  significance_model_ranks = rank_models_by_bootstrap({metric: {'score': scores, 'significant': significant} for metric, scores in evaluations.items()}, weights=weights)
 
   for i in range(len(models)):
     models[i]['rank'] = model_ranks[i]
+    models[i]['significance_rank'] = significance_model_ranks[i]
 
   models.sort(key=lambda x: x['rank'])
 
   print("Model Ranks")
   for model in models:
-    print(f"Model: {model['source']}, Model Name: {model['model']}, Rank: {model['rank']}")
+    print(f"Model: {model['source']}, Model Name: {model['model']}, Rank: {model['rank']}, Rank (Significant Differences Only): {model['significance_rank']}")
@@ -0,0 +1,84 @@
+import itertools
+import numpy as np
+from typing import Any, Dict, List, Optional
+from rankings.functions import dense_ranks, weighted_sum_of_ranks
+
+def dirichlet_weights(num_samples: int, num_metrics: int, alpha: float = 1.0, seed: int = 0) -> np.ndarray:
+  # (num_samples, num_metrics) weight vectors drawn uniformly from the simplex when alpha is 1
+  return np.random.default_rng(seed).dirichlet(np.full(num_metrics, alpha), size=num_samples)
+
+def grid_weights(num_metrics: int, steps: int) -> np.ndarray:
+  # Every weight vector on the simplex whose entries are multiples of 1 / steps
+  rows = []
+  for dividers in itertools.combinations(range(steps + num_metrics - 1), num_metrics - 1):
+    bounds = (-1,) + dividers + (steps + num_metrics - 1,)
+    rows.append([bounds[i + 1] - bounds[i] - 1 for i in range(num_metrics)])
+  return np.asarray(rows, dtype=np.float64) / steps
+
+def rank_models_by_weight_batch(scores: np.ndarray, weight_batch: np.ndarray) -> np.ndarray:
+  # scores: (metrics, models), weight_batch: (weight vectors, metrics) -> (weight vectors, models) final ranks
+  # Per-metric ranks do not depend on the weights, so they are computed once for the whole batch
+  return dense_ranks(weighted_sum_of_ranks(np.asarray(scores)[None], weight_batch))
+
+def analyze_weight_sensitivity(evaluations: Dict[str, List[float]], weight_batch: np.ndarray, baseline_weights: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+  # weight_batch columns follow the order of the metrics in `evaluations`
+  metrics = list(evaluations)
+  scores = np.asarray([evaluations[metric] for metric in metrics], dtype=np.float64)
+  weight_batch = np.asarray(weight_batch, dtype=np.float64)
+  if weight_batch.ndim != 2 or weight_batch.shape[1] != len(metrics):
+    raise ValueError(f"weight_batch must have one column per metric ({', '.join(metrics)}).")
+
+  ranks = rank_models_by_weight_batch(scores, weight_batch)
+  num_models = scores.shape[1]
+  # rank_distribution[m][r - 1] is the share of weight vectors that put model m at rank r
+  rank_distribution = np.stack([(ranks == rank).mean(axis=0) for rank in range(1, num_models + 1)], axis=1)
+
+  sensitivity = {
+    'metrics': metrics,
+    'num_weight_vectors': len(weight_batch),
+    'mean_rank': ranks.mean(axis=0).tolist(),
+    'std_rank': ranks.std(axis=0).tolist(),
+    'min_rank': ranks.min(axis=0).tolist(),
+    'max_rank': ranks.max(axis=0).tolist(),
+    'top_1_share': rank_distribution[:, 0].tolist(),
+    'rank_distribution': rank_distribution.tolist(),
+  }
+
+  if baseline_weights is not None:
+    baseline_ranks = rank_models_by_weight_batch(scores, np.asarray([[baseline_weights[metric] for metric in metrics]]))[0]
+    # Spearman correlation of every ranking in the batch with the baseline ranking
+    centered = ranks - ranks.mean(axis=1, keepdims=True)
+    centered_baseline = baseline_ranks - baseline_ranks.mean()
+    denominator = np.sqrt((centered ** 2).sum(axis=1) * (centered_baseline ** 2).sum())
+    correlations = np.where(denominator > 0, (centered * centered_baseline).sum(axis=1) / np.where(denominator > 0, denominator, 1), 1.0)
+    sensitivity['baseline_ranks'] = baseline_ranks.tolist()
+    sensitivity['baseline_agreement'] = float((ranks == baseline_ranks).all(axis=1).mean())
+    sensitivity['rank_changed_share'] = (ranks != baseline_ranks).mean(axis=0).tolist()
+    sensitivity['mean_spearman_to_baseline'] = float(correlations.mean())
+    sensitivity['min_spearman_to_baseline'] = float(correlations.min())
+
+  return sensitivity
+
+if __name__ == "__main__":
+  from pprint import pprint
+
+  evaluations = {
+    'bleu': [0.35, 0.5, 0.65],
+    'rouge1': [0.6, 0.7, 0.45],
+    'rouge2': [0.35, 0.3, 0.25],
+    'rougel': [0.4, 0.5, 0.3],
+    'rougelsum': [-0.1, 0.2, -0.05],
+  }
+  weights = {
+    'bleu': 1.0,
+    'rouge1': 0.25,
+    'rouge2': 0.25,
+    'rougel': 0.25,
+    'rougelsum': 0.25,
+  }
+
+  print("Dirichlet Samples:")
+  pprint(analyze_weight_sensitivity(evaluations, dirichlet_weights(10000, len(evaluations)), baseline_weights=weights))
+  print()
+  print("Simplex Grid:")
+  pprint(analyze_weight_sensitivity(evaluations, grid_weights(len(evaluations), steps=8), baseline_weights=weights))